@@ -0,0 +1,370 @@
+import re
+import json
+import asyncio
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from database.database_interface import DatabaseInterface
+from services.google_sheet_client import GoogleSheetClient
+from services.sheet_scheduler import SheetScheduler
+
+# fake data vocabulary
+CATEGORIES = ['Spesa', 'Ristorante', 'Trasporti', 'Casa', 'Svago', 'Salute']
+PAYMENT_METHODS = ['Contanti', 'Carta', 'Bonifico']
+
+# a fake transaction as returned by the model
+def fake_transaction(index: int) -> dict:
+    return {
+        'date': (datetime.today() - timedelta(days=index % 30)).strftime('%d/%m/%Y'),
+        'payment_method': PAYMENT_METHODS[index % len(PAYMENT_METHODS)],
+        'category': CATEGORIES[index % len(CATEGORIES)],
+        'amount': -round(1 + (index * 7.31) % 200, 2),
+        'note': f'bench {index % 100}'
+    }
+
+# a fake items sheet row (B:G)
+def fake_sheet_row(index: int) -> list:
+    transaction = fake_transaction(index)
+    return [transaction['date'], transaction['payment_method'], transaction['category'], transaction['note'], transaction['amount'], 'FROM API']
+
+class OpenAIStub:
+    """
+    OpenAI compatible /v1/chat/completions server answering canned JSON after a fixed latency
+    """
+    def __init__(self, latency=0.05, transactions=1):
+        """
+        Starts the stub on a free local port
+        Args:
+            latency (float): Seconds waited before each answer
+            transactions (int): Transactions returned per completion
+        """
+        self.latency = latency
+        self.transactions = transactions
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests += 1
+                time.sleep(stub.latency)
+                body = json.dumps(stub.completion()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, name='openai-stub', daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+
+    def completion(self):
+        """
+        Builds a chat completion holding the canned transactions
+        Returns:
+            dict: The completion body
+        """
+        content = {
+            'action': 'generate_trans',
+            'transactions': [fake_transaction(index) for index in range(self.transactions)]
+        }
+        return {
+            'id': f'chatcmpl-bench-{random.getrandbits(64):x}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'bench-model',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': json.dumps(content)}}],
+            'usage': {'prompt_tokens': 300, 'completion_tokens': 40 * self.transactions, 'total_tokens': 300 + 40 * self.transactions}
+        }
+
+    def close(self):
+        self.server.shutdown()
+
+class FakeSheetRequest:
+    """
+    A prepared Sheets request (executed by GoogleSheetClient.execute like the real HttpRequest)
+    """
+    def __init__(self, sheets, method_id, func, **kwargs):
+        self.sheets = sheets
+        self.methodId = method_id
+        self.func = func
+        self.kwargs = kwargs
+        # what the scheduler keys single-flight reads on
+        self.method = 'GET' if method_id.endswith('.get') else 'POST'
+        self.uri = f"{method_id}?spreadsheetId={kwargs.get('spreadsheetId')}&range={kwargs.get('range')}"
+        self.body = json.dumps(kwargs.get('body'), sort_keys=True) if 'body' in kwargs else None
+
+    def execute(self, http=None, num_retries=0):
+        time.sleep(self.sheets.latency)
+        with self.sheets.lock:
+            self.sheets.calls[self.methodId] = self.sheets.calls.get(self.methodId, 0) + 1
+            return self.func(**self.kwargs)
+
+class FakeSheets:
+    """
+    In-memory Sheets values API (get/update/append/batchUpdate) and grid properties over grids of rows starting at column A
+    """
+    # A1 range: sheet!B2:G10, sheet!B:G, sheet!B2:G
+    RANGE_PATTERN = re.compile(r'^(?P<sheet>[^!]+)!(?P<c1>[A-Z]+)(?P<r1>\d*)(?::(?P<c2>[A-Z]+)(?P<r2>\d*))?$')
+
+    def __init__(self, latency=0.02):
+        """
+        Initializes empty grids
+        Args:
+            latency (float): Seconds waited per request
+        """
+        self.latency = latency
+        self.grids = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def load_items(self, count):
+        """
+        Fills the items sheet with a header and count rows, and the dashboard/utils sheets
+        Args:
+            count (int): The number of transactions
+        """
+        header = ['', 'Data', 'Metodo', 'Categoria', 'Note', 'Totale', '']
+        self.grids['items'] = [header] + [[''] + fake_sheet_row(index) for index in range(count)]
+        self.grids['dashboard'] = [[], [], *[['', name, f'{1000 + index * 10},00 €'] for index, name in enumerate(PAYMENT_METHODS + ['Totale'])]]
+        self.grids['utils'] = [['Categorie', '', 'Metodi']] + [[category, '', method] for category, method in zip(CATEGORIES, PAYMENT_METHODS + [''] * len(CATEGORIES))]
+
+    @staticmethod
+    def column_index(letters):
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - 64
+        return index - 1
+
+    @staticmethod
+    def column_letters(index):
+        letters = ''
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            letters = chr(65 + remainder) + letters
+        return letters
+
+    def parse_range(self, range_name):
+        match = self.RANGE_PATTERN.match(range_name)
+        grid = self.grids.setdefault(match.group('sheet'), [])
+        c1 = self.column_index(match.group('c1'))
+        c2 = self.column_index(match.group('c2') or match.group('c1'))
+        r1 = int(match.group('r1')) if match.group('r1') else 1
+        r2 = int(match.group('r2')) if match.group('r2') else None
+        return match.group('sheet'), grid, c1, c2, r1, r2
+
+    def get(self, spreadsheetId=None, range=None):
+        sheet, grid, c1, c2, r1, r2 = self.parse_range(range)
+        rows = [row[c1:c2 + 1] for row in grid[r1 - 1:r2]]
+        # the API drops trailing empty cells and rows
+        rows = [row[:max([i + 1 for i, value in enumerate(row) if value not in ('', None)] or [0])] for row in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return {'range': range, 'values': rows} if rows else {'range': range}
+
+    def metadata(self, spreadsheetId=None, fields=None):
+        # new sheets have 1000 rows, appends grow the grid
+        return {'sheets': [{'properties': {'title': sheet, 'gridProperties': {'rowCount': max(len(grid), 1000)}}} for sheet, grid in self.grids.items()]}
+
+    def write_values(self, range_name, values):
+        sheet, grid, c1, c2, r1, r2 = self.parse_range(range_name)
+        for offset, row in enumerate(values):
+            index = r1 - 1 + offset
+            while len(grid) <= index:
+                grid.append([])
+            target = grid[index]
+            while len(target) < c1 + len(row):
+                target.append('')
+            target[c1:c1 + len(row)] = row
+        return len(values)
+
+    def update(self, spreadsheetId=None, range=None, valueInputOption=None, body=None):
+        return {'updatedRows': self.write_values(range, body['values'])}
+
+    def batch_update(self, spreadsheetId=None, body=None):
+        responses = [{'updatedRange': data['range'], 'updatedRows': self.write_values(data['range'], data['values'])} for data in body['data']]
+        return {'totalUpdatedRows': sum(response['updatedRows'] for response in responses), 'responses': responses}
+
+    def append(self, spreadsheetId=None, range=None, valueInputOption=None, insertDataOption=None, body=None):
+        sheet, grid, c1, c2, r1, r2 = self.parse_range(range)
+        # the table ends at the last row with a value in the range columns
+        last = len(grid)
+        while last and not any(value not in ('', None) for value in grid[last - 1][c1:c2 + 1]):
+            last -= 1
+        first = last + 1
+        self.write_values(f'{sheet}!{self.column_letters(c1)}{first}', body['values'])
+        end = first + len(body['values']) - 1
+        return {'updates': {'updatedRange': f'{sheet}!{self.column_letters(c1)}{first}:{self.column_letters(c2)}{end}', 'updatedRows': len(body['values'])}}
+
+class FakeValuesResource:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def get(self, **kwargs):
+        return FakeSheetRequest(self.sheets, 'sheets.spreadsheets.values.get', self.sheets.get, **kwargs)
+
+    def update(self, **kwargs):
+        return FakeSheetRequest(self.sheets, 'sheets.spreadsheets.values.update', self.sheets.update, **kwargs)
+
+    def append(self, **kwargs):
+        return FakeSheetRequest(self.sheets, 'sheets.spreadsheets.values.append', self.sheets.append, **kwargs)
+
+    def batchUpdate(self, **kwargs):
+        return FakeSheetRequest(self.sheets, 'sheets.spreadsheets.values.batchUpdate', self.sheets.batch_update, **kwargs)
+
+class FakeSpreadsheetsResource:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def values(self):
+        return FakeValuesResource(self.sheets)
+
+    def get(self, **kwargs):
+        return FakeSheetRequest(self.sheets, 'sheets.spreadsheets.get', self.sheets.metadata, **kwargs)
+
+class FakeSheetClient(GoogleSheetClient):
+    """
+    GoogleSheetClient over FakeSheets: no credentials, execute() is the real one
+    """
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        # the quota would measure Google's limits, not the bot
+        self.scheduler = SheetScheduler(0, 0)
+
+    def refresh_token(self):
+        pass
+
+    def http(self):
+        return None
+
+    def spreadsheets(self):
+        return FakeSpreadsheetsResource(self.sheets)
+
+class FakeDatabase(DatabaseInterface):
+    """
+    In-memory DatabaseInterface with a fixed latency per round trip
+    """
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.tables = {}
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+    def _round_trip(self):
+        time.sleep(self.latency)
+        self.round_trips += 1
+
+    def insert(self, table_name, data):
+        return self.insert_many([(table_name, [data])])
+
+    def bulk_insert(self, table_name, rows):
+        return self.insert_many([(table_name, rows)])
+
+    def insert_many(self, batches):
+        self._round_trip()
+        with self.lock:
+            for table_name, rows in batches:
+                self.tables.setdefault(table_name, []).extend(dict(row) for row in rows)
+        return sum(len(rows) for _, rows in batches)
+
+    def update(self, table_name, data, match):
+        self._round_trip()
+        count = 0
+        with self.lock:
+            for row in self.tables.get(table_name, []):
+                if all(row.get(key) == value for key, value in match.items()):
+                    row.update(data)
+                    count += 1
+        return count
+
+    def delete(self, table_name, match):
+        self._round_trip()
+        with self.lock:
+            rows = self.tables.get(table_name, [])
+            kept = [row for row in rows if not all(row.get(key) == value for key, value in match.items())]
+            self.tables[table_name] = kept
+        return len(rows) - len(kept)
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeMessage:
+    """
+    Telegram message double recording the bot answers
+    """
+    def __init__(self, driver, chat_id, text=None, user_id=None):
+        self.driver = driver
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = FakeUser(user_id)
+
+    async def reply_text(self, text, **kwargs):
+        await self.driver.api_call('sendMessage')
+        return FakeMessage(self.driver, self.chat_id, text)
+
+    async def edit_text(self, text, **kwargs):
+        await self.driver.api_call('editMessageText')
+        self.text = text
+        return self
+
+class FakeBot:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def send_document(self, chat_id=None, document=None, filename=None, **kwargs):
+        await self.driver.api_call('sendDocument')
+        # the real bot uploads the whole file
+        document.read()
+
+    async def get_my_commands(self):
+        return []
+
+class FakeUpdate:
+    def __init__(self, message):
+        self.message = message
+        self.effective_chat = None
+
+class FakeContext:
+    def __init__(self, bot, args=None):
+        self.bot = bot
+        self.args = args or []
+
+class TelegramDriver:
+    """
+    Builds updates for the bot handlers and counts the Telegram API calls they make
+    """
+    def __init__(self, user_id, latency=0.01):
+        """
+        Args:
+            user_id (int): The authorized user id
+            latency (float): Seconds per Telegram API call
+        """
+        self.user_id = user_id
+        self.latency = latency
+        self.calls = {}
+        self.bot = FakeBot(self)
+
+    async def api_call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    def update(self, text, chat_id=1):
+        return FakeUpdate(FakeMessage(self, chat_id, text, self.user_id))
+
+    def context(self, args=None):
+        return FakeContext(self.bot, args)
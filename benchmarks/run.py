@@ -0,0 +1,261 @@
+"""
+Offline benchmarks of the bot hot paths against in-process stand-ins for OpenAI, Sheets, the database and Telegram
+
+Usage (from the repository root):
+    python benchmarks/run.py                   run every scenario and compare with benchmarks/baseline.json
+    python benchmarks/run.py --quick           skip the 100k rows and 50 chats scenarios
+    python benchmarks/run.py --only export     run the scenarios whose name contains "export"
+    python benchmarks/run.py --save-baseline   store the results as the new baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bot resolves src/lang, src/config... from the repository root
+os.chdir(ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# fake credentials: nothing leaves the process
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYmVuY2gifQ.bench')
+os.environ['OPENAI_API_KEY'] = 'bench'
+os.environ['SPREADSHEET_ID'] = 'bench'
+os.environ['TELEGRAM_USER_ID'] = '1'
+
+from fakes import OpenAIStub, FakeSheets, FakeSheetClient, FakeDatabase, TelegramDriver, fake_sheet_row, fake_transaction
+
+# default baseline file
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+class Bench:
+    """
+    Wires the bot module to the fakes, one fresh environment per scenario
+    """
+    def __init__(self, args):
+        self.args = args
+        self.stub = OpenAIStub(args.openai_latency)
+        os.environ['OPENAI_BASE_URL'] = self.stub.base_url
+
+        import bot
+        import helper
+        from services.response_cache import ResponseCache
+        from services.tenants import Tenant
+        self.bot = bot
+        # measure the LLM path: identical bench messages would all be cache hits
+        ResponseCache.get = classmethod(lambda cls: None)
+        # the scenarios decide when the local store is backfilled
+        Tenant.backfill = lambda tenant: None
+        bot.trans = helper.load_translations(helper.config('general.lang'))
+        # the bot warms the backends up in background after startup
+        from services.open_ai_service import OpenAIService
+        OpenAIService.warm_up()
+
+    def setup(self, rows=1000, transactions=1):
+        """
+        Resets the fakes and the bot singletons
+        Args:
+            rows (int): Transactions in the items sheet
+            transactions (int): Transactions returned by each completion
+        """
+        from database.journal import Journal
+        from database.local_store import LocalStore
+        from services.google_sheet_client import GoogleSheetClient
+        from services.reference_data import ReferenceData
+        from services.balance_cache import BalanceCache
+        from services.write_behind import WriteBehind
+        from services.tenants import TenantRegistry
+        from services.reply_service import TelegramSender, TokenBucket
+
+        directory = tempfile.mkdtemp(prefix='cash-tracker-bench-')
+        self.sheets = FakeSheets(self.args.sheets_latency)
+        self.sheets.load_items(rows)
+        GoogleSheetClient._instance = FakeSheetClient(self.sheets)
+        ReferenceData._instance = None
+        BalanceCache._instance = None
+
+        self.conn = FakeDatabase(self.args.db_latency)
+        self.store = LocalStore(os.path.join(directory, 'store.db'))
+        WriteBehind._instance = WriteBehind(Journal(os.path.join(directory, 'journal.db')), self.conn, self.store)
+        self.bot.CONN = self.conn
+        # only the TELEGRAM_USER_ID tenant (no registry file)
+        TenantRegistry._instance = TenantRegistry(self.conn, os.path.join(directory, 'tenants.json'))
+        self.tenant = TenantRegistry.get().tenant(os.environ['TELEGRAM_USER_ID'])
+        # the local parser would answer the bench messages without the LLM
+        self.tenant.parser = None
+
+        # the rate limiter would measure Telegram's flood limits, not the bot
+        sender = TelegramSender()
+        sender.per_chat_rate = sender.per_chat_burst = 1e9
+        sender.global_bucket = TokenBucket(1e9, 1e9)
+        TelegramSender._instance = sender
+
+        self.stub.transactions = transactions
+        self.driver = TelegramDriver(int(os.environ['TELEGRAM_USER_ID']), self.args.telegram_latency)
+
+    def backfill(self):
+        self.store.backfill(self.sheets.get(range='items!B:G').get('values', []))
+
+    def drain(self):
+        from services.write_behind import WriteBehind
+        WriteBehind.get().flush()
+
+    async def timed(self, coroutine):
+        start = time.perf_counter()
+        await coroutine
+        return time.perf_counter() - start
+
+    async def messages(self, transactions, chats, iterations, text='spesa'):
+        self.setup(transactions=transactions)
+        durations = []
+        for _ in range(iterations):
+            durations += await asyncio.gather(*[
+                self.timed(self.bot.handle_message(self.driver.update(text, chat_id=chat), self.driver.context()))
+                for chat in range(chats)
+            ])
+            # deliver the journal outside the measured reply path
+            await asyncio.get_running_loop().run_in_executor(None, self.drain)
+        return durations
+
+    async def balance(self, iterations):
+        self.setup()
+        return [await self.timed(self.bot.balance(self.driver.update('/get_balance'), self.tenant)) for _ in range(iterations)]
+
+    async def export(self, rows, from_store, iterations):
+        self.setup(rows=rows)
+        if from_store:
+            self.backfill()
+        return [await self.timed(self.bot.export(self.driver.update('/export'), self.driver.context())) for _ in range(iterations)]
+
+    async def sync(self, rows, full, iterations):
+        self.setup(rows=rows)
+        self.backfill()
+        durations = []
+        for _ in range(iterations):
+            # hand edit a few rows at the end of the sheet (within the incremental window)
+            grid = self.sheets.grids['items']
+            for _ in range(5):
+                index = random.randint(max(1, len(grid) - 100), len(grid) - 1)
+                grid[index][1:] = fake_sheet_row(random.randint(0, 10 ** 6))
+            start = time.perf_counter()
+            self.tenant.sync(full)
+            durations.append(time.perf_counter() - start)
+        return durations
+
+    def scenarios(self):
+        """
+        Returns the scenarios to run
+        Returns:
+            list: (name, coroutine factory) tuples
+        """
+        quick = self.args.quick
+        iterations = self.args.iterations
+        sizes = [1000, 10000] if quick else [1000, 10000, 100000]
+        chats = [1, 10] if quick else [1, 10, 50]
+        scenarios = []
+        for transactions in (1, 10, 100):
+            scenarios.append((f'message_tx{transactions}', lambda t=transactions: self.messages(t, 1, iterations)))
+        for count in chats:
+            scenarios.append((f'message_chats{count}', lambda c=count: self.messages(1, c, max(1, iterations // c))))
+        # a pasted statement: chunks of 10 lines extracted concurrently
+        statement = '\n'.join(f"{abs(fake_transaction(index % 10)['amount'])} bench {index}" for index in range(100))
+        scenarios.append(('message_bulk100', lambda: self.messages(10, 1, max(1, iterations // 5), statement)))
+        scenarios.append(('balance', lambda: self.balance(iterations)))
+        for rows in sizes:
+            # big sheets: fewer runs
+            runs = iterations if rows < 100000 else max(1, iterations // 10)
+            label = f'{rows // 1000}k'
+            scenarios.append((f'export_sheet_{label}', lambda r=rows, n=runs: self.export(r, False, n)))
+            scenarios.append((f'export_store_{label}', lambda r=rows, n=runs: self.export(r, True, n)))
+            scenarios.append((f'sync_incremental_{label}', lambda r=rows, n=runs: self.sync(r, False, n)))
+            scenarios.append((f'sync_full_{label}', lambda r=rows, n=runs: self.sync(r, True, n)))
+        if self.args.only:
+            scenarios = [scenario for scenario in scenarios if self.args.only in scenario[0]]
+        return scenarios
+
+    async def run(self):
+        """
+        Runs the scenarios
+        Returns:
+            dict: name => ops, throughput (ops/s), p50 and p99 (ms)
+        """
+        import metrics
+        results = {}
+        for name, factory in self.scenarios():
+            start = time.perf_counter()
+            # keep the bot logs out of the report
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                durations = sorted(await factory())
+            wall = time.perf_counter() - start
+            results[name] = {
+                'ops': len(durations),
+                'throughput': round(len(durations) / wall, 2) if wall else 0.0,
+                'p50': round(metrics.percentile(durations, 0.5) * 1000, 2),
+                'p99': round(metrics.percentile(durations, 0.99) * 1000, 2)
+            }
+            print(f"{name:<24} {results[name]['ops']:>6} ops {results[name]['throughput']:>10.2f} ops/s   p50 {results[name]['p50']:>10.2f} ms   p99 {results[name]['p99']:>10.2f} ms", flush=True)
+        return results
+
+# scenarios slower than the baseline by more than tolerance (and min_ms, to ignore noise)
+def regressions(results: dict, baseline: dict, tolerance: float, min_ms: float = 2.0) -> list:
+    found = []
+    for name, values in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ('p50', 'p99'):
+            if values[key] > reference[key] * (1 + tolerance) and values[key] - reference[key] > min_ms:
+                found.append(f"{name} {key}: {values[key]:.2f} ms (baseline {reference[key]:.2f} ms)")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the bot hot paths')
+    parser.add_argument('--quick', action='store_true', help='skip the 100k rows and 50 chats scenarios')
+    parser.add_argument('--only', help='run only the scenarios whose name contains this text')
+    parser.add_argument('--iterations', type=int, default=20, help='runs per scenario (big sheets run a tenth)')
+    parser.add_argument('--openai-latency', type=float, default=0.05, help='seconds per completion')
+    parser.add_argument('--sheets-latency', type=float, default=0.02, help='seconds per Sheets request')
+    parser.add_argument('--db-latency', type=float, default=0.005, help='seconds per database round trip')
+    parser.add_argument('--telegram-latency', type=float, default=0.01, help='seconds per Telegram API call')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging a regression')
+    args = parser.parse_args()
+
+    bench = Bench(args)
+    try:
+        results = asyncio.run(bench.run())
+    finally:
+        bench.stub.close()
+        import executor
+        executor.shutdown(wait=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        if found:
+            print('\nRegressions:\n' + '\n'.join(found))
+            sys.exit(1)
+        print('\nNo regressions against the baseline')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Startup time report: `python -X importtime` breakdown of `import bot`, with an optional budget
+
+Usage (from the repository root):
+    python benchmarks/startup.py                  slowest imports of the best of 5 runs
+    python benchmarks/startup.py --budget 800     exit 1 if importing the bot takes more than 800 ms
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# "import time:  self [us] | cumulative | imported package" (nesting shown by indentation)
+LINE_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# import the bot once in a fresh interpreter and return the (module, depth, self us, cumulative us) rows
+def import_times() -> list:
+    env = {
+        **os.environ,
+        'SUPABASE_URL': os.environ.get('SUPABASE_URL', 'http://127.0.0.1:9'),
+        'SUPABASE_KEY': os.environ.get('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic3RhcnR1cCJ9.startup')
+    }
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', "import sys; sys.path.insert(0, 'src'); import bot"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            rows.append((match.group(4), (len(match.group(3)) - 1) // 2, int(match.group(1)), int(match.group(2))))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time report of the bot imports')
+    parser.add_argument('--runs', type=int, default=5, help='imports measured (the fastest is reported)')
+    parser.add_argument('--top', type=int, default=15, help='slowest direct imports shown')
+    parser.add_argument('--budget', type=float, help='maximum milliseconds to import the bot')
+    args = parser.parse_args()
+
+    # the first run also fills the bytecode caches
+    runs = [import_times() for _ in range(args.runs)]
+    rows = min(runs, key=lambda run: next((row[3] for row in run if row[0] == 'bot'), 0))
+    total = next((row[3] for row in rows if row[0] == 'bot'), 0) / 1000
+
+    # modules imported by bot.py: the depth 1 rows printed right before bot (children come before their parent)
+    direct, children = [], []
+    for row in rows:
+        if row[1] == 1:
+            children.append(row)
+        elif row[1] == 0:
+            if row[0] == 'bot':
+                direct = children
+            children = []
+    direct = sorted(direct, key=lambda row: row[3], reverse=True)
+    print(f"{'module':<40} {'cumulative ms':>14} {'self ms':>9}")
+    for module, depth, own, cumulative in direct[:args.top]:
+        print(f"{module:<40} {cumulative / 1000:>14.1f} {own / 1000:>9.1f}")
+    print(f"\nimport bot: {total:.1f} ms")
+
+    if args.budget is not None and total > args.budget:
+        print(f"Over the {args.budget:.0f} ms budget")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
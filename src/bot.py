@@ -1,9 +1,24 @@
+import time
+# process start, for the startup time report
+STARTED_AT = time.perf_counter()
+import io
 import os
+import html
+import asyncio
 import helper
-import pymysql
-from database.supabase_api import SupabaseAPI
+import executor
+import metrics
+from database.database_interface import DatabaseInterface, SchemaError
 from services.google_sheet_service import GoogleSheetService
+from services.google_sheet_client import GoogleSheetClient
 from services.open_ai_service import OpenAIService
+from services.write_behind import WriteBehind
+from services.tenants import TenantRegistry
+from services.statement_import import StatementImporter
+from services import reply_service
+from services.reply_service import TelegramSender
+from services.update_processor import ChatOrderedUpdateProcessor
+from services.response_cache import ResponseCache
 from datetime import datetime
 from telegram import Update, BotCommand
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
@@ -11,29 +26,47 @@ from telegram.ext import Application, CommandHandler, MessageHandler, filters, C
 # retrieve and set env vars
 TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_USER_ID = os.getenv('TELEGRAM_USER_ID')
+ADMIN_USER_ID = os.getenv('TELEGRAM_ADMIN_ID') or TELEGRAM_USER_ID
+METRICS_PORT = os.getenv('METRICS_PORT')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+PORT = int(os.getenv('PORT', 8080))
 CONN = None
 
-# save conn
+# save conn (the driver is imported and connected after startup)
 if helper.config('general.db.status'):
-    CONN = helper.connect_db()
+    CONN = helper.lazy_db()
 
 # set consts
 EXPORT_METHOD = 'generate_export'
-# set vars
+# set vars (default language, used for the users without a tenant)
 trans = {}
 
+# return the tenant of a user, opened off the event loop (journal and local store files)
+async def open_tenant(user_id):
+    registry = TenantRegistry.get()
+    return registry.active_tenant(user_id) or await executor.run('tenants', registry.tenant, user_id)
+
+# return the tenant of the sender, replying forbidden to unknown users
+async def resolve_tenant(update: Update):
+    tenant = await open_tenant(update.message.from_user.id)
+    if tenant is None:
+        await update.message.reply_text(helper.lang(trans, 'telegram.message.forbidden'))
+    return tenant
+
 # start function
 async def start(update: Update, context: CallbackContext) -> None:
-    await update.message.reply_text(helper.lang(trans, 'telegram.message.start.index'))
+    tenant = await open_tenant(update.message.from_user.id)
+    await update.message.reply_text(helper.lang(tenant.trans if tenant else trans, 'telegram.message.start.index'))
 
 # get balance from all bank accounts
 async def get_balance(update: Update, context: CallbackContext) -> None:
     # check permission
-    if not TELEGRAM_USER_ID or not helper.user_access(update.message.from_user.id, int(TELEGRAM_USER_ID)):
-        await update.message.reply_text(helper.lang(trans, 'telegram.message.forbidden'))
+    tenant = await resolve_tenant(update)
+    if tenant is None:
         return
     # retrieve and print balance
-    await balance(update)
+    await balance(update, tenant)
 
 # help function
 async def help(update: Update, context: CallbackContext) -> None:
@@ -50,70 +83,153 @@ async def help(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(f"Available commands:\n{message}")
 
 # handle message function
+@metrics.timed('handle_message')
 async def handle_message(update: Update, context: CallbackContext) -> None:
     # check permission
-    if not TELEGRAM_USER_ID or not helper.user_access(update.message.from_user.id, int(TELEGRAM_USER_ID)):
-        await update.message.reply_text(helper.lang(trans, 'telegram.message.forbidden'))
+    tenant = await resolve_tenant(update)
+    if tenant is None:
         return
     # retrieve message
     message = update.message.text
     # abort if invalid message
     if not isinstance(message, str): return
+    # wait for a slot in the tenant queue
+    async with tenant.slot():
+        await process_message(update, context, tenant, message)
+
+# extract and record the transactions of a message (or answer an export)
+async def process_message(update: Update, context: CallbackContext, tenant, message: str) -> None:
+    trans = tenant.trans
     # create openai service
-    openai = OpenAIService()
-    await update.message.reply_text(helper.lang(trans, 'telegram.message.success_openai'))
-    # retrieve method
-    method_name = openai.get_method(message)
-    method = getattr(openai, method_name)
-    # perform method
-    openai_response, content = method(message)
-
-    if method_name == EXPORT_METHOD:
+    openai = OpenAIService(tenant.store, tenant.reference_data, tenant.spreadsheet_id)
+    chat_id = update.message.chat_id
+    sender = TelegramSender.get()
+    # processing notice, edited in place with the outcome
+    processing = await sender.send(chat_id, lambda: update.message.reply_text(helper.lang(trans, 'telegram.message.success_openai')))
+    # route the request and perform the chosen method
+    try:
+        method_name, route, openai_response, content = await executor.run('openai', metrics.profiled(openai.dispatch, helper.config('general.metrics.profile_path')), message, tenant.router, tenant.parser)
+    except Exception as e:
+        # the processing notice always gets an outcome
+        print(f"Dispatch failed: {e}")
+        method_name, route, openai_response, content = None, None, None, None
+    print(f"Route: {method_name} ({route})")
+
+    if openai_response is None:
+        await sender.send(chat_id, lambda: processing.edit_text(helper.lang(trans, 'telegram.message.error_openai')))
+    elif method_name == EXPORT_METHOD:
+        # store the route of exports too (routing accuracy is measured on openai_responses)
+        await executor.run('db', tenant.write_behind.record, openai_response, message, f"{method_name}:{route}", [])
+        tenant.write_behind.flush_in_background()
         # set file name
         file_name = 'ai-export-' + datetime.now().strftime('%d-%m-%Y') + '.xlsx'
-        await context.bot.send_document(chat_id=update.message.chat_id, document=content, filename=file_name)
+        await sender.send(chat_id, lambda: context.bot.send_document(chat_id=chat_id, document=content, filename=file_name))
     else:
-        # save response on db
-        if helper.config('general.db.status'):
-            chat_id = helper.save_openai_response(CONN, openai_response, message)
-
-        if openai_response is None:
-            await update.message.reply_text(helper.lang(trans, 'telegram.message.error_openai'))
-        else:
-            try:
-                # retrieve clean transactions structure
-                transactions = helper.sanitize_response(content)
-
-                if not isinstance(transactions, list) or not transactions:
-                    await update.message.reply_text(helper.lang(trans, 'telegram.message.error_openai'))
-                else:
-                    # create new GoogleSheetService
-                    g_sheet_service = GoogleSheetService('add_transaction')
-
-                    # loop transactions
-                    for transaction in transactions:
-                        order_message = f"<b>{helper.lang(trans, 'telegram.message.fields.header')}</b>\n\n"
-
-                        for key, value in transaction.items():
-                            if key == 'amount':
-                                value = f"{value:,.2f} €"
-                            row = f"<b>{helper.lang(trans, f'telegram.message.fields.{key}')}</b>: {value}\n"
-                            order_message += row
-
-                        await update.message.reply_text(order_message, parse_mode='HTML')
-
-                        # save on db
-                        if helper.config('general.db.status'):
-                            helper.save_transaction(CONN, transaction, chat_id)
-
-                        # save on google sheets
-                        g_sheet_service.add_transaction(transaction)
-
-                    await update.message.reply_text(helper.lang(trans, 'telegram.message.success'))
+        try:
+            # retrieve clean transactions structure
+            transactions = helper.sanitize_response(content)
+
+            if not isinstance(transactions, list):
+                transactions = []
+
+            # render before journaling: once saved, an "exception" reply would make the user send the expense again
+            blocks = [reply_service.render_transaction(trans, transaction) for transaction in transactions]
+
+            # commit response and transactions to the local journal (delivered to sheet/db in background)
+            write_behind = tenant.write_behind
+            # sqlite commit with fsync: off the event loop
+            await executor.run('db', write_behind.record, openai_response, message, f"{method_name}:{route}", transactions)
+
+            if not transactions:
+                await sender.send(chat_id, lambda: processing.edit_text(helper.lang(trans, 'telegram.message.error_openai')))
+            else:
+                # all confirmations in as few messages as possible: the first replaces the processing notice
+                blocks.append(helper.lang(trans, 'telegram.message.success'))
+                # lines of a long message no completion answered are not saved
+                failed_lines = content.get('failed_lines') if isinstance(content, dict) else None
+                if failed_lines:
+                    blocks.append(helper.lang(trans, 'telegram.message.failed_lines').format(lines=html.escape('\n'.join(failed_lines))))
+                chunks = reply_service.pack_messages(blocks)
+                await sender.send(chat_id, lambda: processing.edit_text(chunks[0], parse_mode='HTML'))
+                for chunk in chunks[1:]:
+                    await sender.send(chat_id, lambda: update.message.reply_text(chunk, parse_mode='HTML'))
+
+            # drain the journal to google sheets and the database
+            write_behind.flush_in_background()
+
+        except Exception as e:
+            print(e)
+            await sender.send(chat_id, lambda: update.message.reply_text(helper.lang(trans, 'telegram.message.exception')))
+
+# import a csv/xlsx bank statement sent as a document
+@metrics.timed('import_statement')
+async def import_statement(update: Update, context: CallbackContext) -> None:
+    # check permission
+    tenant = await resolve_tenant(update)
+    if tenant is None:
+        return
+    trans = tenant.trans
+    document = update.message.document
+    chat_id = update.message.chat_id
+    sender = TelegramSender.get()
+    # telegram bots cannot download more than 20 MB anyway
+    if document.file_size and document.file_size > (helper.config('general.statement_import.max_size') or 10 * 1024 * 1024):
+        await sender.send(chat_id, lambda: update.message.reply_text(helper.lang(trans, 'telegram.message.statement_import.too_large')))
+        return
 
-            except Exception as e:
-                print(e)
-                await update.message.reply_text(helper.lang(trans, 'telegram.message.exception'))
+    async with tenant.slot():
+        # processing notice, edited in place with the outcome
+        processing = await sender.send(chat_id, lambda: update.message.reply_text(helper.lang(trans, 'telegram.message.waiting')))
+        try:
+            # download the file in memory
+            file_stream = io.BytesIO()
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_memory(file_stream)
+            file_stream.seek(0)
+            write_behind = tenant.write_behind
+
+            # one journal commit per chunk (memory stays bounded), delivered in bulk appends/inserts
+            def commit(response, transactions):
+                write_behind.record(response, document.file_name, 'statement_import', transactions)
+                write_behind.flush_in_background()
+
+            # parse, categorize locally and send only the ambiguous rows to openai
+            importer = StatementImporter(OpenAIService(tenant.store, tenant.reference_data, tenant.spreadsheet_id), trans, tenant.reference_data, tenant.store)
+            counters = await executor.run('openai', importer.run, file_stream, document.file_name, commit, update.message.caption)
+        except Exception as e:
+            print(f"Statement import failed: {e}")
+            await sender.send(chat_id, lambda: processing.edit_text(helper.lang(trans, 'telegram.message.statement_import.fail')))
+            return
+
+        print(f"Statement import: {counters}")
+        await sender.send(chat_id, lambda: processing.edit_text(helper.lang(trans, 'telegram.message.statement_import.success').format(**counters)))
+
+# latency, error and token stats (admin only, /stats profile to profile the next message)
+async def stats(update: Update, context: CallbackContext) -> None:
+    # check permission
+    tenant = await open_tenant(update.message.from_user.id)
+    if not (tenant is not None and tenant.admin) and (not ADMIN_USER_ID or not helper.user_access(update.message.from_user.id, int(ADMIN_USER_ID))):
+        await update.message.reply_text(helper.lang(trans, 'telegram.message.forbidden'))
+        return
+    if context.args and context.args[0].lower() == 'profile':
+        metrics.profile_next()
+        await update.message.reply_text(helper.lang(trans, 'telegram.message.stats.profile'))
+        return
+    await update.message.reply_text(metrics.render_text(stats_extra()), parse_mode='HTML')
+
+# gauges reported next to the stage timings
+def stats_extra() -> dict:
+    tenants = TenantRegistry.get().tenants()
+    extra = {
+        'journal': {'size': sum(tenant.write_behind.journal.size() for tenant in tenants if not tenant.write_behind.closed)},
+        'tenants': {'active': len(tenants), 'in_flight': sum(tenant.in_flight for tenant in tenants)}
+    }
+    cache = ResponseCache.get()
+    if cache is not None:
+        extra['llm_cache'] = cache.stats()
+    if GoogleSheetClient._instance is not None:
+        extra['sheets'] = GoogleSheetClient._instance.scheduler.stats()
+    return extra
 
 # set suggested commands on "/" in chat
 async def post_init(application: Application) -> None:
@@ -121,23 +237,79 @@ async def post_init(application: Application) -> None:
         BotCommand('start','To start bot'),
         BotCommand('get_balance','To retrieve balance of bank accounts'),
         # BotCommand('build_sheet','Build sheet structure'),
-        BotCommand('export','Export sheet in csv'),
+        BotCommand('export','Export sheet in csv (/export xlsx for excel)'),
         BotCommand('set_lang','Set default lang [it, en]'),
         BotCommand('help','To get hints'),
     ]
 
-    if isinstance(CONN, (SupabaseAPI, pymysql.connections.Connection)):
+    if isinstance(CONN, DatabaseInterface):
         command.append(BotCommand('sync','To sync google sheet with internal database'))
 
     await application.bot.set_my_commands(command)
 
-# return balance from gsheet
-async def balance(update: Update) -> None:
-    # create new GoogleSheetService
-    g_sheet_service = GoogleSheetService('get_balance')
+    # ready to poll (or serve the webhook): the backends are warmed in background
+    ready = time.perf_counter() - STARTED_AT
+    metrics.observe('startup.ready', ready)
+    budget = helper.config('general.startup.budget')
+    print(f"Bot ready in {ready * 1000:.0f} ms" + (f" (over the {budget * 1000:.0f} ms budget)" if budget and ready > budget else ''))
+    application.create_task(warm_up(application))
+
+# import and connect the backends after startup
+async def warm_up(application: Application) -> None:
+    start = time.perf_counter()
+    tasks = {
+        # create and warm the shared google sheets client (credentials, discovery, token)
+        'google_sheet': executor.run('google_sheet', GoogleSheetClient.warm_up),
+        # import openai and create the shared client
+        'openai': executor.run('openai', OpenAIService.warm_up),
+        # open the registered tenants (their local stores are backfilled once in background)
+        'tenants': executor.run('tenants', TenantRegistry.get().preload)
+    }
+    # import the driver and connect the database
+    if CONN is not None:
+        tasks['db'] = executor.run('db', CONN.connect)
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for name, result in zip(tasks, results):
+        if isinstance(result, SchemaError):
+            # every database write would fail: stop until the tables are migrated (the journal keeps the pending rows)
+            print(f"{name} warm up failed, stopping: {result}")
+            application.stop_running()
+        elif isinstance(result, Exception):
+            print(f"{name} warm up failed: {result}")
+    metrics.observe('startup.warm_up', time.perf_counter() - start)
+
+# refresh categories and payment methods read from google sheets
+async def refresh_reference_data(context: CallbackContext) -> None:
+    await asyncio.gather(*[tenant.job('refresh_reference_data', 'google_sheet', tenant.reference_data.refresh_all) for tenant in TenantRegistry.get().tenants()], return_exceptions=True)
+
+# reconcile the balance snapshot with the sheet formulas
+async def refresh_balance(context: CallbackContext) -> None:
+    await asyncio.gather(*[tenant.job('refresh_balance', 'google_sheet', tenant.balance_cache.refresh) for tenant in TenantRegistry.get().tenants()], return_exceptions=True)
+
+# deliver journaled writes left behind (retries, restarts), each tenant on its own worker
+async def flush_journal(context: CallbackContext) -> None:
+    await asyncio.gather(*[tenant.job('flush_journal', 'journal', tenant.write_behind.flush) for tenant in TenantRegistry.get().tenants()], return_exceptions=True)
+
+# incremental sync of the items sheet
+async def sync_sheet(context: CallbackContext) -> None:
+    tenants = TenantRegistry.get().tenants()
+    deltas = await asyncio.gather(*[tenant.job('sync_sheet', 'google_sheet', tenant.sync) for tenant in tenants], return_exceptions=True)
+    for tenant, delta in zip(tenants, deltas):
+        if isinstance(delta, Exception):
+            print(f"Sheet sync of {tenant.user_id} failed: {delta}")
+        elif delta is not None:
+            print(f"Sheet sync of {tenant.user_id}: {delta}")
+
+# deliver the pending writes and release backend thread pools
+async def post_shutdown(application: Application) -> None:
+    await executor.run('journal', TenantRegistry.get().close)
+    executor.shutdown(wait=False)
 
-    # retrieve bank accounts
-    bank_accounts = g_sheet_service.get_balance()
+# return balance from gsheet
+async def balance(update: Update, tenant) -> None:
+    trans = tenant.trans
+    # retrieve bank accounts (cached snapshot, read only if missing)
+    bank_accounts, as_of = await executor.run('google_sheet', tenant.balance_cache.snapshot)
 
     if isinstance(bank_accounts, list):
         message_lines = []
@@ -152,6 +324,7 @@ async def balance(update: Update) -> None:
                     message_lines.append(f"{name}: {amount}")
 
         message = "<tg-spoiler>" + "\n".join(message_lines) + "</tg-spoiler>"
+        message += f"\n\n<i>{helper.lang(trans, 'telegram.message.balance.as_of')} {as_of.strftime('%d/%m/%Y %H:%M:%S')}</i>"
 
         await update.message.reply_text(message, parse_mode='HTML')
     else:
@@ -159,11 +332,16 @@ async def balance(update: Update) -> None:
 
 # build sheet structure
 async def build_sheet(update: Update, context: CallbackContext) -> None:
+    # check permission
+    tenant = await resolve_tenant(update)
+    if tenant is None:
+        return
+    trans = tenant.trans
     # create new GoogleSheetService
-    g_sheet_service = GoogleSheetService('build_sheet')
+    g_sheet_service = GoogleSheetService('build_sheet', spreadsheet_id=tenant.spreadsheet_id)
 
     # retrieve bank accounts
-    response = g_sheet_service.build_sheet()
+    response = await executor.run('google_sheet', g_sheet_service.build_sheet)
 
     # set message
     message = helper.lang(trans, 'telegram.message.build_sheet.success') if response else helper.lang(trans, 'telegram.message.build_sheet.fail')
@@ -172,65 +350,119 @@ async def build_sheet(update: Update, context: CallbackContext) -> None:
 
 # export transactions (.csv)
 async def export(update: Update, context: CallbackContext) -> None:
-    # create new GoogleSheetService
-    g_sheet_service = GoogleSheetService('export')
+    # check permission
+    tenant = await resolve_tenant(update)
+    if tenant is None:
+        return
+    trans = tenant.trans
+    # /export xlsx, csv by default
+    file_format = 'xlsx' if context.args and context.args[0].lower() == 'xlsx' else 'csv'
+
+    async with tenant.slot():
+        if tenant.store is not None and tenant.store.is_backfilled():
+            # serve the export from the local read model
+            file_stream = await executor.run('db', helper.stream_export, tenant.store.export_rows(helper.config('google_sheet.header.items'), helper.config('general.export.page_size') or 1000), file_format)
+        else:
+            # create new GoogleSheetService
+            g_sheet_service = GoogleSheetService('export', spreadsheet_id=tenant.spreadsheet_id)
 
-    # retrieve bank accounts
-    file_stream = g_sheet_service.export()
+            # retrieve bank accounts
+            file_stream = await executor.run('google_sheet', g_sheet_service.export, file_format)
 
     if file_stream:
         # set file name
-        file_name = 'export-' + datetime.now().strftime('%d-%m-%Y') + '.csv'
-        await context.bot.send_document(chat_id=update.message.chat_id, document=file_stream, filename=file_name)
+        file_name = 'export-' + datetime.now().strftime('%d-%m-%Y') + '.' + file_format
+        try:
+            await context.bot.send_document(chat_id=update.message.chat_id, document=file_stream, filename=file_name)
+        finally:
+            file_stream.close()
     else:
         await update.message.reply_text(helper.lang(trans, 'telegram.message.export.fail'))
 
 # export transactions (.csv)
 async def set_lang(update: Update, context: CallbackContext) -> None:
-    # load translations var global
-    global trans
+    # check permission
+    tenant = await resolve_tenant(update)
+    if tenant is None:
+        return
     if context.args:
         # retrieve lang param
         lang = context.args[0].lower()
         # check if lang is available
         if lang not in helper.config('general.available_langs'):
-            await update.message.reply_text(helper.lang(trans, 'telegram.message.set_lang.not_available'))
+            await update.message.reply_text(helper.lang(tenant.trans, 'telegram.message.set_lang.not_available'))
         else:
-            # set lang on config
-            helper.set_lang(lang)
-            # load translations
-            trans = helper.load_translations(helper.config('general.lang'))
-
-            await update.message.reply_text(helper.lang(trans, 'telegram.message.set_lang.success'))
+            if tenant.default:
+                # set lang on config
+                helper.set_lang(lang)
+            else:
+                # set lang on the tenant registry
+                await executor.run('tenants', TenantRegistry.get().update, tenant.user_id, {'lang': lang})
+            # load translations, pre-router and parser vocabularies
+            tenant.load_language(lang)
+
+            await update.message.reply_text(helper.lang(tenant.trans, 'telegram.message.set_lang.success'))
     else:
-        await update.message.reply_text(helper.lang(trans, 'telegram.message.set_lang.fail'))
+        await update.message.reply_text(helper.lang(tenant.trans, 'telegram.message.set_lang.fail'))
 
 # sync google sheet items with database
 async def sync(update: Update, context: CallbackContext) -> None:
+    # check permission
+    tenant = await resolve_tenant(update)
+    if tenant is None:
+        return
+    trans = tenant.trans
     # retrieve categories
-    g_sheet_service = GoogleSheetService('get_categories')
-    categories = g_sheet_service.get_categories()
+    g_sheet_service = GoogleSheetService('get_categories', spreadsheet_id=tenant.spreadsheet_id)
+    categories = await executor.run('google_sheet', g_sheet_service.get_categories)
     # retrieve payment methods
-    g_sheet_service = GoogleSheetService('get_payment_methods')
-    payment_methods = g_sheet_service.get_payment_methods()
+    g_sheet_service = GoogleSheetService('get_payment_methods', spreadsheet_id=tenant.spreadsheet_id)
+    payment_methods = await executor.run('google_sheet', g_sheet_service.get_payment_methods)
     # check if categories and payment methods are valid
     if isinstance(categories, list) and isinstance(payment_methods, list):
-        # load settings
-        data = helper.load_settings()
-        # set categories
-        data['google_sheet']['categories'] = categories
-        # set payment methods
-        data['google_sheet']['payment_methods'] = payment_methods
-        # save settings
-        helper.write_settings(data)
+        reference_data = tenant.reference_data
+        if tenant.default:
+            # load settings
+            data = helper.load_settings()
+            # set categories
+            data['google_sheet']['categories'] = categories
+            # set payment methods
+            data['google_sheet']['payment_methods'] = payment_methods
+            # save settings
+            helper.write_settings(data)
+        else:
+            # update the fixed lists of the tenant registry
+            fixed = {kind: values for kind, values in (('categories', categories), ('payment_methods', payment_methods)) if kind in reference_data.lists}
+            if fixed:
+                await executor.run('tenants', TenantRegistry.get().update, tenant.user_id, fixed)
+                reference_data.lists.update(fixed)
+        # drop the cached lists and store the fresh ones
+        reference_data.invalidate()
+        reference_data.store('categories', categories)
+        reference_data.store('payment_methods', payment_methods)
         await update.message.reply_text(helper.lang(trans, 'telegram.message.sync.success'))
     else:
         await update.message.reply_text(helper.lang(trans, 'telegram.message.sync.fail'))
+        return
+
+    # sync the items sheet rows changed since the last run (/sync full re-reads the whole sheet)
+    if tenant.store is not None and tenant.store.is_backfilled():
+        try:
+            async with tenant.slot():
+                delta = await executor.run('google_sheet', tenant.sync, bool(context.args) and context.args[0].lower() == 'full')
+            if delta is not None:
+                await update.message.reply_text(helper.lang(trans, 'telegram.message.sync.delta').format(**delta))
+        except Exception as e:
+            print(e)
+            await update.message.reply_text(helper.lang(trans, 'telegram.message.sync.fail'))
 # main
 def main():
+    metrics.observe('startup.imports', time.perf_counter() - STARTED_AT)
     print('Starting bot...')
     # build application
-    application = Application.builder().token(TOKEN).post_init(post_init).build()
+    # updates processed concurrently, one at a time per chat
+    update_processor = ChatOrderedUpdateProcessor(helper.config('general.telegram.concurrent_updates') or 1)
+    application = Application.builder().token(TOKEN).concurrent_updates(update_processor).post_init(post_init).post_shutdown(post_shutdown).build()
 
     # set start() -> /start
     application.add_handler(CommandHandler('start', start))
@@ -248,23 +480,67 @@ def main():
     application.add_handler(CommandHandler('export', export))
 
     # set sync() -> /sync
-    if isinstance(CONN, (SupabaseAPI, pymysql.connections.Connection)):
+    if isinstance(CONN, DatabaseInterface):
         application.add_handler(CommandHandler('sync', sync))
 
+    # refresh the cached categories/payment methods on a schedule
+    if application.job_queue and (helper.config('google_sheet.use_gs.categories') or helper.config('google_sheet.use_gs.payment_methods')):
+        application.job_queue.run_repeating(refresh_reference_data, interval=helper.config('google_sheet.cache.reference_refresh'), first=0)
+
+    # open the write-behind journal (default tenant) and the tenant registry
+    WriteBehind.configure(CONN, helper.connect_store())
+    TenantRegistry.configure(CONN)
+
+    # drain the journals on a schedule
+    if application.job_queue:
+        application.job_queue.run_repeating(flush_journal, interval=helper.config('general.journal.flush_interval'), first=0)
+
+    # sync hand edits of the items sheets on a schedule
+    if helper.config('general.local_store.status') and application.job_queue and helper.config('general.sync.status'):
+        application.job_queue.run_repeating(sync_sheet, interval=helper.config('general.sync.interval'), first=helper.config('general.sync.interval'))
+
+    # reconcile the balance snapshot on a schedule
+    if application.job_queue:
+        application.job_queue.run_repeating(refresh_balance, interval=helper.config('google_sheet.cache.balance_refresh'), first=0)
+
+    # set stats() -> /stats
+    application.add_handler(CommandHandler('stats', stats))
+
     # set settings/set_lang() -> /set_lang
     application.add_handler(CommandHandler('set_lang', set_lang))
 
     # create handler for all messages (not start with /)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    # create handler for bank statements (csv/xlsx documents)
+    if helper.config('general.statement_import.status'):
+        application.add_handler(MessageHandler(filters.Document.FileExtension('csv') | filters.Document.FileExtension('xlsx'), import_statement))
+
     # load translations
     global trans
     trans = helper.load_translations(helper.config('general.lang'))
 
+    # expose the metrics in the prometheus text format
+    if METRICS_PORT:
+        metrics.start_http_server(int(METRICS_PORT), stats_extra)
+
     print('Bot started')
 
-    # run bot
-    application.run_polling()
+    # run bot (BOT_MODE env var overrides general.telegram.mode)
+    mode = os.getenv('BOT_MODE') or helper.config('general.telegram.mode') or 'polling'
+    if mode == 'webhook':
+        if not WEBHOOK_URL:
+            raise RuntimeError('WEBHOOK_URL must be set in the .env file to run in webhook mode.')
+        url_path = helper.config('general.telegram.webhook_path') or 'telegram'
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=PORT,
+            url_path=url_path,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+            secret_token=WEBHOOK_SECRET or None
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,57 @@
+-- --------------------------------------------------------
+
+--
+-- Upgrade of tables created before the journal, the sheet sync and the tenants
+-- Safe to run more than once: every change is skipped when already applied
+--
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'openai_responses' AND COLUMN_NAME = 'route'), 'SELECT 1', 'ALTER TABLE openai_responses ADD COLUMN route VARCHAR(50) NULL');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'openai_responses' AND COLUMN_NAME = 'tenant_id'), 'SELECT 1', 'ALTER TABLE openai_responses ADD COLUMN tenant_id VARCHAR(64) NULL');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND COLUMN_NAME = 'sheet_row'), 'SELECT 1', 'ALTER TABLE transactions ADD COLUMN sheet_row INT NULL');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND COLUMN_NAME = 'tenant_id'), 'SELECT 1', 'ALTER TABLE transactions ADD COLUMN tenant_id VARCHAR(64) NULL');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND COLUMN_NAME = 'journal_key'), 'SELECT 1', 'ALTER TABLE transactions ADD COLUMN journal_key VARCHAR(255) NULL');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+-- --------------------------------------------------------
+
+--
+-- Keys and indexes of the new columns
+--
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND INDEX_NAME = 'uq_transactions_journal_key'), 'SELECT 1', 'ALTER TABLE transactions ADD UNIQUE KEY uq_transactions_journal_key (journal_key)');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND INDEX_NAME = 'idx_sheet_row'), 'SELECT 1', 'ALTER TABLE transactions ADD INDEX idx_sheet_row (sheet_row)');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'transactions' AND INDEX_NAME = 'idx_tenant_id_sheet_row'), 'SELECT 1', 'ALTER TABLE transactions ADD INDEX idx_tenant_id_sheet_row (tenant_id, sheet_row)');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF(EXISTS(SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'openai_responses' AND INDEX_NAME = 'idx_openai_responses_tenant_id'), 'SELECT 1', 'ALTER TABLE openai_responses ADD INDEX idx_openai_responses_tenant_id (tenant_id)');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
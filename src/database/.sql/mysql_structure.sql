@@ -6,14 +6,17 @@ SET time_zone = 'Europe/Rome';
 -- Table structure for table `openai_responses`
 --
 
-CREATE TABLE openai_responses (
+CREATE TABLE IF NOT EXISTS openai_responses (
     chat_id VARCHAR(255) PRIMARY KEY,
     prompt TEXT NOT NULL,
+    route VARCHAR(50) NULL,
     response JSON NOT NULL,
     completion_tokens INT NOT NULL,
     prompt_tokens INT NOT NULL,
     total_tokens INT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    tenant_id VARCHAR(64) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_openai_responses_tenant_id (tenant_id)
 );
 
 -- --------------------------------------------------------
@@ -22,7 +25,7 @@ CREATE TABLE openai_responses (
 -- Table structure for table `transactions`
 --
 
-CREATE TABLE transactions (
+CREATE TABLE IF NOT EXISTS transactions (
     id INT AUTO_INCREMENT PRIMARY KEY,
     category VARCHAR(255) NOT NULL,
     amount DECIMAL(10, 2) NOT NULL,
@@ -31,8 +34,14 @@ CREATE TABLE transactions (
     note TEXT,
     paid_at DATE NULL,
     openai_response_chat_id VARCHAR(255),
+    sheet_row INT NULL,
+    tenant_id VARCHAR(64) NULL,
+    journal_key VARCHAR(255) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_transactions_journal_key (journal_key),
     INDEX idx_openai_response_chat_id (openai_response_chat_id),
+    INDEX idx_sheet_row (sheet_row),
+    INDEX idx_tenant_id_sheet_row (tenant_id, sheet_row),
     CONSTRAINT fk_openai_response_chat_id
     FOREIGN KEY (openai_response_chat_id) REFERENCES openai_responses(chat_id)
 );
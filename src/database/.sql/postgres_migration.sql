@@ -0,0 +1,23 @@
+-- --------------------------------------------------------
+
+--
+-- Upgrade of tables created before the journal, the sheet sync and the tenants
+-- Safe to run more than once (supabase: paste it in the SQL editor)
+--
+
+ALTER TABLE openai_responses ADD COLUMN IF NOT EXISTS route VARCHAR(50) NULL;
+ALTER TABLE openai_responses ADD COLUMN IF NOT EXISTS tenant_id VARCHAR(64) NULL;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS sheet_row INT NULL;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS tenant_id VARCHAR(64) NULL;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS journal_key TEXT NULL;
+
+-- --------------------------------------------------------
+
+--
+-- Keys and indexes of the new columns
+--
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_transactions_journal_key ON transactions (journal_key);
+CREATE INDEX IF NOT EXISTS idx_sheet_row ON transactions (sheet_row);
+CREATE INDEX IF NOT EXISTS idx_tenant_id_sheet_row ON transactions (tenant_id, sheet_row);
+CREATE INDEX IF NOT EXISTS idx_openai_responses_tenant_id ON openai_responses (tenant_id);
@@ -6,13 +6,15 @@ SET TIME ZONE 'Europe/Rome';
 -- Table structure for table `openai_responses`
 --
 
-CREATE TABLE openai_responses (
+CREATE TABLE IF NOT EXISTS openai_responses (
     chat_id TEXT PRIMARY KEY,
     prompt TEXT NOT NULL,
+    route VARCHAR(50) NULL,
     response JSONB NOT NULL,
     completion_tokens INT NOT NULL,
     prompt_tokens INT NOT NULL,
     total_tokens INT NOT NULL,
+    tenant_id VARCHAR(64) NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -22,7 +24,7 @@ CREATE TABLE openai_responses (
 -- Table structure for table `transactions`
 --
 
-CREATE TABLE transactions (
+CREATE TABLE IF NOT EXISTS transactions (
     id SERIAL PRIMARY KEY,
     category TEXT NOT NULL,
     amount NUMERIC(10, 2) NOT NULL,
@@ -31,6 +33,9 @@ CREATE TABLE transactions (
     note TEXT,
     paid_at DATE NULL,
     openai_response_chat_id TEXT,
+    sheet_row INT NULL,
+    tenant_id VARCHAR(64) NULL,
+    journal_key TEXT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_openai_response_chat_id FOREIGN KEY (openai_response_chat_id) REFERENCES openai_responses(chat_id) ON DELETE SET NULL
 );
@@ -41,4 +46,8 @@ CREATE TABLE transactions (
 -- Constraints for dumped tables
 --
 
-CREATE INDEX idx_openai_response_chat_id ON transactions (openai_response_chat_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_transactions_journal_key ON transactions (journal_key);
+CREATE INDEX IF NOT EXISTS idx_openai_response_chat_id ON transactions (openai_response_chat_id);
+CREATE INDEX IF NOT EXISTS idx_sheet_row ON transactions (sheet_row);
+CREATE INDEX IF NOT EXISTS idx_tenant_id_sheet_row ON transactions (tenant_id, sheet_row);
+CREATE INDEX IF NOT EXISTS idx_openai_responses_tenant_id ON openai_responses (tenant_id);
@@ -1,4 +1,20 @@
+class SchemaError(RuntimeError):
+    """
+    The database tables are older than the bot (src/database/.sql/*_migration.sql not applied)
+    """
+
 class DatabaseInterface:
+    # unique key of each table: retried inserts skip the rows already written
+    KEYS = {
+        'openai_responses': 'chat_id',
+        'transactions': 'journal_key'
+    }
+    # columns added by src/database/.sql/*_migration.sql
+    MIGRATED_COLUMNS = {
+        'openai_responses': ('route', 'tenant_id'),
+        'transactions': ('sheet_row', 'tenant_id', 'journal_key')
+    }
+
     def __init__(self):
         """
         Initializes the database interface
@@ -14,4 +30,79 @@ class DatabaseInterface:
         Returns:
             dict: The response from the database
         """
-        pass
\ No newline at end of file
+        pass
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            list: The responses from the database
+        """
+        # fallback for backends without a multi-row insert
+        return [self.insert(table_name, row) for row in rows]
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables, in order (atomically where the backend supports it)
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            list: The responses from the database
+        """
+        return [self.bulk_insert(table_name, rows) for table_name, rows in batches if rows]
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            dict: The response from the database
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support updates")
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            dict: The response from the database
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support deletes")
+
+    def missing_schema(self):
+        """
+        Lists the migrated columns and unique keys missing from the database
+        Returns:
+            list: The missing items (e.g. "transactions.journal_key"), empty if the backend cannot tell
+        """
+        return []
+
+    def missing_from(self, columns, unique_columns):
+        """
+        Compares the database schema with the migrated one
+        Args:
+            columns (set): The (table, column) pairs of the database
+            unique_columns (set): The (table, column) pairs with a single column unique key
+        Returns:
+            list: The missing items
+        """
+        missing = [f"{table_name}.{column}" for table_name, names in self.MIGRATED_COLUMNS.items() for column in names if (table_name, column) not in columns]
+        # the upserts resolve their conflicts on the table keys
+        missing += [f"unique key on {table_name}.{key}" for table_name, key in self.KEYS.items() if (table_name, key) not in unique_columns]
+        return missing
+
+    def check_schema(self):
+        """
+        Refuses a database whose tables were not migrated: the idempotent inserts and the tenant scopes need them
+        """
+        missing = self.missing_schema()
+        if missing:
+            raise SchemaError(f"The database schema is not migrated (missing {', '.join(missing)}): apply the migration script of src/database/.sql, see the README")
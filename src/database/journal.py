@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+class Journal:
+    """
+    Durable append-only journal of the writes still to deliver to Google Sheets and the database
+    """
+    # delivery targets
+    TARGETS = ('sheet', 'db')
+
+    def __init__(self, path):
+        """
+        Opens (and creates) the journal
+        Args:
+            path (str): The SQLite file path
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # one connection shared by the event loop and the flusher thread
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.lock = threading.Lock()
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                sheet_done INTEGER NOT NULL DEFAULT 0,
+                db_done INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_journal_sheet ON journal (sheet_done, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS idx_journal_db ON journal (db_done, next_attempt_at);
+        ''')
+
+    def append(self, entries):
+        """
+        Commits entries to the journal in one transaction, ignoring already known keys
+        Args:
+            entries (list): Dicts with idempotency_key, kind, payload and the targets to skip (sheet_done, db_done)
+        """
+        now = time.time()
+        rows = [
+            (entry['idempotency_key'], entry['kind'], json.dumps(entry['payload'], ensure_ascii=False), int(entry.get('sheet_done', False)), int(entry.get('db_done', False)), now)
+            for entry in entries
+        ]
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO journal (idempotency_key, kind, payload, sheet_done, db_done, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+
+    def pending(self, target, limit=100):
+        """
+        Returns the entries not yet delivered to a target, oldest first
+        Args:
+            target (str): sheet or db
+            limit (int): The maximum number of entries
+        Returns:
+            list: Dicts with id, idempotency_key, kind and payload
+        """
+        # transactions reach the database only once their sheet row is known
+        condition = "AND (kind != 'transaction' OR sheet_done = 1)" if target == 'db' else ''
+        with self.lock:
+            cursor = self.conn.execute(
+                f'SELECT id, idempotency_key, kind, payload FROM journal WHERE {self._column(target)} = 0 AND next_attempt_at <= ? {condition} ORDER BY id LIMIT ?',
+                (time.time(), limit)
+            )
+            rows = cursor.fetchall()
+        return [{'id': row[0], 'idempotency_key': row[1], 'kind': row[2], 'payload': json.loads(row[3])} for row in rows]
+
+    def mark_done(self, ids, target):
+        """
+        Marks entries as delivered to a target and drops fully delivered ones
+        Args:
+            ids (list): The entry ids
+            target (str): sheet or db
+        """
+        if not ids:
+            return
+        placeholders = ','.join('?' * len(ids))
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.execute(f'UPDATE journal SET {self._column(target)} = 1, attempts = 0, last_error = NULL WHERE id IN ({placeholders})', ids)
+                self.conn.execute('DELETE FROM journal WHERE sheet_done = 1 AND db_done = 1')
+
+    def update_payloads(self, payloads):
+        """
+        Replaces the payload of entries (e.g. to add the sheet row once known)
+        Args:
+            payloads (dict): The new payload of each entry id
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.executemany(
+                    'UPDATE journal SET payload = ? WHERE id = ?',
+                    [(json.dumps(payload, ensure_ascii=False), entry_id) for entry_id, payload in payloads.items()]
+                )
+
+    def mark_failed(self, ids, error, base_delay=2, max_delay=600):
+        """
+        Schedules a retry with jittered exponential backoff
+        Args:
+            ids (list): The entry ids
+            error (Exception): The delivery error
+            base_delay (float): The first retry delay (seconds)
+            max_delay (float): The maximum retry delay (seconds)
+        """
+        if not ids:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                for entry_id in ids:
+                    attempts = self.conn.execute('SELECT attempts FROM journal WHERE id = ?', (entry_id,)).fetchone()[0] + 1
+                    delay = min(max_delay, base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                    self.conn.execute(
+                        'UPDATE journal SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                        (attempts, time.time() + delay, str(error), entry_id)
+                    )
+
+    def mark_dead(self, errors, target):
+        """
+        Parks entries that can never be delivered to a target (dead letters, kept for inspection)
+        Args:
+            errors (dict): The delivery error of each entry id
+            target (str): sheet or db
+        """
+        if not errors:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.executemany(
+                    f'UPDATE journal SET {self._column(target)} = -1, attempts = attempts + 1, last_error = ? WHERE id = ?',
+                    [(str(error), entry_id) for entry_id, error in errors.items()]
+                )
+
+    def size(self):
+        """
+        Returns the number of entries not fully delivered (dead letters excluded)
+        Returns:
+            int: The journal size
+        """
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM journal WHERE sheet_done >= 0 AND db_done >= 0').fetchone()[0]
+
+    def close(self):
+        """
+        Closes the journal connection
+        """
+        with self.lock:
+            self.conn.close()
+
+    def _column(self, target):
+        # whitelist the target column used in the queries
+        if target not in self.TARGETS:
+            raise ValueError(f"Unknown journal target: {target}")
+        return f'{target}_done'
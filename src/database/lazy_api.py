@@ -0,0 +1,43 @@
+import threading
+from database.database_interface import DatabaseInterface
+
+class LazyAPI(DatabaseInterface):
+    """
+    Database connection opened on first use: the driver import and the connection stay off the startup path
+    """
+    def __init__(self, factory):
+        """
+        Initializes the deferred connection
+        Args:
+            factory (callable): Opens the real connection (helper.connect_db)
+        """
+        self.factory = factory
+        self.api = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Opens the connection once
+        Returns:
+            DatabaseInterface: The real connection
+        """
+        if self.api is None:
+            with self.lock:
+                if self.api is None:
+                    self.api = self.factory()
+        return self.api
+
+    def insert(self, table_name, data):
+        return self.connect().insert(table_name, data)
+
+    def bulk_insert(self, table_name, rows):
+        return self.connect().bulk_insert(table_name, rows)
+
+    def insert_many(self, batches):
+        return self.connect().insert_many(batches)
+
+    def update(self, table_name, data, match):
+        return self.connect().update(table_name, data, match)
+
+    def delete(self, table_name, match):
+        return self.connect().delete(table_name, match)
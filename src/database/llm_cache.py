@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+class LLMCache:
+    """
+    On-disk LRU + TTL cache of LLM responses
+    """
+    def __init__(self, path, ttl=2592000, max_entries=5000):
+        """
+        Opens (and creates) the cache
+        Args:
+            path (str): The SQLite file path
+            ttl (float): Seconds an entry stays valid
+            max_entries (int): Entries kept before the least recently used are evicted
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # one connection shared by the openai pool threads
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                model TEXT,
+                base_date TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at);
+        ''')
+
+    def get(self, cache_key):
+        """
+        Returns a cached entry and marks it as recently used
+        Args:
+            cache_key (str): The entry key
+        Returns:
+            dict: content and base_date, None on miss or expired entry
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT content, base_date, created_at FROM llm_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl:
+                self.conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (cache_key,))
+                return None
+            self.conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE cache_key = ?', (now, cache_key))
+        return {'content': json.loads(row[0]), 'base_date': row[1]}
+
+    def put(self, cache_key, content, model, base_date):
+        """
+        Stores an entry, evicting expired and least recently used ones
+        Args:
+            cache_key (str): The entry key
+            content (Any): The parsed response content
+            model (str): The model that produced it
+            base_date (str): The date (yyyy-mm-dd) relative dates were resolved against
+        """
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO llm_cache (cache_key, content, model, base_date, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (cache_key, json.dumps(content, ensure_ascii=False), model, base_date, now, now)
+                )
+                self.conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+                self.conn.execute(
+                    'DELETE FROM llm_cache WHERE cache_key IN (SELECT cache_key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+
+    def size(self):
+        """
+        Returns the number of cached entries
+        Returns:
+            int: The cache size
+        """
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
@@ -0,0 +1,406 @@
+import os
+import re
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from database.database_interface import DatabaseInterface
+
+class LocalStore(DatabaseInterface):
+    """
+    Embedded SQLite read model mirroring the transactions written by the bot and the items sheet
+    """
+    def __init__(self, path):
+        """
+        Opens (and creates) the local store
+        Args:
+            path (str): The SQLite file path
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.Lock()
+        # same columns as the transactions table, plus the sheet row it mirrors
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS openai_responses (
+                chat_id TEXT PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                route TEXT,
+                response TEXT NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                amount REAL,
+                currency TEXT DEFAULT 'EUR',
+                payment_method TEXT NOT NULL,
+                note TEXT,
+                paid_at TEXT,
+                openai_response_chat_id TEXT,
+                sheet_row INTEGER,
+                journal_key TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_transactions_paid_at ON transactions (paid_at);
+            CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (category);
+            CREATE INDEX IF NOT EXISTS idx_transactions_payment_method ON transactions (payment_method);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_sheet_row ON transactions (sheet_row);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS sheet_rows (
+                sheet_row INTEGER PRIMARY KEY,
+                hash TEXT NOT NULL
+            );
+        ''')
+        # stores created before journal_key existed
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(transactions)')]
+        if 'journal_key' not in columns:
+            self.conn.execute('ALTER TABLE transactions ADD COLUMN journal_key TEXT')
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_journal_key ON transactions (journal_key)')
+
+    def insert(self, table_name, data):
+        """
+        Insert a record into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            data (dict): A dictionary representing the record to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, [data])])
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, rows)])
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables in one transaction
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            int: The number of inserted rows
+        """
+        count = 0
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                for table_name, rows in batches:
+                    if not rows:
+                        continue
+                    columns = list(dict.fromkeys(column for row in rows for column in row)) + ['created_at']
+                    self.conn.executemany(
+                        f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        [tuple(row.get(column) for column in columns[:-1]) + (now,) for row in rows]
+                    )
+                    count += len(rows)
+        return count
+
+    def is_backfilled(self):
+        """
+        Returns whether the store was loaded from the sheet
+        Returns:
+            bool: True once the sheet history is mirrored
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'backfilled_at'").fetchone()
+        return row is not None
+
+    def backfill(self, rows):
+        """
+        Loads the items sheet history (header first, as read from items!B:G)
+        Args:
+            rows (list): The sheet rows
+        Returns:
+            int: The number of loaded rows
+        """
+        values = []
+        # sheet rows are 1-based, the header is row 1
+        for index, row in enumerate(rows[1:], start=2):
+            transaction = sheet_row_values(row, index)
+            if transaction:
+                values.append(transaction)
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                # rows mirrored by the bot and already appended are part of the sheet history,
+                # the ones still waiting for their sheet row are not
+                self.conn.execute('DELETE FROM transactions WHERE journal_key IS NULL OR sheet_row IS NOT NULL')
+                columns = list(values[0]) + ['created_at'] if values else []
+                if values:
+                    now = time.time()
+                    self.conn.executemany(
+                        f"INSERT INTO transactions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        [tuple(value[column] for column in columns[:-1]) + (now,) for value in values]
+                    )
+                # the backfilled rows are the sync baseline
+                self.conn.execute('DELETE FROM sheet_rows')
+                self.conn.executemany('INSERT INTO sheet_rows (sheet_row, hash) VALUES (?, ?)', [(value['sheet_row'], row_hash(value)) for value in values])
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sync_watermark', ?)", (str(len(rows)),))
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled_at', ?)", (datetime.now().isoformat(),))
+        return len(values)
+
+    def export_rows(self, header, page_size=1000):
+        """
+        Yields the transactions as sheet rows (header first), in sheet order
+        Args:
+            header (list): The header row
+            page_size (int): The number of rows read per query
+        Yields:
+            list: The rows
+        """
+        yield list(header)
+        last_id = 0
+        while True:
+            # keyset pagination: constant cost per page
+            with self.lock:
+                page = self.conn.execute(
+                    'SELECT id, paid_at, payment_method, category, note, amount FROM transactions WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, page_size)
+                ).fetchall()
+            if not page:
+                return
+            for row in page:
+                yield [format_date(row[1]), row[2], row[3], row[4], row[5]]
+            last_id = page[-1][0]
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records
+        Returns:
+            int: The number of updated rows
+        """
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(
+                    f"UPDATE {table_name} SET {', '.join(f'{column} = ?' for column in data)} WHERE {' AND '.join(f'{column} = ?' for column in match)}",
+                    tuple(data.values()) + tuple(match.values())
+                ).rowcount
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records
+        Returns:
+            int: The number of deleted rows
+        """
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(
+                    f"DELETE FROM {table_name} WHERE {' AND '.join(f'{column} = ?' for column in match)}",
+                    tuple(match.values())
+                ).rowcount
+
+    def get_meta(self, key):
+        """
+        Returns a meta value
+        Args:
+            key (str): The meta key
+        Returns:
+            str: The value, None if missing
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        """
+        Stores a meta value
+        Args:
+            key (str): The meta key
+            value (str): The value
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def sheet_hashes(self, from_row):
+        """
+        Returns the content hash of the synced sheet rows from a row on
+        Args:
+            from_row (int): The first sheet row
+        Returns:
+            dict: The hash of each sheet row
+        """
+        with self.lock:
+            return dict(self.conn.execute('SELECT sheet_row, hash FROM sheet_rows WHERE sheet_row >= ?', (from_row,)).fetchall())
+
+    def transaction_keys(self, first_date, last_date, exclude_chat_ids=()):
+        """
+        Returns the (date, amount, note) key of each transaction between two dates
+        Args:
+            first_date (str): The first yyyy-mm-dd date
+            last_date (str): The last yyyy-mm-dd date
+            exclude_chat_ids (list): Responses whose transactions are left out
+        Returns:
+            list: The keys, one per transaction (repeated keys are repeated)
+        """
+        sql = 'SELECT paid_at, amount, note FROM transactions WHERE paid_at BETWEEN ? AND ?'
+        params = (first_date, last_date)
+        if exclude_chat_ids:
+            sql += f" AND (openai_response_chat_id IS NULL OR openai_response_chat_id NOT IN ({', '.join('?' * len(exclude_chat_ids))}))"
+            params += tuple(exclude_chat_ids)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [import_key(paid_at, amount, note) for paid_at, amount, note in rows]
+
+    def unassigned_rows(self):
+        """
+        Returns the mirrored bot transactions that have no sheet row yet, by content hash
+        Returns:
+            dict: The journal keys of each hash, oldest first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT journal_key, paid_at, payment_method, category, note, amount FROM transactions WHERE journal_key IS NOT NULL AND sheet_row IS NULL ORDER BY id'
+            ).fetchall()
+        unassigned = {}
+        for journal_key, paid_at, payment_method, category, note, amount in rows:
+            values = {'paid_at': paid_at, 'payment_method': payment_method, 'category': category, 'note': note, 'amount': amount}
+            unassigned.setdefault(row_hash(values), []).append(journal_key)
+        return unassigned
+
+    def assign_sheet_rows(self, assignments):
+        """
+        Links mirrored bot transactions to the sheet rows they were appended to
+        Args:
+            assignments (list): (journal_key, sheet_row, hash) tuples
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                for journal_key, sheet_row, hash in assignments:
+                    # a row synced from the sheet at this index is the same row: the bot copy replaces it
+                    self.conn.execute('DELETE FROM transactions WHERE sheet_row = ? AND journal_key IS NULL', (sheet_row,))
+                    # a row previously synced at this index was shifted/replaced
+                    self.conn.execute('UPDATE transactions SET sheet_row = NULL WHERE sheet_row = ? AND journal_key IS NOT ?', (sheet_row, journal_key))
+                    self.conn.execute('UPDATE transactions SET sheet_row = ? WHERE journal_key = ?', (sheet_row, journal_key))
+                    self.conn.execute('INSERT OR REPLACE INTO sheet_rows (sheet_row, hash) VALUES (?, ?)', (sheet_row, hash))
+
+    def apply_sheet_delta(self, upserts, deletes, watermark):
+        """
+        Applies the sheet changes found by a sync in one transaction
+        Args:
+            upserts (list): transactions values (with sheet_row) of new or changed rows
+            deletes (list): The sheet rows that were emptied or removed
+            watermark (int): The last sheet row read
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                for sheet_row in deletes:
+                    self.conn.execute('DELETE FROM transactions WHERE sheet_row = ?', (sheet_row,))
+                    self.conn.execute('DELETE FROM sheet_rows WHERE sheet_row = ?', (sheet_row,))
+                for values in upserts:
+                    columns = list(values)
+                    updated = self.conn.execute(
+                        f"UPDATE transactions SET {', '.join(f'{column} = ?' for column in columns)} WHERE sheet_row = ?",
+                        tuple(values.values()) + (values['sheet_row'],)
+                    ).rowcount
+                    if not updated:
+                        self.conn.execute(
+                            f"INSERT INTO transactions ({', '.join(columns)}, created_at) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                            tuple(values.values()) + (time.time(),)
+                        )
+                    self.conn.execute('INSERT OR REPLACE INTO sheet_rows (sheet_row, hash) VALUES (?, ?)', (values['sheet_row'], row_hash(values)))
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sync_watermark', ?)", (str(watermark),))
+
+    def close(self):
+        """
+        Closes the local store connection
+        """
+        with self.lock:
+            self.conn.close()
+
+# content hash of transactions values (formatting independent)
+def row_hash(values: dict) -> str:
+    amount = values.get('amount')
+    content = [
+        values.get('paid_at'),
+        str(values.get('payment_method') or '').strip().lower(),
+        str(values.get('category') or '').strip().lower(),
+        str(values.get('note') or '').strip().lower(),
+        round(amount, 2) if isinstance(amount, float) else amount
+    ]
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# key of an imported statement row: same day, amount and note
+def import_key(paid_at: str, amount, note) -> tuple:
+    return (paid_at, round(amount, 2) if isinstance(amount, (int, float)) else amount, str(note or '').strip().lower())
+
+# convert a dd/mm/yyyy sheet date to yyyy-mm-dd (None if invalid)
+def parse_date(value: str) -> str:
+    try:
+        return datetime.strptime(re.sub(r'[^0-9/]', '', value), '%d/%m/%Y').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+# convert a yyyy-mm-dd store date to dd/mm/yyyy
+def format_date(value: str) -> str:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%d/%m/%Y')
+    except (TypeError, ValueError):
+        return ''
+
+# formatted amount: optional thousands groups, then 1-2 decimals after the other separator
+AMOUNT_PATTERN = r'(?P<integer>-?(?:[1-9]\d{0,2}(?P<thousands>[.,])\d{3}(?:(?P=thousands)\d{3})*|\d+))(?:(?P<decimal>[.,])(?P<decimals>\d{1,2}))?'
+
+# convert a formatted sheet amount ("€ -1.234,50", "1,234.50", "-2.5", 10) to a number (None if invalid or ambiguous)
+def parse_amount(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(AMOUNT_PATTERN, re.sub(r'[^\d,.\-]', '', str(value)))
+    # the last separator is the decimal one: "1.234.5" or "1,234,50" are not amounts
+    if match is None or (match['thousands'] and match['thousands'] == match['decimal']):
+        return None
+    return float(re.sub(r'[.,]', '', match['integer']) + '.' + (match['decimals'] or '0'))
+
+# build transactions values from a sheet row (items!B:G), None for empty rows
+def sheet_row_values(row: list, sheet_row: int = None) -> dict:
+    cells = list(row[:5]) + [''] * (5 - len(row[:5]))
+    if not any(str(cell).strip() for cell in cells):
+        return None
+    date, payment_method, category, note, amount = cells
+    return {
+        'category': str(category),
+        'amount': parse_amount(amount),
+        'payment_method': str(payment_method),
+        'note': str(note),
+        'paid_at': parse_date(str(date)),
+        'sheet_row': sheet_row
+    }
+
+# build transactions values from a parsed transaction (as written by the bot)
+def transaction_values(transaction: dict, chat_id: str = None) -> dict:
+    return {
+        'category': transaction['category'],
+        'amount': parse_amount(transaction['amount']),
+        'payment_method': transaction['payment_method'],
+        'note': transaction['note'],
+        'paid_at': parse_date(transaction['date']),
+        'openai_response_chat_id': chat_id
+    }
@@ -0,0 +1,217 @@
+import os
+import threading
+import pymysql
+import pymysql.cursors
+from database.database_interface import DatabaseInterface
+
+class SqlAPI(DatabaseInterface):
+    # identifier quote per driver
+    QUOTES = {
+        'mysql': '`',
+        'postgres': '"'
+    }
+
+    def __init__(self, driver='mysql'):
+        """
+        Initializes a DB-API connection (pymysql or psycopg2) using configuration from the .env file
+        Args:
+            driver (str): mysql or postgres
+        """
+        if driver not in self.QUOTES:
+            raise RuntimeError(f"Unsupported database driver: {driver}")
+        self.driver = driver
+        self.quote = self.QUOTES[driver]
+        # DB-API connections are not thread safe
+        self.lock = threading.Lock()
+        self.conn = self.connect()
+        self.check_schema()
+
+    def connect(self):
+        """
+        Opens the connection
+        Returns:
+            Connection: The DB-API connection
+        """
+        if self.driver == 'mysql':
+            return pymysql.connect(
+                host=os.getenv('DB_HOST'),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                db=os.getenv('DB_NAME'),
+                charset='utf8mb4',
+                cursorclass=pymysql.cursors.DictCursor
+            )
+        try:
+            import psycopg2
+        except ImportError:
+            raise RuntimeError("psycopg2 must be installed to use the postgres database service.")
+        return psycopg2.connect(
+            host=os.getenv('DB_HOST'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            dbname=os.getenv('DB_NAME')
+        )
+
+    def missing_schema(self):
+        """
+        Lists the migrated columns and unique keys missing from the database
+        Returns:
+            list: The missing items
+        """
+        tables = ', '.join(f"'{table_name}'" for table_name in self.MIGRATED_COLUMNS)
+        if self.driver == 'mysql':
+            columns_sql = f"SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({tables})"
+            unique_sql = f"SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({tables}) AND NON_UNIQUE = 0 AND SEQ_IN_INDEX = 1"
+        else:
+            columns_sql = f"SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name IN ({tables})"
+            # unique indexes (primary keys and UNIQUE constraints included) on a single column
+            unique_sql = (
+                "SELECT t.relname, a.attname FROM pg_index i JOIN pg_class t ON t.oid = i.indrelid "
+                "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0] "
+                f"WHERE i.indisunique AND i.indnatts = 1 AND t.relnamespace = current_schema()::regnamespace AND t.relname IN ({tables})"
+            )
+        with self.lock:
+            try:
+                with self.conn.cursor() as cursor:
+                    # pymysql returns dicts, psycopg2 tuples
+                    cursor.execute(columns_sql)
+                    columns = {tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in cursor.fetchall()}
+                    cursor.execute(unique_sql)
+                    unique_columns = {tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in cursor.fetchall()}
+            finally:
+                # do not keep the read transaction open
+                self.conn.rollback()
+        return self.missing_from(columns, unique_columns)
+
+    def insert(self, table_name, data):
+        """
+        Insert a record into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            data (dict): A dictionary representing the record to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.bulk_insert(table_name, [data])
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table with a single executemany
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, rows)])
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables in one database transaction
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            int: The number of inserted rows
+        """
+        count = 0
+        with self.lock:
+            try:
+                with self.conn.cursor() as cursor:
+                    for table_name, rows in batches:
+                        if not rows:
+                            continue
+                        sql, params = self.insert_statement(table_name, rows)
+                        cursor.executemany(sql, params)
+                        count += len(rows)
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise RuntimeError(f"Failed to insert data into {', '.join(table for table, _ in batches)}: {e}")
+        return count
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of updated rows
+        """
+        q = self.quote
+        where, params = self.where(match)
+        sql = f"UPDATE {q}{table_name}{q} SET {', '.join(f'{q}{column}{q} = %s' for column in data)} WHERE {where}"
+        return self.execute(sql, tuple(data.values()) + params, f"Failed to update data in {table_name}")
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of deleted rows
+        """
+        q = self.quote
+        where, params = self.where(match)
+        sql = f"DELETE FROM {q}{table_name}{q} WHERE {where}"
+        return self.execute(sql, params, f"Failed to delete data from {table_name}")
+
+    def where(self, match):
+        """
+        Builds the condition matching all the given column values
+        Args:
+            match (dict): The column values (None matches NULL)
+        Returns:
+            Tuple[str, tuple]: The condition and its parameters
+        """
+        q = self.quote
+        # "= NULL" is never true
+        where = ' AND '.join(f'{q}{column}{q} IS NULL' if value is None else f'{q}{column}{q} = %s' for column, value in match.items())
+        return where, tuple(value for value in match.values() if value is not None)
+
+    def execute(self, sql, params, error):
+        """
+        Executes a statement in its own transaction
+        Args:
+            sql (str): The statement
+            params (tuple): The statement parameters
+            error (str): The error message prefix
+        Returns:
+            int: The number of affected rows
+        """
+        with self.lock:
+            try:
+                with self.conn.cursor() as cursor:
+                    count = cursor.execute(sql, params)
+                    count = cursor.rowcount if count is None else count
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                raise RuntimeError(f"{error}: {e}")
+        return count
+
+    def insert_statement(self, table_name, rows):
+        """
+        Builds a parametrized INSERT for the union of the rows columns, skipping duplicates of the table key
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            Tuple[str, list]: The statement and the parameters of each row
+        """
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        q = self.quote
+        sql = (
+            f"INSERT INTO {q}{table_name}{q} ({', '.join(f'{q}{column}{q}' for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        # rows already written by an earlier attempt are skipped
+        key = self.KEYS.get(table_name)
+        if key in columns:
+            if self.driver == 'mysql':
+                sql += f" ON DUPLICATE KEY UPDATE {q}{key}{q} = {q}{key}{q}"
+            else:
+                sql += f" ON CONFLICT ({q}{key}{q}) DO NOTHING"
+        return sql, [tuple(row.get(column) for column in columns) for row in rows]
@@ -0,0 +1,413 @@
+import os
+import re
+import json
+import asyncio
+import threading
+from sqlalchemy import MetaData, Table, create_engine, inspect
+from sqlalchemy.types import JSON
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.database_interface import DatabaseInterface
+
+# schema scripts of each dialect in src/database/.sql (the single schema definition, applied by hand for the other services)
+SCHEMA_SCRIPTS = {
+    'mysql': 'mysql',
+    'mariadb': 'mysql',
+    'postgresql': 'postgres'
+}
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sql')
+
+# split a schema script into its statements (each ends with ";" at the end of a line, "--" comment lines dropped)
+def sql_statements(path: str) -> list:
+    with open(path, encoding='utf-8') as file:
+        script = '\n'.join(line for line in file.read().splitlines() if not line.strip().startswith('--'))
+    return [statement.strip() for statement in re.split(r';\s*$', script, flags=re.MULTILINE) if statement.strip()]
+
+# create the missing tables and migrate the older ones (both scripts are idempotent)
+def ensure_schema(conn) -> None:
+    prefix = SCHEMA_SCRIPTS.get(conn.dialect.name)
+    if prefix is None:
+        raise RuntimeError(f"No schema script for {conn.dialect.name}: create the tables by hand and disable general.db.sqlalchemy.create_schema")
+    for script in ('structure', 'migration'):
+        for statement in sql_statements(os.path.join(SQL_DIR, f"{prefix}_{script}.sql")):
+            conn.exec_driver_sql(statement)
+
+# columns and single column unique keys (primary keys included) of the bot tables
+def schema_columns(conn) -> tuple:
+    inspector = inspect(conn)
+    columns = set()
+    unique_columns = set()
+    for table_name in DatabaseInterface.MIGRATED_COLUMNS:
+        if not inspector.has_table(table_name):
+            continue
+        columns |= {(table_name, column['name']) for column in inspector.get_columns(table_name)}
+        keys = [inspector.get_pk_constraint(table_name)['constrained_columns']]
+        keys += [index['column_names'] for index in inspector.get_indexes(table_name) if index['unique']]
+        keys += [constraint['column_names'] for constraint in inspector.get_unique_constraints(table_name)]
+        unique_columns |= {(table_name, key[0]) for key in keys if len(key) == 1}
+    return columns, unique_columns
+
+# pool options used when none are given
+DEFAULT_POOL_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 1800
+}
+
+# return the engine options
+def engine_options(pool_options: dict = None) -> dict:
+    options = {**DEFAULT_POOL_OPTIONS, **(pool_options or {})}
+    # test connections on checkout: dropped/idle-timed-out connections are replaced transparently
+    options['pool_pre_ping'] = True
+    return options
+
+# return the database url from the env var
+def database_url(url_env: str = 'DATABASE_URL') -> str:
+    url = os.getenv(url_env)
+    if not url:
+        raise RuntimeError(f"{url_env} must be set in the .env file to use the sqlalchemy database service.")
+    return url
+
+# decode JSON strings bound to JSON columns (they would be encoded twice)
+def coerce_rows(table: Table, rows: list) -> list:
+    json_columns = [column.name for column in table.columns if isinstance(column.type, JSON)]
+    if not json_columns:
+        return rows
+    coerced = []
+    for row in rows:
+        row = dict(row)
+        for name in json_columns:
+            if isinstance(row.get(name), str):
+                try:
+                    row[name] = json.loads(row[name])
+                except ValueError:
+                    pass
+        coerced.append(row)
+    return coerced
+
+# INSERT skipping the rows whose table key is already written (retried journal batches)
+def insert_statement(dialect: str, table: Table, key: str = None):
+    if key is None or key not in table.c:
+        return table.insert()
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        return insert(table).on_duplicate_key_update({key: table.c[key]})
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=[key])
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing(index_elements=[key])
+    return table.insert()
+
+# build the WHERE clauses of a column values match
+def match_clauses(table: Table, match: dict) -> list:
+    # None matches NULL ("= NULL" is never true)
+    return [table.c[column].is_(None) if value is None else table.c[column] == value for column, value in match.items()]
+
+class SQLAlchemyAPI(DatabaseInterface):
+    def __init__(self, url=None, pool_options=None, create_schema=True):
+        """
+        Initializes a pooled SQLAlchemy engine
+        Args:
+            url (str, optional): The database url, defaults to the DATABASE_URL env var
+            pool_options (dict, optional): pool_size, max_overflow, pool_timeout, pool_recycle
+            create_schema (bool): Apply the schema scripts of the dialect
+        """
+        self.engine = create_engine(url or database_url(), **engine_options(pool_options))
+        self.metadata = MetaData()
+        self.tables = {}
+        self._tables_lock = threading.Lock()
+
+        if create_schema:
+            self.create_schema()
+        self.check_schema()
+
+    def create_schema(self):
+        """
+        Creates the missing tables and migrates the older ones (src/database/.sql scripts of the dialect)
+        """
+        with self.engine.begin() as conn:
+            ensure_schema(conn)
+
+    def missing_schema(self):
+        """
+        Lists the migrated columns and unique keys missing from the database
+        Returns:
+            list: The missing items
+        """
+        with self.engine.connect() as conn:
+            return self.missing_from(*schema_columns(conn))
+
+    def table(self, table_name):
+        """
+        Returns a reflected table
+        Args:
+            table_name (str): The table name
+        Returns:
+            Table: The reflected table
+        """
+        table = self.tables.get(table_name)
+        if table is None:
+            with self._tables_lock:
+                table = self.tables.get(table_name)
+                if table is None:
+                    table = Table(table_name, self.metadata, autoload_with=self.engine)
+                    self.tables[table_name] = table
+        return table
+
+    def insert(self, table_name, data):
+        """
+        Insert a record into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            data (dict): A dictionary representing the record to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, [data])])
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table with a single executemany
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, rows)])
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables in one database transaction
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            int: The number of inserted rows
+        """
+        count = 0
+        try:
+            with self.engine.begin() as conn:
+                for table_name, rows in batches:
+                    if not rows:
+                        continue
+                    table = self.table(table_name)
+                    conn.execute(insert_statement(self.engine.dialect.name, table, self.KEYS.get(table_name)), coerce_rows(table, rows))
+                    count += len(rows)
+        except Exception as e:
+            raise RuntimeError(f"Failed to insert data into {', '.join(table for table, _ in batches)}: {e}")
+        return count
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of updated rows
+        """
+        table = self.table(table_name)
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(table.update().where(*match_clauses(table, match)).values(**coerce_rows(table, [data])[0])).rowcount
+        except Exception as e:
+            raise RuntimeError(f"Failed to update data in {table_name}: {e}")
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of deleted rows
+        """
+        table = self.table(table_name)
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(table.delete().where(*match_clauses(table, match))).rowcount
+        except Exception as e:
+            raise RuntimeError(f"Failed to delete data from {table_name}: {e}")
+
+class AsyncSQLAlchemyAPI(DatabaseInterface):
+    def __init__(self, url=None, pool_options=None, create_schema=True):
+        """
+        Initializes a pooled async SQLAlchemy engine running on its own event loop thread
+        Args:
+            url (str, optional): The database url with an async driver (e.g. mysql+aiomysql://, postgresql+asyncpg://)
+            pool_options (dict, optional): pool_size, max_overflow, pool_timeout, pool_recycle
+            create_schema (bool): Apply the schema scripts of the dialect
+        """
+        # the async pool is bound to one loop: keep a dedicated one so sync callers (thread pools) can use it too
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='db-async-loop', daemon=True).start()
+        self.engine = create_async_engine(url or database_url(), **engine_options(pool_options))
+        self.metadata = MetaData()
+        self.tables = {}
+
+        if create_schema:
+            self.run(self.create_schema())
+        self.check_schema()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the engine loop and waits for the result
+        Args:
+            coroutine (Coroutine): The coroutine
+        Returns:
+            Any: The coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def create_schema(self):
+        """
+        Creates the missing tables and migrates the older ones (src/database/.sql scripts of the dialect)
+        """
+        async with self.engine.begin() as conn:
+            await conn.run_sync(ensure_schema)
+
+    async def schema_columns_async(self):
+        """
+        Reads the columns and single column unique keys of the bot tables
+        Returns:
+            tuple: The (table, column) pairs of the columns and of the unique keys
+        """
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(schema_columns)
+
+    def missing_schema(self):
+        """
+        Lists the migrated columns and unique keys missing from the database
+        Returns:
+            list: The missing items
+        """
+        return self.missing_from(*self.run(self.schema_columns_async()))
+
+    async def table(self, conn, table_name):
+        """
+        Returns a reflected table
+        Args:
+            conn (AsyncConnection): The connection used to reflect the table
+            table_name (str): The table name
+        Returns:
+            Table: The reflected table
+        """
+        table = self.tables.get(table_name)
+        if table is None:
+            table = await conn.run_sync(lambda sync_conn: Table(table_name, self.metadata, autoload_with=sync_conn))
+            self.tables[table_name] = table
+        return table
+
+    async def insert_many_async(self, batches):
+        """
+        Insert records into several tables in one database transaction
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            int: The number of inserted rows
+        """
+        count = 0
+        try:
+            async with self.engine.begin() as conn:
+                for table_name, rows in batches:
+                    if not rows:
+                        continue
+                    table = await self.table(conn, table_name)
+                    await conn.execute(insert_statement(self.engine.dialect.name, table, self.KEYS.get(table_name)), coerce_rows(table, rows))
+                    count += len(rows)
+        except Exception as e:
+            raise RuntimeError(f"Failed to insert data into {', '.join(table for table, _ in batches)}: {e}")
+        return count
+
+    def insert(self, table_name, data):
+        """
+        Insert a record into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            data (dict): A dictionary representing the record to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, [data])])
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.insert_many([(table_name, rows)])
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables in one database transaction (blocking wrapper)
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            int: The number of inserted rows
+        """
+        return self.run(self.insert_many_async(batches))
+
+    async def update_async(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of updated rows
+        """
+        try:
+            async with self.engine.begin() as conn:
+                table = await self.table(conn, table_name)
+                result = await conn.execute(table.update().where(*match_clauses(table, match)).values(**coerce_rows(table, [data])[0]))
+                return result.rowcount
+        except Exception as e:
+            raise RuntimeError(f"Failed to update data in {table_name}: {e}")
+
+    async def delete_async(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of deleted rows
+        """
+        try:
+            async with self.engine.begin() as conn:
+                table = await self.table(conn, table_name)
+                result = await conn.execute(table.delete().where(*match_clauses(table, match)))
+                return result.rowcount
+        except Exception as e:
+            raise RuntimeError(f"Failed to delete data from {table_name}: {e}")
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values (blocking wrapper)
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of updated rows
+        """
+        return self.run(self.update_async(table_name, data, match))
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values (blocking wrapper)
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            int: The number of deleted rows
+        """
+        return self.run(self.delete_async(table_name, match))
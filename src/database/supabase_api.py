@@ -1,7 +1,13 @@
 import os
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from database.database_interface import DatabaseInterface
 
+# error codes of the schema probes: undefined column (postgres, postgrest), no unique key for ON CONFLICT, NOT NULL violation
+MISSING_COLUMN_CODES = ('42703', 'PGRST204')
+NO_CONFLICT_KEY_CODE = '42P10'
+NOT_NULL_CODE = '23502'
+
 class SupabaseAPI(DatabaseInterface):
     def __init__(self):
         """
@@ -18,6 +24,37 @@ class SupabaseAPI(DatabaseInterface):
             print('Connected to Supabase successfully')
         except Exception as e:
             print(f"Failed to connect to Supabase: {e}")
+            return
+
+        self.check_schema()
+
+    def missing_schema(self):
+        """
+        Lists the migrated columns and unique keys missing from the database (PostgREST exposes no catalog: probed)
+        Returns:
+            list: The missing items
+        """
+        missing = []
+        for table_name, columns in self.MIGRATED_COLUMNS.items():
+            for column in columns:
+                try:
+                    self.client.table(table_name).select(column).limit(1).execute()
+                except APIError as e:
+                    if e.code not in MISSING_COLUMN_CODES:
+                        raise
+                    missing.append(f"{table_name}.{column}")
+        for table_name, key in self.KEYS.items():
+            if f"{table_name}.{key}" in missing:
+                continue
+            try:
+                # the probe row breaks the NOT NULL columns and is never written, but without a unique key the conflict target is refused first
+                self.client.table(table_name).upsert({key: None}, on_conflict=key, ignore_duplicates=True).execute()
+            except APIError as e:
+                if e.code == NO_CONFLICT_KEY_CODE:
+                    missing.append(f"unique key on {table_name}.{key}")
+                elif e.code != NOT_NULL_CODE:
+                    raise
+        return missing
 
     def insert(self, table_name, data):
         """
@@ -32,4 +69,78 @@ class SupabaseAPI(DatabaseInterface):
             response = self.client.table(table_name).insert(data).execute()
             return response
         except Exception as e:
-            raise RuntimeError(f"Failed to insert data into {table_name}: {e}")
\ No newline at end of file
+            raise RuntimeError(f"Failed to insert data into {table_name}: {e}")
+
+    def bulk_insert(self, table_name, rows):
+        """
+        Insert several records into the specified table with a single request
+        Args:
+            table_name (str): The name of the table to insert data into
+            rows (list): A list of dictionaries representing the records to insert
+        Returns:
+            dict: The response from the database
+        """
+        if not rows:
+            return None
+        try:
+            response = self.client.table(table_name).insert(rows).execute()
+            return response
+        except Exception as e:
+            raise RuntimeError(f"Failed to insert data into {table_name}: {e}")
+
+    def insert_many(self, batches):
+        """
+        Insert records into several tables, one request per table
+        PostgREST has no multi-table transaction: rows are upserted on their table key (KEYS), so a retry after a partial failure skips the rows already written
+        Args:
+            batches (list): A list of (table_name, rows) tuples
+        Returns:
+            list: The responses from the database
+        """
+        responses = []
+        for table_name, rows in batches:
+            if not rows:
+                continue
+            if table_name not in self.KEYS:
+                responses.append(self.bulk_insert(table_name, rows))
+                continue
+            try:
+                responses.append(self.client.table(table_name).upsert(rows, on_conflict=self.KEYS[table_name], ignore_duplicates=True).execute())
+            except Exception as e:
+                raise RuntimeError(f"Failed to insert data into {table_name}: {e}")
+        return responses
+
+    def update(self, table_name, data, match):
+        """
+        Update the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to update
+            data (dict): The columns to set
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            dict: The response from the database
+        """
+        try:
+            return match_filters(self.client.table(table_name).update(data), match).execute()
+        except Exception as e:
+            raise RuntimeError(f"Failed to update data in {table_name}: {e}")
+
+    def delete(self, table_name, match):
+        """
+        Delete the records matching all the given column values
+        Args:
+            table_name (str): The name of the table to delete from
+            match (dict): The column values identifying the records (None matches NULL)
+        Returns:
+            dict: The response from the database
+        """
+        try:
+            return match_filters(self.client.table(table_name).delete(), match).execute()
+        except Exception as e:
+            raise RuntimeError(f"Failed to delete data from {table_name}: {e}")
+
+# filter a query on column values (eq.null would compare with the "null" string: NULL uses is.null)
+def match_filters(query, match: dict):
+    for column, value in match.items():
+        query = query.is_(column, 'null') if value is None else query.eq(column, value)
+    return query
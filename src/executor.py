@@ -0,0 +1,37 @@
+import asyncio
+import functools
+import threading
+import helper
+from concurrent.futures import ThreadPoolExecutor
+
+# default number of worker threads per backend
+DEFAULT_WORKERS = 4
+
+# one bounded thread pool per backend (openai, google_sheet, db)
+_pools = {}
+_pools_lock = threading.Lock()
+
+# return the thread pool of a backend
+def pool(backend: str) -> ThreadPoolExecutor:
+    executor = _pools.get(backend)
+    if executor is None:
+        with _pools_lock:
+            executor = _pools.get(backend)
+            if executor is None:
+                # concurrency limit from settings.json (general.concurrency.{backend})
+                workers = helper.config(f'general.concurrency.{backend}') or DEFAULT_WORKERS
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{backend}-worker')
+                _pools[backend] = executor
+    return executor
+
+# run a blocking call on the backend pool without blocking the event loop
+async def run(backend: str, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool(backend), functools.partial(func, *args, **kwargs))
+
+# stop all pools
+def shutdown(wait: bool = True) -> None:
+    with _pools_lock:
+        for executor in _pools.values():
+            executor.shutdown(wait=wait)
+        _pools.clear()
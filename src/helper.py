@@ -1,14 +1,24 @@
 import re
 import os
+import csv
 import json
 import io
-import pandas as pd
-import pymysql
-import pymysql.cursors
-import xlsxwriter
-from typing import Any, Union
+import time
+import uuid
+import tempfile
+import threading
+import metrics
+from types import MappingProxyType
+from typing import Any, NamedTuple, Union, TYPE_CHECKING
 from datetime import datetime
-from database.supabase_api import SupabaseAPI
+from database.database_interface import DatabaseInterface
+from database.lazy_api import LazyAPI
+from database.local_store import LocalStore
+
+# heavy libraries and backends are imported on first use (startup time)
+if TYPE_CHECKING:
+    import pandas as pd
+    from openai.types.chat import ChatCompletion
 
 # return cleaned response
 def sanitize_response(decoded_content: dict) -> list:
@@ -23,9 +33,35 @@ def sanitize_response(decoded_content: dict) -> list:
     if extracted_array is None:
         extracted_array = decoded_content
 
-    required_fields = {'date', 'amount', 'payment_method', 'category', 'note'}
+    transactions = []
+    for obj in extracted_array if isinstance(extracted_array, list) else []:
+        try:
+            transactions.append(normalize_transaction(obj))
+        except ValueError as e:
+            # never journal what the sheet and the database would reject forever
+            print(f"Malformed transaction dropped: {e}")
+    return transactions
 
-    return [obj for obj in extracted_array if required_fields.issubset(obj.keys())]
+# check the fields of a transaction and return it with a clean date and a numeric amount (ValueError if malformed)
+def normalize_transaction(transaction: dict) -> dict:
+    required_fields = {'date', 'amount', 'payment_method', 'category', 'note'}
+    if not isinstance(transaction, dict) or not required_fields.issubset(transaction.keys()):
+        raise ValueError(f"missing fields in {transaction!r}")
+    for field in ('date', 'payment_method', 'category', 'note'):
+        if not isinstance(transaction[field], str):
+            raise ValueError(f"{field} is not a text: {transaction[field]!r}")
+    date = format_date(transaction['date'])
+    # raises ValueError on anything but dd/mm/yyyy
+    format_db_date(date)
+    amount = transaction['amount']
+    if isinstance(amount, str):
+        try:
+            amount = float(amount.strip())
+        except ValueError:
+            raise ValueError(f"amount is not a number: {amount!r}")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount != amount or amount in (float('inf'), float('-inf')):
+        raise ValueError(f"amount is not a number: {amount!r}")
+    return {**transaction, 'date': date, 'amount': amount}
 
 # get file path
 def get_file_path(name: str = 'settings.json') -> str:
@@ -34,92 +70,216 @@ def get_file_path(name: str = 'settings.json') -> str:
     # build settings.json path
     return os.path.join(current_dir, 'config', name)
 
-# load settings.json file
-def load_settings() -> dict:
+# resolve a configured path ("src/data/store.db") from the project root, whatever the working directory
+def project_path(path: str) -> str:
+    if not path or os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+
+# immutable settings snapshot: file signature, frozen tree and flat index
+class _Snapshot(NamedTuple):
+    signature: Union[tuple, None]
+    data: Any
+    index: MappingProxyType
+
+# settings snapshot (parsed once, reloaded only when settings.json changes on disk)
+_settings_lock = threading.Lock()
+_settings_snapshot = _Snapshot(None, None, MappingProxyType({}))
+
+# make a parsed settings value read-only
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+# build a flat "a.b.c" -> value index of the settings tree
+def _index_settings(settings: Any, prefix: str = '', index: dict = None) -> dict:
+    index = {} if index is None else index
+    for key, value in settings.items():
+        path = f"{prefix}.{key}" if prefix else key
+        index[path] = value
+        if isinstance(value, MappingProxyType):
+            _index_settings(value, path, index)
+    return index
+
+# file signature used to detect changes (inode, mtime, size)
+def _settings_signature(settings_path: str) -> tuple:
+    stat = os.stat(settings_path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# swap a new settings snapshot in (a single reference assignment: readers never see a mix of old and new)
+def _store_snapshot(settings: dict, signature: tuple) -> None:
+    global _settings_snapshot
+    frozen = _freeze(settings)
+    _settings_snapshot = _Snapshot(signature, frozen, MappingProxyType(_index_settings(frozen)))
+
+# return the current settings snapshot, reloading it if settings.json changed
+def _settings() -> _Snapshot:
     # build settings.json path
     settings_path = get_file_path()
-    # load file
-    with open(settings_path, 'r') as f:
-        settings = json.load(f)
-    # return file content
-    return settings
+    signature = _settings_signature(settings_path)
+    # fast path: file unchanged since last parse (read the reference once)
+    snapshot = _settings_snapshot
+    if signature == snapshot.signature:
+        return snapshot
+    with _settings_lock:
+        if signature != _settings_snapshot.signature:
+            # load file
+            with open(settings_path, 'r') as f:
+                settings = json.load(f)
+            _store_snapshot(settings, signature)
+    return _settings_snapshot
+
+# plain (mutable) copy of a frozen settings value
+def _thaw(value: Any) -> Any:
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+# load settings.json file
+def load_settings() -> dict:
+    # return a mutable copy of the current snapshot
+    return _thaw(_settings().data)
+
+# write a json file atomically (temp file next to it, then replace)
+def write_json(path: str, data: Any) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.' + os.path.splitext(os.path.basename(path))[0] + '-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 def write_settings(data) -> None:
     # build settings.json path
     settings_path = get_file_path()
-    # load file
-    with open(settings_path, 'w') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    with _settings_lock:
+        write_json(settings_path, data)
+        # swap the new snapshot in
+        _store_snapshot(data, _settings_signature(settings_path))
+
+# join a (frozen) settings list for prompts and messages: "a, b" instead of "('a', 'b')"
+def join_values(values: Any, separator: str = ', ') -> str:
+    return separator.join(str(value) for value in values)
 
 # retrieve config param from key (settings.json)
 def config(key: str) -> Any:
     if '.' in key:
-        # return array of splitted keys
-        elements = key.split('.')
-        # load config file
-        settings = load_settings()
-
-        for element in elements:
-            # create settings[element1][element2]...
-            settings = settings.setdefault(element, {})
-
-        return settings
+        # O(1) lookup on the flat index, missing keys return an empty dict
+        return _settings().index.get(key, {})
 
     return None
 
 # connect db
-def connect_db() -> Union[SupabaseAPI, pymysql.connections.Connection]:
-    if config('general.db.service') == 'supabase':
+def connect_db() -> DatabaseInterface:
+    service = config('general.db.service')
+    if service == 'supabase':
+        from database.supabase_api import SupabaseAPI
         return SupabaseAPI()
-    else:
-        conn = pymysql.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            db=os.getenv('DB_NAME'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
+    if service in ('sqlalchemy', 'sqlalchemy_async'):
+        from database.sqlalchemy_api import SQLAlchemyAPI, AsyncSQLAlchemyAPI, database_url
+        # pooled engine with pre-ping/reconnect
+        options = config('general.db.sqlalchemy')
+        api = AsyncSQLAlchemyAPI if service == 'sqlalchemy_async' else SQLAlchemyAPI
+        return api(
+            database_url(options.get('url_env') or 'DATABASE_URL'),
+            {key: options[key] for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle') if key in options},
+            bool(options.get('create_schema'))
         )
-        return conn
+    from database.sql_api import SqlAPI
+    # mysql (default) or postgres through DB-API
+    return SqlAPI('postgres' if service == 'postgres' else 'mysql')
+
+# database connection opened on first use (or by LazyAPI.connect in background)
+def lazy_db() -> LazyAPI:
+    return LazyAPI(connect_db)
+
+# open the local read model
+def connect_store() -> Union[LocalStore, None]:
+    if not config('general.local_store.status'):
+        return None
+    return LocalStore(project_path(config('general.local_store.path')))
 
 # insert db row
 def insert_db(conn, table_name, values) -> None:
     # Insert data
     try:
-        insert_response = conn.insert(table_name, values)
+        with metrics.span('db.insert'):
+            insert_response = conn.insert(table_name, values)
         print("Insert Response:", insert_response)
     except RuntimeError as e:
         print(e)
 
-# save transaction
-def save_transaction(conn, transaction, chat_id) -> None:
-    # table
-    table_name = "transactions"
-    # set values
-    values = {
+# build transactions row values
+def transaction_values(transaction, chat_id, sheet_row=None) -> dict:
+    return {
         "category": transaction['category'].lower(),
         "amount": transaction['amount'],
         "payment_method": transaction['payment_method'].lower(),
         "note": transaction['note'].lower(),
         "paid_at": format_db_date(transaction['date']),
-        "openai_response_chat_id": chat_id
+        "openai_response_chat_id": chat_id,
+        "sheet_row": sheet_row
     }
-    # save
-    insert_db(conn, table_name, values)
 
-# save openai response
-def save_openai_response(conn, response, message) -> int:
+# save transaction
+def save_transaction(conn, transaction, chat_id) -> None:
     # table
-    table_name = "openai_responses"
+    table_name = "transactions"
     # set values
-    values = {
+    values = transaction_values(transaction, chat_id)
+    # save
+    insert_db(conn, table_name, values)
+
+# build openai_responses row values
+def openai_response_values(response, message, route=None) -> dict:
+    return {
         "chat_id": response.id,
         "prompt": message,
+        "route": route,
         "response": response.choices[0].message.content,
         "completion_tokens": response.usage.completion_tokens,
         "prompt_tokens": response.usage.prompt_tokens,
         "total_tokens": response.usage.total_tokens
     }
+
+# build a completion answered without the OpenAI API (same fields as a real one, zero usage unless given)
+def local_completion(content: Any, model: str, id_prefix: str = 'local', usage: dict = None) -> 'ChatCompletion':
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate({
+        'id': f"{id_prefix}-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)}
+        }],
+        'usage': usage or {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    })
+
+# sum the token usage of several completions
+def sum_usage(responses: list) -> dict:
+    return {
+        key: sum(getattr(response.usage, key) or 0 for response in responses if response.usage)
+        for key in ('completion_tokens', 'prompt_tokens', 'total_tokens')
+    }
+
+# save openai response
+def save_openai_response(conn, response, message, route=None) -> int:
+    # table
+    table_name = "openai_responses"
+    # set values
+    values = openai_response_values(response, message, route)
     # save
     insert_db(conn, table_name, values)
 
@@ -127,7 +287,7 @@ def save_openai_response(conn, response, message) -> int:
 
 # load translations
 def load_translations(language_code: str) -> dict:
-    file_path = f"src/lang/{language_code}/general.json"
+    file_path = project_path(f"src/lang/{language_code}/general.json")
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Translation file not found for language: {language_code}")
 
@@ -146,25 +306,25 @@ def lang(translations: dict, key_path: str) -> str:
 
 # set lang on settings.json
 def set_lang(lang: str) -> None:
-    # build settings.json path
-    settings_path = get_file_path()
     # retrieve file content
     data = load_settings()
     # set new lang
     data['general']['lang'] = lang
-    # load file
-    with open(settings_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    # save settings
+    write_settings(data)
 
 # check if the user has permission
 def user_access(user_id: int, telegram_user_id: int) -> bool:
     return user_id == int(telegram_user_id)
 
 # create file stream
-def create_file_stream(data_string: str) -> io.BytesIO:
-    data_io = io.StringIO(data_string)
-
-    df = pd.read_csv(data_io, delimiter=';', skipinitialspace=True)
+def create_file_stream(data: Union[str, 'pd.DataFrame']) -> io.BytesIO:
+    import pandas as pd
+    if isinstance(data, pd.DataFrame):
+        df = data
+    else:
+        data_io = io.StringIO(data)
+        df = pd.read_csv(data_io, delimiter=';', skipinitialspace=True)
 
     output = io.BytesIO()
 
@@ -175,6 +335,37 @@ def create_file_stream(data_string: str) -> io.BytesIO:
 
     return output
 
+# stream rows to a spooled csv/xlsx file (constant memory, None if there are no rows)
+def stream_export(rows, file_format: str = 'csv') -> Union[tempfile.SpooledTemporaryFile, None]:
+    # spill to disk past general.export.spool_max_size bytes
+    output = tempfile.SpooledTemporaryFile(max_size=config('general.export.spool_max_size') or 5 * 1024 * 1024)
+    count = 0
+
+    if file_format == 'xlsx':
+        import xlsxwriter
+        # constant_memory: each row is flushed to a temp file as soon as it is written
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet()
+        for row in rows:
+            worksheet.write_row(count, 0, row)
+            count += 1
+        workbook.close()
+    else:
+        text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        text.flush()
+        text.detach()
+
+    if not count:
+        output.close()
+        return None
+
+    output.seek(0)
+    return output
+
 # remove any non-numeric characters except for '/'
 def format_date(date: str) -> str:
     return re.sub(r'[^0-9/]', '', date)
@@ -0,0 +1,181 @@
+import io
+import os
+import asyncio
+import math
+import time
+import pstats
+import cProfile
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# latest samples kept per stage for the percentiles
+WINDOW = 2048
+# reported percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+
+# stage => latest durations (seconds), call count, total seconds, error count
+_samples = {}
+_counts = {}
+_sums = {}
+_errors = {}
+# model => prompt/completion/total tokens
+_tokens = {}
+_lock = threading.Lock()
+# set when the next request has to be profiled
+_profile_next = threading.Event()
+
+# record a stage duration
+def observe(stage: str, seconds: float, error: bool = False) -> None:
+    with _lock:
+        samples = _samples.get(stage)
+        if samples is None:
+            samples = _samples[stage] = deque(maxlen=WINDOW)
+        samples.append(seconds)
+        _counts[stage] = _counts.get(stage, 0) + 1
+        _sums[stage] = _sums.get(stage, 0.0) + seconds
+        if error:
+            _errors[stage] = _errors.get(stage, 0) + 1
+
+# time a block (also around awaits), counting raised exceptions as errors
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe(stage, time.perf_counter() - start, error=True)
+        raise
+    observe(stage, time.perf_counter() - start)
+
+# decorator timing every call of a function (or coroutine function)
+def timed(stage: str):
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# record the token usage of a completion
+def record_tokens(model: str, usage) -> None:
+    if usage is None:
+        return
+    with _lock:
+        tokens = _tokens.setdefault(model, {'prompt': 0, 'completion': 0, 'total': 0})
+        tokens['prompt'] += usage.prompt_tokens or 0
+        tokens['completion'] += usage.completion_tokens or 0
+        tokens['total'] += usage.total_tokens or 0
+
+# nearest-rank percentile of sorted values
+def percentile(values: list, quantile: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(quantile * len(values)) - 1))]
+
+# return the aggregated stages and token usage
+def snapshot() -> dict:
+    with _lock:
+        samples = {stage: sorted(values) for stage, values in _samples.items()}
+        stages = {
+            stage: {
+                'count': _counts[stage],
+                'errors': _errors.get(stage, 0),
+                'sum': _sums[stage],
+                **{f'p{int(quantile * 100)}': percentile(values, quantile) for quantile in QUANTILES}
+            }
+            for stage, values in samples.items()
+        }
+        tokens = {model: dict(values) for model, values in _tokens.items()}
+    return {'stages': stages, 'tokens': tokens}
+
+# render the snapshot as a Telegram HTML message
+def render_text(extra: dict = None) -> str:
+    data = snapshot()
+    lines = ['<b>Stages</b> (count, errors, p50/p95/p99 ms)']
+    for stage, values in sorted(data['stages'].items()):
+        lines.append(f"<code>{stage}</code>: {values['count']}, {values['errors']}, {values['p50'] * 1000:.0f}/{values['p95'] * 1000:.0f}/{values['p99'] * 1000:.0f}")
+    if data['tokens']:
+        lines.append('\n<b>Tokens</b> (prompt/completion/total)')
+        for model, values in sorted(data['tokens'].items()):
+            lines.append(f"<code>{model}</code>: {values['prompt']}/{values['completion']}/{values['total']}")
+    for title, values in (extra or {}).items():
+        lines.append(f'\n<b>{title}</b>')
+        lines.extend(f'{key}: {value}' for key, value in values.items())
+    return '\n'.join(lines)
+
+# render the snapshot in the Prometheus text format
+def prometheus_text(extra: dict = None) -> str:
+    data = snapshot()
+    lines = ['# TYPE cash_tracker_stage_seconds summary']
+    for stage, values in sorted(data['stages'].items()):
+        for quantile in QUANTILES:
+            lines.append(f'cash_tracker_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {values[f"p{int(quantile * 100)}"]:.6f}')
+        lines.append(f'cash_tracker_stage_seconds_sum{{stage="{stage}"}} {values["sum"]:.6f}')
+        lines.append(f'cash_tracker_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+    lines.append('# TYPE cash_tracker_stage_errors_total counter')
+    for stage, values in sorted(data['stages'].items()):
+        lines.append(f'cash_tracker_stage_errors_total{{stage="{stage}"}} {values["errors"]}')
+    lines.append('# TYPE cash_tracker_tokens_total counter')
+    for model, values in sorted(data['tokens'].items()):
+        for kind in ('prompt', 'completion', 'total'):
+            lines.append(f'cash_tracker_tokens_total{{model="{model}",kind="{kind}"}} {values[kind]}')
+    for name, values in (extra or {}).items():
+        for key, value in values.items():
+            lines.append(f'cash_tracker_{name}_{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+# serve /metrics in a daemon thread (extra: callable returning more gauges)
+def start_http_server(port: int, extra=None) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(extra() if extra else None).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+# profile the next request only
+def profile_next() -> None:
+    _profile_next.set()
+
+# run a function under cProfile if a profile was requested, dumping the stats to directory
+def profiled(func, directory: str):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile_next.is_set():
+            return func(*args, **kwargs)
+        _profile_next.clear()
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{func.__name__}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof")
+            profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(20)
+            print(f"Profile saved to {path}\n{summary.getvalue()}")
+    return wrapper
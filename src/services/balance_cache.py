@@ -0,0 +1,105 @@
+import threading
+import executor
+from datetime import datetime
+from services.google_sheet_service import GoogleSheetService
+
+class BalanceCache:
+    """
+    Snapshot of the dashboard balance, refreshed after the bot writes transactions
+    """
+    # shared instance
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, spreadsheet_id=None):
+        """
+        Initializes an empty snapshot
+        Args:
+            spreadsheet_id (str, optional): The spreadsheet holding the dashboard, defaults to the SPREADSHEET_ID env var
+        """
+        self.spreadsheet_id = spreadsheet_id
+        self.rows = None
+        self.as_of = None
+        # writes done by the bot, and the count the snapshot already includes
+        self.writes = 0
+        self.snapshot_writes = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared cache
+        Returns:
+            BalanceCache: The shared cache
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def snapshot(self):
+        """
+        Returns the balance rows, reading them only if there is no snapshot yet
+        Returns:
+            Tuple[list, datetime]: The balance rows (False on error) and the time they were read
+        """
+        if self.rows is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                # any failure (auth, network, quota): serve what is there
+                print(f"Failed to read balance: {e}")
+        with self._lock:
+            return self.rows if self.rows is not None else False, self.as_of
+
+    def refresh(self):
+        """
+        Reads the balance from the dashboard sheet and swaps the snapshot in
+        Returns:
+            list: The balance rows, False on error
+        """
+        # writes landing during the read are not included in this snapshot
+        with self._lock:
+            writes = self.writes
+        g_sheet_service = GoogleSheetService('get_balance', spreadsheet_id=self.spreadsheet_id)
+        rows = g_sheet_service.get_balance()
+        if isinstance(rows, list):
+            with self._lock:
+                self.rows, self.as_of, self.snapshot_writes = rows, datetime.now(), writes
+        return rows
+
+    def refresh_in_background(self):
+        """
+        Schedules a refresh on the google_sheet pool, coalescing concurrent requests
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def task():
+            rows = False
+            try:
+                rows = self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh balance: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+            # a write landed while refreshing: run again
+            with self._lock:
+                outdated = self.snapshot_writes != self.writes
+            if isinstance(rows, list) and outdated:
+                self.refresh_in_background()
+
+        executor.pool('google_sheet').submit(task)
+
+    def invalidate(self):
+        """
+        Marks the snapshot as outdated after a write and refreshes it in the background
+        """
+        with self._lock:
+            self.writes += 1
+        self.refresh_in_background()
@@ -0,0 +1,56 @@
+import re
+from collections import Counter
+from services.local_parser import LocalParser
+
+# a number written in a statement line (45, -45, 12,50, 1.200,50)
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+
+# non-empty lines of a message
+def message_lines(message: str) -> list:
+    return [line.strip() for line in message.splitlines() if line.strip()]
+
+# split lines in consecutive chunks of at most max_lines lines and max_chars characters (a longer line is a chunk on its own)
+def split_chunks(lines: list, max_lines: int, max_chars: int) -> list:
+    chunks = []
+    chunk, size = [], 0
+    for line in lines:
+        if chunk and (len(chunk) >= max_lines or size + len(line) + 1 > max_chars):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# absolute amounts written in a line
+def line_amounts(line: str) -> set:
+    amounts = set()
+    for number in NUMBER_PATTERN.findall(line):
+        amount = LocalParser.to_amount(number)
+        if amount is not None:
+            amounts.add(abs(amount))
+    return amounts
+
+# identity of an extracted transaction
+def transaction_key(transaction: dict) -> tuple:
+    return tuple(str(transaction.get(field)).strip().lower() for field in ('date', 'amount', 'payment_method', 'category', 'note'))
+
+# concatenate the chunk transactions in input order, dropping the copies the input does not justify
+def merge(results: list, lines: list) -> list:
+    # amount => input lines mentioning it (two identical coffees are two lines)
+    mentions = Counter(amount for line in lines for amount in line_amounts(line))
+    seen = Counter()
+    merged = []
+    for transactions in results:
+        for transaction in transactions:
+            key = transaction_key(transaction)
+            try:
+                amount = abs(round(float(transaction['amount']), 2))
+            except (TypeError, ValueError):
+                amount = None
+            if seen[key] >= max(1, mentions.get(amount, 0)):
+                continue
+            seen[key] += 1
+            merged.append(transaction)
+    return merged
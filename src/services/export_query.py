@@ -0,0 +1,133 @@
+import pandas as pd
+from datetime import datetime
+from database import local_store
+
+class ExportQuery:
+    # sheet columns (items!B:F) in order
+    COLUMNS = ['date', 'payment_method', 'category', 'note', 'amount']
+    # supported group by keys
+    GROUP_BY = {'category', 'payment_method', 'month', 'year'}
+    # supported sort keys
+    SORT_BY = {'date', 'amount', 'category', 'payment_method'}
+
+    # filter/aggregation spec the model is asked to return
+    SPEC_PROMPT = (
+        'Return a JSON with the keys: '
+        '"date_from" and "date_to" (dd/mm/yyyy or null), '
+        '"categories" and "payment_methods" (lists, empty for all), '
+        '"min_amount" and "max_amount" (numbers or null, expenses are negative), '
+        '"note_contains" (string or null), '
+        '"group_by" (one of "category", "payment_method", "month", "year" or null), '
+        '"sort_by" (one of "date", "amount", "category", "payment_method" or null), '
+        '"sort_order" ("asc" or "desc"), "limit" (number or null).'
+    )
+
+    def __init__(self, rows):
+        """
+        Loads the sheet rows in a DataFrame
+        Args:
+            rows (list): The sheet rows, the first one is the header
+        """
+        header, body = (rows[0], rows[1:]) if rows else ([], [])
+        # keep the sheet header names for the output file
+        self.header = dict(zip(self.COLUMNS, header or self.COLUMNS))
+        # pad short rows (empty trailing cells are omitted by the API)
+        frame = pd.DataFrame([row[:len(self.COLUMNS)] + [''] * (len(self.COLUMNS) - len(row)) for row in body], columns=self.COLUMNS)
+        # parsed helper columns, used only to filter
+        frame['_date'] = pd.to_datetime(frame['date'], format='%d/%m/%Y', errors='coerce')
+        frame['_amount'] = self.to_number(frame['amount'])
+        self.frame = frame
+
+    @staticmethod
+    def to_number(column):
+        """
+        Converts formatted amounts (e.g. "€ -1.234,50") to numbers
+        Args:
+            column (pd.Series): The formatted amounts
+        Returns:
+            pd.Series: The numeric amounts (NaN if not parsable)
+        """
+        cleaned = column.astype(str).str.replace(r'[^0-9,.\-]', '', regex=True)
+        # same rules as the local store: the last separator is the decimal one
+        parts = cleaned.str.extract(f'^{local_store.AMOUNT_PATTERN}$')
+        valid = parts['integer'].notna() & ~(parts['thousands'].notna() & (parts['thousands'] == parts['decimal']))
+        number = parts['integer'].str.replace(r'[.,]', '', regex=True) + '.' + parts['decimals'].fillna('0')
+        return pd.to_numeric(number.where(valid), errors='coerce')
+
+    @staticmethod
+    def parse_date(value):
+        """
+        Parses a dd/mm/yyyy spec date
+        Args:
+            value (str): The date
+        Returns:
+            datetime: The parsed date, None if missing or invalid
+        """
+        try:
+            return datetime.strptime(value, '%d/%m/%Y') if value else None
+        except (TypeError, ValueError):
+            return None
+
+    def run(self, spec):
+        """
+        Applies the filter/aggregation spec to the sheet rows
+        Args:
+            spec (dict): The spec returned by the model (see SPEC_PROMPT)
+        Returns:
+            pd.DataFrame: The export content with the sheet header names
+        """
+        spec = spec if isinstance(spec, dict) else {}
+        frame = self.frame
+        mask = pd.Series(True, index=frame.index)
+
+        # date range
+        date_from, date_to = self.parse_date(spec.get('date_from')), self.parse_date(spec.get('date_to'))
+        if date_from:
+            mask &= frame['_date'] >= date_from
+        if date_to:
+            mask &= frame['_date'] <= date_to
+        # categories and payment methods (case insensitive)
+        for key, spec_key in (('category', 'categories'), ('payment_method', 'payment_methods')):
+            values = [str(value).lower() for value in spec.get(spec_key) or []]
+            if values:
+                mask &= frame[key].str.lower().isin(values)
+        # amount bounds
+        if isinstance(spec.get('min_amount'), (int, float)):
+            mask &= frame['_amount'] >= spec['min_amount']
+        if isinstance(spec.get('max_amount'), (int, float)):
+            mask &= frame['_amount'] <= spec['max_amount']
+        # note
+        if spec.get('note_contains'):
+            mask &= frame['note'].str.contains(str(spec['note_contains']), case=False, regex=False)
+
+        result = frame[mask]
+
+        # group by
+        group_by = spec.get('group_by')
+        if group_by in self.GROUP_BY:
+            if group_by == 'month':
+                # sortable key, the mm/yyyy label is applied after sorting
+                keys = result['_date'].dt.strftime('%Y-%m')
+            elif group_by == 'year':
+                keys = result['_date'].dt.strftime('%Y')
+            else:
+                keys = result[group_by]
+            grouped = result.groupby(keys.rename(group_by), sort=False)['_amount'].agg(['sum', 'count']).reset_index()
+            result = grouped.rename(columns={'sum': '_amount', 'count': 'count'})
+            result[self.header['amount']] = result['_amount'].round(2)
+            sort_by = '_amount' if spec.get('sort_by') == 'amount' else group_by
+        else:
+            sort_by = spec.get('sort_by') if spec.get('sort_by') in self.SORT_BY else 'date'
+            sort_by = {'date': '_date', 'amount': '_amount'}.get(sort_by, sort_by)
+
+        # sort and limit
+        result = result.sort_values(sort_by, ascending=spec.get('sort_order') != 'desc', kind='stable')
+        if isinstance(spec.get('limit'), int) and spec['limit'] > 0:
+            result = result.head(spec['limit'])
+        # month label of the sheet dates
+        if group_by == 'month':
+            result = result.assign(month=pd.to_datetime(result['month'], format='%Y-%m').dt.strftime('%m/%Y'))
+
+        # drop the helper columns and restore the sheet header names
+        result = result[[column for column in result.columns if not column.startswith('_')]]
+        return result.rename(columns=self.header)
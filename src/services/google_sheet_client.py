@@ -0,0 +1,136 @@
+import os
+import json
+import threading
+import helper
+import metrics
+from services.sheet_scheduler import SheetScheduler
+
+class GoogleSheetClient:
+    """
+    Long-lived Google Sheets client shared by every GoogleSheetService
+    """
+    # set scope
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    # shared instance
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        """
+        Loads the service account credentials and builds the Sheets service once
+        """
+        # google auth and discovery are imported with the client (off the startup path)
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+        # check if we are in development or production
+        if os.getenv('APP_ENV', 'DEV') == 'DEV':
+            # load credentials from file
+            self.credentials = service_account.Credentials.from_service_account_file(helper.project_path('src/google-key.json'), scopes=self.SCOPES)
+        else:
+            # load credentials from JSON env variable
+            self.credentials = service_account.Credentials.from_service_account_info(json.loads(os.getenv('GOOGLE_KEY_JSON')), scopes=self.SCOPES)
+        # build service (discovery document is parsed only here)
+        self.service = build('sheets', 'v4', credentials=self.credentials, cache_discovery=False)
+        # httplib2 is not thread safe: one authorized http per thread
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        # every request goes through the quota scheduler
+        self.scheduler = SheetScheduler.from_config()
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared client, creating it on first use
+        Returns:
+            GoogleSheetClient: The shared client
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Creates the shared client and fetches the first access token
+        Returns:
+            GoogleSheetClient: The shared client
+        """
+        client = cls.get()
+        client.refresh_token()
+        return client
+
+    def refresh_token(self):
+        """
+        Refreshes the access token if it is missing or expired
+        """
+        if self.credentials.valid:
+            return
+        with self._refresh_lock:
+            if not self.credentials.valid:
+                from google.auth.transport.requests import Request
+                self.credentials.refresh(Request())
+
+    def http(self):
+        """
+        Returns the authorized http object of the current thread
+        Returns:
+            google_auth_httplib2.AuthorizedHttp: The thread-local http object
+        """
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            import httplib2
+            import google_auth_httplib2
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def spreadsheets(self):
+        """
+        Returns the spreadsheets resource of the shared service
+        Returns:
+            Resource: The spreadsheets resource
+        """
+        return self.service.spreadsheets()
+
+    def execute(self, request):
+        """
+        Executes a request on the current thread's http object, within the Sheets quota
+        Args:
+            request (HttpRequest): The request to execute
+        Returns:
+            dict: The response body
+        """
+        # one stage per API method (sheets.spreadsheets.values.append => google_sheet.append)
+        stage = f"google_sheet.{getattr(request, 'methodId', 'request').rsplit('.', 1)[-1]}"
+
+        def call():
+            # refresh the token once for all threads instead of per request
+            self.refresh_token()
+            with metrics.span(stage):
+                return request.execute(http=self.http())
+
+        # identical reads in flight share one response
+        if request.method == 'GET':
+            return self.scheduler.read((request.uri, request.body), call)
+        # a retried append writes its rows twice: only a quota rejection is retried
+        return self.scheduler.write(call, idempotent=not stage.endswith('.append'))
+
+    def update_values(self, spreadsheet_id, data, value_input_option='RAW'):
+        """
+        Writes value ranges, merged in one batchUpdate with the concurrent updates of the same spreadsheet
+        Args:
+            spreadsheet_id (str): The spreadsheet
+            data (list): The {'range', 'values'} updates
+            value_input_option (str): RAW or USER_ENTERED
+        Returns:
+            list: The update response of each range
+        """
+        def batch_update(merged):
+            request = self.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body={'valueInputOption': value_input_option, 'data': merged})
+            self.refresh_token()
+            with metrics.span('google_sheet.batchUpdate'):
+                return request.execute(http=self.http())
+
+        return self.scheduler.update((spreadsheet_id, value_input_option), list(data), batch_update)
@@ -1,32 +1,24 @@
 import os
-import io
-import csv
+import re
 import helper
-import json
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from services.google_sheet_client import GoogleSheetClient
 
 class GoogleSheetService:
-    def __init__(self, func):
+    def __init__(self, func, client=None, spreadsheet_id=None):
         """
         Initializes the Google Sheet Service with the specified function name
         Args:
             func (str): The name of the function to initialize the service for
+            client (GoogleSheetClient, optional): The Sheets client to use, defaults to the shared one
+            spreadsheet_id (str, optional): The spreadsheet (tenant), defaults to the SPREADSHEET_ID env var
         """
         # set const
         self.FROM_API = 'FROM API'
-        # set scope
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        # check if we are in development or production
-        if os.getenv('APP_ENV', 'DEV') == 'DEV':
-            # load credentials from file
-            credentials = service_account.Credentials.from_service_account_file('src/google-key.json', scopes=scopes)
-        else:
-            # load credentials from JSON env variable
-            credentials = service_account.Credentials.from_service_account_info(json.loads(os.getenv('GOOGLE_KEY_JSON')), scopes=scopes)
-        # build service
-        self.service = build('sheets', 'v4', credentials=credentials)
+        self.func = func
+        # reuse the long-lived client (credentials and discovery are loaded once)
+        self.client = client or GoogleSheetClient.get()
+        self.spreadsheet_id = spreadsheet_id or os.getenv('SPREADSHEET_ID')
         # set range name
         self.range_name = (
             f"{helper.config(f'google_sheet.functions.{func}.sheet_name')}!"
@@ -40,10 +32,26 @@ class GoogleSheetService:
             list: A list of rows from the Google Sheet
         """
         # read sheet
-        result = self.service.spreadsheets().values().get(spreadsheetId=os.getenv('SPREADSHEET_ID'), range=self.range_name).execute()
+        result = self.client.execute(self.client.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=self.range_name))
         # return values
         return result.get('values', [])
 
+    def read_from(self, start_row):
+        """
+        Reads the rows of the function columns from a row to the end of the sheet
+        Args:
+            start_row (int): The first row (1-based)
+        Returns:
+            list: A list of rows from the Google Sheet
+        """
+        range_name = (
+            f"{helper.config(f'google_sheet.functions.{self.func}.sheet_name')}!"
+            f"{helper.config(f'google_sheet.functions.{self.func}.range.from')}{start_row}:"
+            f"{helper.config(f'google_sheet.functions.{self.func}.range.to')}"
+        )
+        result = self.client.execute(self.client.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=range_name))
+        return result.get('values', [])
+
     def write(self, update_range, body):
         """
         Writes to the Google Sheet specified by the update range
@@ -51,8 +59,8 @@ class GoogleSheetService:
             update_range (str): The range in the Google Sheet to update
             body (dict): The body of the request containing the values to write
         """
-        # add new row
-        self.service.spreadsheets().values().update(spreadsheetId=os.getenv('SPREADSHEET_ID'), range=update_range, valueInputOption='RAW', body=body).execute()
+        # merged with the concurrent updates of the spreadsheet
+        self.client.update_values(self.spreadsheet_id, [{'range': update_range, 'values': body['values']}])
 
     def first_empty_row_index(self):
         """
@@ -65,24 +73,69 @@ class GoogleSheetService:
         # return first empty row index
         return len(rows) + 1
 
-    def add_transaction(self, transaction):
+    def append(self, rows):
         """
-        Adds a new transaction to the Google Sheet
+        Appends rows after the last row of the table in the range name
+        Args:
+            rows (list): The rows to append
+        Returns:
+            dict: The append response (updates.updatedRange holds the written range)
+        """
+        # native append: the row is allocated server side, concurrent writers never collide
+        return self.client.execute(self.client.spreadsheets().values().append(
+            spreadsheetId=self.spreadsheet_id,
+            range=self.range_name,
+            valueInputOption='RAW',
+            insertDataOption='INSERT_ROWS',
+            body={ 'values': rows }
+        ))
+
+    def transaction_row(self, transaction):
+        """
+        Builds the sheet row of a transaction
         Args:
             transaction (dict): A dictionary containing the transaction details
+        Returns:
+            list: The row values
         """
-        # get first empty row
-        first_empty_row = self.first_empty_row_index()
-        # set update range
-        update_range = f"{helper.config('google_sheet.functions.add_transaction.sheet_name')}!{helper.config('google_sheet.functions.add_transaction.range.from')}{first_empty_row}:{helper.config('google_sheet.functions.add_transaction.range.to')}{first_empty_row}"
         # sanitize date
         transaction['date'] = helper.format_date(transaction['date'])
         # set values
-        values = [transaction['date'], transaction['payment_method'], transaction['category'], transaction['note'], transaction['amount'], self.FROM_API]
-        # set body
-        body = { 'values': [values] }
-        # write new row
-        self.write(update_range, body)
+        return [transaction['date'], transaction['payment_method'], transaction['category'], transaction['note'], transaction['amount'], self.FROM_API]
+
+    def add_transactions(self, transactions):
+        """
+        Adds all the transactions to the Google Sheet with a single request
+        Args:
+            transactions (list): A list of dictionaries containing the transaction details
+        Returns:
+            dict: The append response
+        """
+        if not transactions:
+            return None
+        # write new rows
+        return self.append([self.transaction_row(transaction) for transaction in transactions])
+
+    def add_transaction(self, transaction):
+        """
+        Adds a new transaction to the Google Sheet
+        Args:
+            transaction (dict): A dictionary containing the transaction details
+        """
+        self.add_transactions([transaction])
+
+    @staticmethod
+    def first_updated_row(response):
+        """
+        Retrieves the first row written by an append
+        Args:
+            response (dict): The append response
+        Returns:
+            int: The first written row, None if unknown
+        """
+        updated_range = ((response or {}).get('updates') or {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        return int(match.group(1)) if match else None
 
     def get_balance(self):
         """
@@ -132,23 +185,17 @@ class GoogleSheetService:
             bool: True if the sheet was built successfully, False otherwise
         """
         # set cells
-        update_cells = {
-            'valueInputOption': 'RAW',
-            'data': [
-                {
-                    'range': self.range_name,
-                    'values': [
-                        helper.config('google_sheet.header.items')
-                    ]
-                }
-            ]
-        }
+        update_cells = [
+            {
+                'range': self.range_name,
+                'values': [
+                    list(helper.config('google_sheet.header.items'))
+                ]
+            }
+        ]
         # write header row
         try:
-            self.service.spreadsheets().values().batchUpdate(
-                spreadsheetId=os.getenv('SPREADSHEET_ID'),
-                body=update_cells
-            ).execute()
+            self.client.update_values(self.spreadsheet_id, update_cells)
             return True
         except HttpError as err:
             print(err)
@@ -164,18 +211,53 @@ class GoogleSheetService:
         rows = self.read()
         return rows
 
-    def export(self):
+    def row_count(self):
         """
-        Exports the Google Sheet as a CSV file
+        Retrieves the number of rows of the function sheet grid
         Returns:
-            io.StringIO: A StringIO object containing the CSV data
+            int: The grid row count, None if the sheet is not found
         """
-        # retrieve rows
-        rows = self.read()
-        # convert to csv
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerows(rows)
-        output.seek(0)
+        sheet_name = helper.config(f'google_sheet.functions.{self.func}.sheet_name')
+        result = self.client.execute(self.client.spreadsheets().get(spreadsheetId=self.spreadsheet_id, fields='sheets.properties(title,gridProperties.rowCount)'))
+        for sheet in result.get('sheets', []):
+            properties = sheet.get('properties', {})
+            if properties.get('title') == sheet_name:
+                return properties.get('gridProperties', {}).get('rowCount')
+        return None
+
+    def iter_rows(self, page_size=1000):
+        """
+        Reads the function columns in row-range pages, up to the last row of the grid
+        Args:
+            page_size (int): The number of rows read per request
+        Yields:
+            list: The rows, the first page is yielded before the next one is requested
+        """
+        # empty rows inside a page are trimmed too: only the grid size tells where the sheet ends
+        last_row = self.row_count()
+        start = 1
+        while last_row is None or start <= last_row:
+            end = start + page_size - 1 if last_row is None else min(start + page_size - 1, last_row)
+            range_name = (
+                f"{helper.config(f'google_sheet.functions.{self.func}.sheet_name')}!"
+                f"{helper.config(f'google_sheet.functions.{self.func}.range.from')}{start}:"
+                f"{helper.config(f'google_sheet.functions.{self.func}.range.to')}{end}"
+            )
+            result = self.client.execute(self.client.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=range_name))
+            rows = result.get('values', [])
+            # unknown grid size: an entirely empty page is the end
+            if last_row is None and not rows:
+                return
+            yield from rows
+            start += page_size
 
-        return output
\ No newline at end of file
+    def export(self, file_format='csv'):
+        """
+        Exports the Google Sheet as a CSV or XLSX file, streaming it page by page
+        Args:
+            file_format (str): csv or xlsx
+        Returns:
+            tempfile.SpooledTemporaryFile: The export file, None if the sheet is empty
+        """
+        # stream pages into the file
+        return helper.stream_export(self.iter_rows(helper.config('general.export.page_size') or 1000), file_format)
@@ -0,0 +1,65 @@
+import re
+import helper
+
+class IntentRouter:
+    # set consts
+    EXPORT_METHOD = 'generate_export'
+    TRANS_METHOD = 'generate_trans'
+    # bot commands whose name is also an export keyword
+    COMMAND_KEYWORDS = ['export']
+    # an amount written as a number (10, 10.50, -45, 2,50)
+    AMOUNT_PATTERN = re.compile(r'(?<![\w/])[-+]?\d+(?:[.,]\d{1,2})?(?![\w/])')
+
+    def __init__(self, translations):
+        """
+        Initializes the local pre-router from the translations vocabulary
+        Args:
+            translations (dict): The loaded translations (router.export and router.query keywords)
+        """
+        keywords = list(helper.lang(translations, 'router.export') or []) + self.COMMAND_KEYWORDS
+        # whole words only: "file" must not match "filetto"
+        self.export_pattern = self.words_pattern(keywords)
+        # questions and listings ("show my 10 biggest expenses", "quanto ho speso a marzo 2024")
+        self.query_pattern = self.words_pattern(helper.lang(translations, 'router.query') or [])
+
+    @staticmethod
+    def words_pattern(words):
+        """
+        Builds a case insensitive whole word regex
+        Args:
+            words (list): The words (inflections are listed in the vocabulary)
+        Returns:
+            re.Pattern: The regex, None if there are no words
+        """
+        if not words:
+            return None
+        return re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(word.lower()) for word in sorted(words, key=len, reverse=True)) + r')(?!\w)', re.IGNORECASE)
+
+    def is_query(self, message):
+        """
+        Checks whether a message asks something instead of recording a transaction
+        Args:
+            message (str): The user's request
+        Returns:
+            bool: True if the message is a question or uses the query vocabulary
+        """
+        return '?' in message or bool(self.query_pattern and self.query_pattern.search(message))
+
+    def route(self, message):
+        """
+        Routes the obvious requests without calling the LLM
+        Args:
+            message (str): The user's request
+        Returns:
+            str: The method to use, None if the request is ambiguous
+        """
+        # export vocabulary wins: "export expenses over 50" is still an export
+        if self.export_pattern.search(message):
+            return self.EXPORT_METHOD
+        # numbers in questions are not amounts: the LLM decides
+        if self.is_query(message):
+            return None
+        # the amount is the only signal: a transaction
+        if self.AMOUNT_PATTERN.search(message):
+            return self.TRANS_METHOD
+        return None
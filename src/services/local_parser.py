@@ -0,0 +1,239 @@
+import re
+import difflib
+import helper
+from datetime import datetime, timedelta
+from services.reference_data import ReferenceData
+
+class LocalParser:
+    """
+    Rule based extraction of simple transactions ("caffè 2.50 contanti", "-45 spesa carta")
+    """
+    # an amount with optional sign and currency (2.50, -45, +1.200,00, 3€)
+    AMOUNT_PATTERN = re.compile(r'(?<![\w/.,])([-+])?\s?€?\s?(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)\s?€?(?![\w/.,])')
+    # a dd/mm or dd/mm/yyyy date
+    DATE_PATTERN = re.compile(r'(?<![\w/])(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?(?![\w/])')
+    # words of a message
+    WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+    # confidence of each kind of match
+    EXACT, PREFIX, ALIAS = 1.0, 0.9, 0.9
+    # similarity needed by a fuzzy match
+    FUZZY_CUTOFF = 0.8
+    # unmatched words allowed in a simple entry
+    MAX_NOTE_WORDS = 3
+    # default minimum confidence to skip the LLM
+    DEFAULT_MIN_CONFIDENCE = 0.8
+    # match result of a line naming two different values
+    AMBIGUOUS = object()
+
+    def __init__(self, translations, reference_data=None):
+        """
+        Initializes the parser from the translations vocabulary
+        Args:
+            translations (dict): The loaded translations (parser.* vocabulary)
+            reference_data (ReferenceData, optional): The categories and payment methods, defaults to the shared ones
+        """
+        self.reference_data = reference_data
+        vocabulary = helper.lang(translations, 'parser') or {}
+        self.day_offsets = {word.lower(): int(offset) for word, offset in dict(vocabulary.get('days', {})).items()}
+        self.income_words = {word.lower() for word in vocabulary.get('income', [])}
+        self.stopwords = {word.lower() for word in vocabulary.get('stopwords', [])}
+        # words naming a payment method the user has not configured ("bonifico", "paypal")
+        self.payment_words = {word.lower() for word in vocabulary.get('payment_words', [])}
+        # alias => category/payment method name
+        self.aliases = {
+            'categories': {word.lower(): name for word, name in dict(vocabulary.get('categories', {})).items()},
+            'payment_methods': {word.lower(): name for word, name in dict(vocabulary.get('payment_methods', {})).items()}
+        }
+
+    def parse(self, message):
+        """
+        Extracts the transactions of a message, one per line
+        Args:
+            message (str): The user's request
+        Returns:
+            Tuple[list, float]: The transactions (sanitize_response shape) and the lowest line confidence
+        """
+        lines = [line.strip() for line in message.splitlines() if line.strip()]
+        if not lines:
+            return [], 0.0
+        reference_data = self.reference_data or ReferenceData.get()
+        categories = reference_data.values('categories')
+        payment_methods = reference_data.values('payment_methods')
+
+        transactions = []
+        confidence = 1.0
+        for line in lines:
+            transaction, line_confidence = self.parse_line(line, categories, payment_methods)
+            if transaction is None:
+                return [], 0.0
+            transactions.append(transaction)
+            confidence = min(confidence, line_confidence)
+        return transactions, confidence
+
+    def parse_line(self, line, categories, payment_methods):
+        """
+        Extracts a single transaction
+        Args:
+            line (str): A line of the user's request
+            categories (list): The configured categories
+            payment_methods (list): The configured payment methods
+        Returns:
+            Tuple[dict, float]: The transaction and its confidence, (None, 0.0) if the line is not a simple entry
+        """
+        text = line.lower()
+        # questions are never entries
+        if '?' in text:
+            return None, 0.0
+
+        # date: explicit dd/mm[/yyyy], relative day word, today by default
+        date = None
+        dates = self.DATE_PATTERN.findall(text)
+        if len(dates) > 1:
+            return None, 0.0
+        if dates:
+            date = self.explicit_date(*dates[0])
+            if date is None:
+                return None, 0.0
+            text = self.DATE_PATTERN.sub(' ', text)
+
+        # exactly one amount: several amounts mean several entries on one line (LLM)
+        amounts = self.AMOUNT_PATTERN.findall(text)
+        if len(amounts) != 1:
+            return None, 0.0
+        sign, number = amounts[0]
+        amount = self.to_amount(number)
+        if amount is None or amount == 0:
+            return None, 0.0
+        text = self.AMOUNT_PATTERN.sub(' ', text)
+
+        words = self.WORD_PATTERN.findall(text)
+        for phrase, offset in sorted(self.day_offsets.items(), key=lambda item: -len(item[0])):
+            if re.search(r'(?<!\w)' + re.escape(phrase) + r'(?!\w)', text):
+                if date is not None:
+                    return None, 0.0
+                date = datetime.today() - timedelta(days=offset)
+                # a day phrase may span several words ("l'altro ieri")
+                phrase_words = self.WORD_PATTERN.findall(phrase)
+                words = [word for word in words if word not in phrase_words]
+                break
+        if date is None:
+            date = datetime.today()
+
+        income = sign == '+' or any(word in self.income_words for word in words)
+        if sign == '-' and income:
+            return None, 0.0
+
+        # payment method and category from the configured lists
+        payment_method, payment_confidence, words = self.match(words, payment_methods, 'payment_methods')
+        category, category_confidence, words = self.match(words, categories, 'categories')
+        if category is None or category is self.AMBIGUOUS or payment_method is self.AMBIGUOUS:
+            return None, 0.0
+        if payment_method is None:
+            # the default is for lines that name no payment method, not for the unknown ones
+            if any(word in self.payment_words or word in self.aliases['payment_methods'] for word in words):
+                return None, 0.0
+            payment_method = helper.config('general.local_parser.default_payment_method') or 'Contanti'
+            payment_confidence = self.PREFIX
+
+        # what is left is the note
+        note_words = [word for word in words if word not in self.stopwords and word not in self.income_words]
+        # longer sentences are left to the LLM
+        if len(note_words) > self.MAX_NOTE_WORDS:
+            return None, 0.0
+        note = ' '.join(note_words)[:10].strip() or '-'
+
+        transaction = {
+            'date': date.strftime('%d/%m/%Y'),
+            'payment_method': payment_method,
+            'category': category,
+            'amount': amount if income else -amount,
+            'note': note
+        }
+        return transaction, min(payment_confidence, category_confidence)
+
+    def match(self, words, names, kind):
+        """
+        Finds the best reference value among the words (exact, alias, prefix, then fuzzy)
+        Args:
+            words (list): The remaining words of the line
+            names (list): The reference values
+            kind (str): categories or payment_methods
+        Returns:
+            Tuple[str, float, list]: The value (None if nothing matched, AMBIGUOUS if two values did), its confidence and the words left
+        """
+        lookup = {str(name).lower(): name for name in names}
+        best = (None, 0.0, None)
+        for word in words:
+            if word in self.stopwords:
+                continue
+            name, confidence = self.match_word(word, lookup, kind)
+            if name is not None:
+                if best[0] is not None and best[0] != name:
+                    # two different values in the same line: the line fails, no default applies
+                    return self.AMBIGUOUS, 0.0, words
+                if confidence > best[1]:
+                    best = (name, confidence, word)
+        if best[0] is None:
+            return None, 0.0, words
+        return best[0], best[1], [word for word in words if word != best[2]]
+
+    def match_word(self, word, lookup, kind):
+        # exact match on a configured name
+        if word in lookup:
+            return lookup[word], self.EXACT
+        # vocabulary alias, only if the aliased name is configured
+        alias = self.aliases[kind].get(word)
+        if alias is not None and alias.lower() in lookup:
+            return lookup[alias.lower()], self.ALIAS
+        # unique prefix (caff => caffè, carta => carta di credito)
+        if len(word) >= 3:
+            prefixed = [name for key, name in lookup.items() if key.startswith(word) or (len(key) >= 3 and word.startswith(key))]
+            if len(prefixed) == 1:
+                return prefixed[0], self.PREFIX
+        # typos
+        close = difflib.get_close_matches(word, lookup.keys(), n=2, cutoff=self.FUZZY_CUTOFF)
+        if len(close) == 1:
+            return lookup[close[0]], difflib.SequenceMatcher(None, word, close[0]).ratio()
+        return None, 0.0
+
+    @staticmethod
+    def explicit_date(day, month, year):
+        """
+        Builds a dd/mm[/yyyy] date (current year by default)
+        Returns:
+            datetime: The date, None if invalid
+        """
+        today = datetime.today()
+        year = int(year) if year else today.year
+        if year < 100:
+            year += 2000
+        try:
+            return datetime(year, int(month), int(day))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def to_amount(number):
+        """
+        Converts an amount written the Italian or English way to a float
+        Returns:
+            float: The amount, None if invalid
+        """
+        # 1.200,50 / 1.200: dot as thousands separator
+        if re.fullmatch(r'\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?', number):
+            number = number.replace('.', '')
+        number = number.replace(',', '.')
+        try:
+            return round(float(number), 2)
+        except ValueError:
+            return None
+
+    def is_confident(self, confidence):
+        """
+        Checks whether a parse can skip the LLM
+        Args:
+            confidence (float): The parse confidence
+        Returns:
+            bool: True if the confidence reaches general.local_parser.min_confidence
+        """
+        return confidence >= (helper.config('general.local_parser.min_confidence') or self.DEFAULT_MIN_CONFIDENCE)
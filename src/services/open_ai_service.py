@@ -1,16 +1,54 @@
 import json
+import threading
 import helper
+import executor
+import metrics
 from datetime import datetime
-from openai import OpenAI, OpenAIError
 from services.google_sheet_service import GoogleSheetService
+from services.intent_router import IntentRouter
+from services import bulk_extraction
+from services.reference_data import ReferenceData
+from services.response_cache import ResponseCache
 
 class OpenAIService:
-    def __init__(self):
+    # shared client (openai and its http pool are loaded on first use or by warm_up)
+    _client = None
+    _client_lock = threading.Lock()
+
+    def __init__(self, store=None, reference_data=None, spreadsheet_id=None):
         """
         Initializes the OpenAI service
+        Args:
+            store (LocalStore, optional): The local read model used for exports
+            reference_data (ReferenceData, optional): The categories and payment methods, defaults to the shared ones
+            spreadsheet_id (str, optional): The spreadsheet (tenant), defaults to the SPREADSHEET_ID env var
+        """
+        # reuse the shared client
+        self.client = self.shared_client()
+        self.store = store
+        self.reference_data = reference_data or ReferenceData.get()
+        self.spreadsheet_id = spreadsheet_id
+
+    @classmethod
+    def shared_client(cls):
+        """
+        Returns the shared OpenAI client, creating it on first use
+        Returns:
+            OpenAI: The shared client
         """
-        # create client
-        self.client = OpenAI()
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    from openai import OpenAI
+                    cls._client = OpenAI()
+        return cls._client
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Imports openai and creates the shared client off the startup path
+        """
+        cls.shared_client()
 
     def get_method(self, message):
         """
@@ -18,79 +56,285 @@ class OpenAIService:
         Args:
             message (str): The user's request
         Returns:
-            str: The method to use
+            str: The method to use, None if the completion failed or named no known method
         """
         # set system prompt
         system_prompt = 'Determine whether to use "generate_trans" or "generate_export" based on the request. Return a word "action" (format json)'
         # retrieve gpt response
-        response, content = self.get_response(message, system_prompt)
+        result = self.get_response(message, system_prompt)
+        if result is None:
+            return None
         # validate response
-        return content['action']
+        action = result[1].get('action') if isinstance(result[1], dict) else None
+        return action if action in (IntentRouter.TRANS_METHOD, IntentRouter.EXPORT_METHOD) else None
 
     def generate_export(self, message):
         """
-        Generates a CSV export based on the user's request
+        Generates an export based on the user's request
         Args:
             message (str): The user's request
         Returns:
-            Tuple[ChatCompletion, Optional[dict]]: The OpenAI response and the file stream if applicable
+            Tuple[ChatCompletion, Optional[io.BytesIO]]: The OpenAI response and the file stream, (None, None) if the completion failed
         """
-        # set system prompt
-        g_sheet_service = GoogleSheetService('export')
-        # retrieve csv file content
-        csv_content = g_sheet_service.convert_sheet_csv()
+        # pandas is only needed by exports
+        from services.export_query import ExportQuery
+        # set current date
+        date = datetime.today().strftime('%d/%m/%Y')
 
-        # set system prompt
-        system_prompt = f'Given the CSV in array format: {csv_content}. Filter it based on the user\'s prompt and return a JSON with the key: "data" for the final result (which should be a string in CSV format). Do not skip any rows. Consider the first array with Data, Metodo... as the header. The number of columns per row is 5. Use /n for line breaks and separate each cell with a semicolon (;).'
+        # set system prompt (only the filter spec is requested, the sheet never enters the prompt)
+        system_prompt = f'Translate the user\'s export request (today: {date}) on a table of transactions with columns date, payment_method, category, note, amount into a filter. {ExportQuery.SPEC_PROMPT}'
 
-        # retrieve gpt response
-        response, content = self.get_response(message, system_prompt)
+        # retrieve gpt response (not cached: "last month" does not shift by days)
+        result = self.get_response(message, system_prompt, cacheable=False)
+        if result is None:
+            return None, None
+        response, content = result
 
-        # create csv file
-        file_stream = helper.create_file_stream(content['data'])
+        # run the spec locally on the transactions (local read model, sheet as fallback)
+        if self.store is not None and self.store.is_backfilled():
+            rows = list(self.store.export_rows(helper.config('google_sheet.header.items')))
+        else:
+            g_sheet_service = GoogleSheetService('export', spreadsheet_id=self.spreadsheet_id)
+            rows = g_sheet_service.convert_sheet_csv()
+        data = ExportQuery(rows).run(content)
+
+        # create xlsx file
+        file_stream = helper.create_file_stream(data)
 
         return response, file_stream
 
+    def transaction_prompt(self):
+        """
+        Builds the instructions used to extract transactions
+        Returns:
+            str: The transaction extraction instructions
+        """
+        # set current date
+        date = datetime.today().strftime('%d/%m/%Y')
+        # retrieve payment_methods and categories (cached when read from google sheets)
+        payment_methods = helper.join_values(self.reference_data.values('payment_methods'))
+        categories = helper.join_values(self.reference_data.values('categories'))
+
+        return f'each containing: date (dd/mm/yyyy, today: {date}), payment_method (one of [{payment_methods}], default: "Contanti"), category (one of [{categories}]), amount (if expense, negative), note (max 10 characters, not null or set to "-").'
+
     def generate_trans(self, message):
         """
         Generates a list of transactions based on the user's request
         Args:
             message (str): The user's request
         Returns:
-            Tuple[ChatCompletion, dict]: The OpenAI response and the parsed content
+            Tuple[ChatCompletion, dict]: The OpenAI response and the parsed content, (None, None) if the completion failed
         """
-        # set current date
-        date = datetime.today().strftime('%d/%m/%Y')
-        # retrieve payment_methods and categories from google sheets
-        if helper.config('google_sheet.use_gs.categories'):
-            g_sheet_service = GoogleSheetService('get_payment_methods')
-            payment_methods = g_sheet_service.get_payment_methods()
-        else:
-            payment_methods = helper.config('google_sheet.payment_methods')
+        # set system prompt
+        system_prompt = f'Given the input, return a JSON (can be empty, DO NOT INVENT) with the transactions, {self.transaction_prompt()}'
 
-        if helper.config('google_sheet.use_gs.categories'):
-            g_sheet_service = GoogleSheetService('get_categories')
-            categories = g_sheet_service.get_categories()
-        else:
-            categories = helper.config('google_sheet.categories')
+        # retrieve gpt response
+        return self.get_response(message, system_prompt) or (None, None)
 
+    def is_bulk(self, message):
+        """
+        Checks whether a message is too long for a single extraction completion
+        Args:
+            message (str): The user's request
+        Returns:
+            bool: True if openai.bulk is on and the message has more than openai.bulk.chunk_lines lines
+        """
+        if not helper.config('openai.bulk.status'):
+            return False
+        return len(bulk_extraction.message_lines(message)) > (helper.config('openai.bulk.chunk_lines') or 10)
+
+    def generate_trans_bulk(self, message, parser=None):
+        """
+        Extracts the transactions of a long message in line-aligned chunks, concurrently (openai_bulk pool)
+        Args:
+            message (str): The user's request
+            parser (LocalParser, optional): The local parser, tried on each chunk before the LLM
+        Returns:
+            Tuple[ChatCompletion, dict]: A completion summing the chunks usage and the merged content (failed_lines: the lines no completion answered), (None, None) if every completion failed
+        """
+        system_prompt = f'Given the input, return a JSON (can be empty, DO NOT INVENT) with the transactions, {self.transaction_prompt()}'
+        lines = bulk_extraction.message_lines(message)
+        chunks = bulk_extraction.split_chunks(lines, helper.config('openai.bulk.chunk_lines') or 10, helper.config('openai.bulk.chunk_chars') or 2000)
+
+        # map keeps the chunk order, the pool size caps the concurrent completions
+        with metrics.span('openai.bulk'):
+            results = list(executor.pool('openai_bulk').map(lambda chunk: self.extract_chunk(chunk, system_prompt, parser), chunks))
+
+        transactions = bulk_extraction.merge([transactions for transactions, _, _ in results], lines)
+        responses = [response for _, chunk_responses, _ in results for response in chunk_responses]
+        content = {'transactions': transactions, 'failed_lines': [line for _, _, failed in results for line in failed]}
+        # nothing extracted because the completions failed: same outcome as a failed single completion
+        if not transactions and content['failed_lines']:
+            return None, None
+        return helper.local_completion(content, helper.config('openai.model'), 'bulk', helper.sum_usage(responses)), content
+
+    def extract_chunk(self, lines, system_prompt, parser=None):
+        """
+        Extracts the transactions of a chunk, splitting it in halves while the completion is truncated
+        Args:
+            lines (list): The chunk lines
+            system_prompt (str): The extraction prompt
+            parser (LocalParser, optional): The local parser
+        Returns:
+            Tuple[list, list, list]: The transactions, the completions used and the lines of the failed completions
+        """
+        text = '\n'.join(lines)
+        if parser is not None and helper.config('general.local_parser.status'):
+            transactions, confidence = parser.parse(text)
+            if transactions and parser.is_confident(confidence):
+                return transactions, [], []
+        try:
+            result = self.get_response(text, system_prompt)
+        except ValueError:
+            # the json was cut at max_tokens
+            result = False
+        truncated = result is False or (result is not None and result[0].choices[0].finish_reason == 'length')
+        if truncated and len(lines) > 1:
+            middle = len(lines) // 2
+            first, first_responses, first_failed = self.extract_chunk(lines[:middle], system_prompt, parser)
+            second, second_responses, second_failed = self.extract_chunk(lines[middle:], system_prompt, parser)
+            return first + second, first_responses + second_responses, first_failed + second_failed
+        if not result:
+            # reported to the user: a dropped line would look recorded
+            print(f"Chunk extraction failed: {lines[0][:40]}...")
+            return [], [], list(lines)
+        response, content = result
+        return helper.sanitize_response(content), [response], []
+
+    def categorize(self, lines, categories, batch_size=40):
+        """
+        Assigns a category to each statement line, in numbered batches sent concurrently (openai_bulk pool)
+        Args:
+            lines (list): The statement lines ("expense: PAGAMENTO POS ESSELUNGA")
+            categories (list): The configured categories
+            batch_size (int): Lines per completion
+        Returns:
+            Tuple[list, list]: The category of each line (None if the model found none) and the completions used
+        """
+        lookup = {str(name).lower(): name for name in categories}
+        system_prompt = (
+            f'Assign each numbered bank statement line to one of the categories [{helper.join_values(categories)}]. '
+            'Return a JSON with the key "categories": an object mapping each line number to its category, null if none fits. DO NOT INVENT categories.'
+        )
+        batches = [lines[start:start + batch_size] for start in range(0, len(lines), batch_size)]
+        # map keeps the batch order, the pool size caps the concurrent completions
+        with metrics.span('openai.categorize'):
+            results = list(executor.pool('openai_bulk').map(lambda batch: self.categorize_batch(batch, system_prompt, lookup), batches))
+        return [category for batch, _ in results for category in batch], [response for _, responses in results for response in responses]
+
+    def categorize_batch(self, lines, system_prompt, lookup):
+        """
+        Categorizes a batch of lines, splitting it in halves while the completion is truncated
+        Args:
+            lines (list): The statement lines
+            system_prompt (str): The categorization prompt
+            lookup (dict): lowercase category => category
+        Returns:
+            Tuple[list, list]: The category of each line (None if unknown) and the completions used
+        """
+        message = '\n'.join(f"{number}. {line}" for number, line in enumerate(lines, start=1))
+        try:
+            result = self.get_response(message, system_prompt)
+        except ValueError:
+            # the json was cut at max_tokens
+            result = False
+        truncated = result is False or (result is not None and result[0].choices[0].finish_reason == 'length')
+        if truncated and len(lines) > 1:
+            middle = len(lines) // 2
+            first, first_responses = self.categorize_batch(lines[:middle], system_prompt, lookup)
+            second, second_responses = self.categorize_batch(lines[middle:], system_prompt, lookup)
+            return first + second, first_responses + second_responses
+        if not result:
+            print(f"Categorization failed: {lines[0][:40]}...")
+            return [None] * len(lines), []
+        response, content = result
+        answers = content.get('categories') if isinstance(content, dict) else None
+        answers = answers if isinstance(answers, dict) else {}
+        # only the configured categories are kept
+        return [lookup.get(str(answers.get(str(number)) or '').lower()) for number in range(1, len(lines) + 1)], [response]
+
+    def generate_combined(self, message):
+        """
+        Chooses the method and extracts the transactions with a single completion
+        Args:
+            message (str): The user's request
+        Returns:
+            Tuple[str, ChatCompletion, dict]: The chosen method, the OpenAI response and the parsed content, (None, None, None) if the completion failed
+        """
         # set system prompt
-        system_prompt = f'Given the input, return a JSON (can be empty, DO NOT INVENT) with the transactions, each containing: date (dd/mm/yyyy, today: {date}), payment_method (one of [{payment_methods}], default: "Contanti"), category (one of [{categories}]), amount (if expense, negative), note (max 10 characters, not null or set to "-").'
+        system_prompt = (
+            f'Determine whether the request records transactions ("{IntentRouter.TRANS_METHOD}") or asks for an export of recorded data ("{IntentRouter.EXPORT_METHOD}"). '
+            f'Return a JSON with the key "action". Only if action is "{IntentRouter.TRANS_METHOD}", add the key "transactions" (can be empty, DO NOT INVENT), {self.transaction_prompt()}'
+        )
 
         # retrieve gpt response
-        response, content = self.get_response(message, system_prompt)
+        result = self.get_response(message, system_prompt)
+        if result is None:
+            return None, None, None
+        response, content = result
+        return (content.get('action') if isinstance(content, dict) else None), response, content
 
-        return response, content
+    def dispatch(self, message, router=None, parser=None):
+        """
+        Routes the request and performs the chosen method
+        Args:
+            message (str): The user's request
+            router (IntentRouter, optional): The local pre-router
+            parser (LocalParser, optional): The local transactions parser
+        Returns:
+            Tuple[str, str, ChatCompletion, Any]: The method, the route source, the OpenAI response (None if a completion failed) and the method content
+        """
+        # obvious requests skip the LLM classification
+        method_name = None
+        if router and helper.config('openai.routing.pre_router'):
+            with metrics.span('router'):
+                method_name = router.route(message)
+
+        # simple entries are parsed locally, the LLM only sees the uncertain ones
+        # questions ("how much did I spend on 5 march?") are never parsed as entries
+        if method_name != IntentRouter.EXPORT_METHOD and parser and helper.config('general.local_parser.status') and not (router and router.is_query(message)):
+            with metrics.span('local_parser'):
+                transactions, confidence = parser.parse(message)
+            if transactions and parser.is_confident(confidence):
+                content = {'transactions': transactions}
+                return IntentRouter.TRANS_METHOD, 'local_parser', helper.local_completion(content, 'local-parser'), content
+
+        # long pasted statements are extracted in parallel chunks (never truncated at max_tokens)
+        if method_name != IntentRouter.EXPORT_METHOD and self.is_bulk(message):
+            response, content = self.generate_trans_bulk(message, parser)
+            return IntentRouter.TRANS_METHOD, 'bulk', response, content
 
-    def get_response(self, message, system_prompt):
+        if method_name:
+            response, content = getattr(self, method_name)(message)
+            return method_name, 'pre_router', response, content
+
+        if helper.config('openai.routing.mode') == 'combined':
+            # one completion returns both the action and the transactions
+            method_name, response, content = self.generate_combined(message)
+            if method_name != IntentRouter.EXPORT_METHOD:
+                return IntentRouter.TRANS_METHOD, 'combined', response, content
+            # the export spec has its own prompt: run the export completion
+            response, content = self.generate_export(message)
+            return method_name, 'combined', response, content
+
+        # retrieve method
+        method_name = self.get_method(message)
+        if method_name is None:
+            return IntentRouter.TRANS_METHOD, 'classifier', None, None
+        response, content = getattr(self, method_name)(message)
+        return method_name, 'classifier', response, content
+
+    def get_response(self, message, system_prompt, cacheable=True):
         """
         Retrieves the response from the OpenAI API
         Args:
             message (str): The user's request
             system_prompt (str): The system prompt to guide the response
+            cacheable (bool): Serve and store the response through the response cache
         Returns:
-            Tuple[ChatCompletion, dict]: The OpenAI response and the response content
+            Tuple[ChatCompletion, dict]: The OpenAI response and the response content, None if the request failed
         """
+        from openai import OpenAIError
         # define messages
         messages = [
             {
@@ -102,20 +346,33 @@ class OpenAIService:
                 'content': message
             }
         ]
+        model = helper.config('openai.model')
+        temperature = helper.config('openai.temperature')
+        # repeated requests are answered from the response cache
+        cache = ResponseCache.get() if cacheable else None
+        if cache is not None:
+            with metrics.span('openai.cache_lookup'):
+                content = cache.lookup(message, system_prompt, model, temperature, self.reference_data)
+            if content is not None:
+                return helper.local_completion(content, model, 'cache'), content
         try:
             # get response
-            response = self.client.chat.completions.create(
-                model=helper.config('openai.model'),
-                messages=messages,
-                max_tokens=helper.config('openai.max_tokens'),
-                temperature=helper.config('openai.temperature'),
-                response_format=helper.config('openai.response_format'),
-            )
+            with metrics.span('openai.completion'):
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=helper.config('openai.max_tokens'),
+                    temperature=temperature,
+                    response_format=dict(helper.config('openai.response_format')),
+                )
+            metrics.record_tokens(response.model or model, response.usage)
+            content = json.loads(response.choices[0].message.content)
+            if cache is not None:
+                cache.store(message, system_prompt, model, temperature, content, self.reference_data)
             # return message content response
-            return response, json.loads(response.choices[0].message.content)
+            return response, content
 
         except OpenAIError as e:
             # handle all OpenAI API errors
             print(f"Error: {e}")
-            return None
-            raise RuntimeError(f"OpenAI request failed: {e}")
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -0,0 +1,140 @@
+import time
+import threading
+import helper
+import executor
+from services.google_sheet_service import GoogleSheetService
+
+class ReferenceData:
+    """
+    TTL read-through cache of the categories and payment methods lists
+    """
+    # cached lists and the GoogleSheetService function that reads them
+    KINDS = {
+        'categories': 'get_categories',
+        'payment_methods': 'get_payment_methods'
+    }
+    # default time to live (seconds)
+    DEFAULT_TTL = 3600
+    # shared instance
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, spreadsheet_id=None, lists=None):
+        """
+        Initializes an empty cache
+        Args:
+            spreadsheet_id (str, optional): The spreadsheet holding the lists, defaults to the SPREADSHEET_ID env var
+            lists (dict, optional): Fixed lists per kind (tenant settings), used instead of settings.json and the sheet
+        """
+        self.spreadsheet_id = spreadsheet_id
+        self.lists = dict(lists or {})
+        # kind -> {'values': list, 'fetched_at': float}
+        self._entries = {}
+        self._lock = threading.Lock()
+        # kinds with a background refresh in flight
+        self._refreshing = set()
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared cache
+        Returns:
+            ReferenceData: The shared cache
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def values(self, kind):
+        """
+        Returns a reference list, served from cache when possible
+        Args:
+            kind (str): categories or payment_methods
+        Returns:
+            list: The reference list
+        """
+        # fixed lists do not need a cache
+        if kind in self.lists:
+            return list(self.lists[kind])
+        if not helper.config(f'google_sheet.use_gs.{kind}'):
+            return list(helper.config(f'google_sheet.{kind}'))
+
+        entry = self._entries.get(kind)
+        # cold cache: read through
+        if entry is None:
+            return list(self.refresh(kind))
+        # stale entry: serve it and revalidate in the background
+        if time.monotonic() - entry['fetched_at'] > (helper.config('google_sheet.cache.reference_ttl') or self.DEFAULT_TTL):
+            self.refresh_in_background(kind)
+        return list(entry['values'])
+
+    def refresh(self, kind):
+        """
+        Reads a reference list from Google Sheets and stores it
+        Args:
+            kind (str): categories or payment_methods
+        Returns:
+            list: The fresh list, the stale (or settings.json) one if Sheets is failing
+        """
+        try:
+            g_sheet_service = GoogleSheetService(self.KINDS[kind], spreadsheet_id=self.spreadsheet_id)
+            values = getattr(g_sheet_service, self.KINDS[kind])()
+        except Exception as e:
+            print(f"Failed to refresh {kind}: {e}")
+            values = False
+        # get_* return False on HttpError: keep serving what we have
+        if not isinstance(values, list):
+            entry = self._entries.get(kind)
+            return entry['values'] if entry else list(helper.config(f'google_sheet.{kind}'))
+        self.store(kind, values)
+        return values
+
+    def refresh_in_background(self, kind):
+        """
+        Schedules a refresh on the google_sheet pool, once per kind
+        Args:
+            kind (str): categories or payment_methods
+        """
+        with self._lock:
+            if kind in self._refreshing:
+                return
+            self._refreshing.add(kind)
+
+        def task():
+            try:
+                self.refresh(kind)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(kind)
+
+        executor.pool('google_sheet').submit(task)
+
+    def refresh_all(self):
+        """
+        Refreshes every list read from Google Sheets
+        """
+        for kind in self.KINDS:
+            if kind not in self.lists and helper.config(f'google_sheet.use_gs.{kind}'):
+                self.refresh(kind)
+
+    def store(self, kind, values):
+        """
+        Stores a reference list
+        Args:
+            kind (str): categories or payment_methods
+            values (list): The reference list
+        """
+        self._entries[kind] = {'values': list(values), 'fetched_at': time.monotonic()}
+
+    def invalidate(self, kind=None):
+        """
+        Drops one or all the cached lists
+        Args:
+            kind (str, optional): categories or payment_methods, all if omitted
+        """
+        if kind is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(kind, None)
@@ -0,0 +1,135 @@
+import time
+import html
+import asyncio
+import helper
+import metrics
+from collections import OrderedDict
+from telegram.error import RetryAfter
+
+# telegram message size limit
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Initializes a full token bucket
+        Args:
+            rate (float): Tokens added per second
+            capacity (int): Maximum burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class TelegramSender:
+    """
+    Rate limited Telegram sender (per chat and global token buckets, retry_after aware)
+    """
+    # per chat buckets kept in memory
+    MAX_CHATS = 1000
+    # shared instance
+    _instance = None
+
+    def __init__(self):
+        """
+        Initializes the buckets from general.telegram.rate
+        """
+        self.per_chat_rate = helper.config('general.telegram.rate.per_chat') or 1
+        self.per_chat_burst = helper.config('general.telegram.rate.per_chat_burst') or 3
+        self.max_retries = helper.config('general.telegram.rate.max_retries') or 3
+        global_rate = helper.config('general.telegram.rate.global') or 30
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = OrderedDict()
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared sender
+        Returns:
+            TelegramSender: The shared sender
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def chat_bucket(self, chat_id):
+        """
+        Returns the bucket of a chat (least recently used chats are dropped)
+        Args:
+            chat_id (int): The chat id
+        Returns:
+            TokenBucket: The chat bucket
+        """
+        bucket = self.chat_buckets.pop(chat_id, None) or TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        self.chat_buckets[chat_id] = bucket
+        if len(self.chat_buckets) > self.MAX_CHATS:
+            self.chat_buckets.popitem(last=False)
+        return bucket
+
+    async def send(self, chat_id, call):
+        """
+        Sends through the buckets, waiting retry_after on flood errors
+        Args:
+            chat_id (int): The chat id
+            call (Callable): Returns the Telegram API coroutine to await
+        Returns:
+            Any: The API result
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                with metrics.span('telegram.send'):
+                    return await call()
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                print(f"Flood control on chat {chat_id}, retrying in {retry_after}s")
+                await asyncio.sleep(retry_after)
+
+# render a transaction confirmation block (fields written by the model are escaped: the reply is HTML)
+def render_transaction(trans: dict, transaction: dict) -> str:
+    message = f"<b>{helper.lang(trans, 'telegram.message.fields.header')}</b>\n\n"
+    for key, value in transaction.items():
+        label = helper.lang(trans, f'telegram.message.fields.{key}')
+        # extra keys of the completion are not transaction fields
+        if label is None:
+            continue
+        value = f"{value:,.2f} €" if key == 'amount' else html.escape(str(value))
+        message += f"<b>{label}</b>: {value}\n"
+    return message
+
+# pack text blocks in as few messages as possible under the telegram limit
+def pack_messages(blocks: list, separator: str = '\n') -> list:
+    messages = []
+    current = ''
+    for block in blocks:
+        candidate = f"{current}{separator}{block}" if current else block
+        if len(candidate) <= MAX_MESSAGE_LENGTH:
+            current = candidate
+            continue
+        if current:
+            messages.append(current)
+        # a single block never exceeds the limit in practice, cut it anyway
+        while len(block) > MAX_MESSAGE_LENGTH:
+            messages.append(block[:MAX_MESSAGE_LENGTH])
+            block = block[MAX_MESSAGE_LENGTH:]
+        current = block
+    if current:
+        messages.append(current)
+    return messages
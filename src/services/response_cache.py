@@ -0,0 +1,178 @@
+import re
+import json
+import hashlib
+import threading
+import helper
+from datetime import datetime, timedelta
+from database.llm_cache import LLMCache
+from services.reference_data import ReferenceData
+
+# month names ("may" alone is the verb more often than the month)
+MONTHS = (
+    r'(?:gennaio|febbraio|marzo|aprile|maggio|giugno|luglio|agosto|settembre|ottobre|novembre|dicembre'
+    r'|january|february|march|april|may|june|july|august|september|october|november|december)'
+)
+# an explicit date in the message (resolved results must not move with the calendar): month names count next to a day number only
+EXPLICIT_DATE_PATTERN = re.compile(
+    r'\d{1,2}/\d{1,2}|\d{4}-\d{1,2}-\d{1,2}'
+    rf'|\b\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?{MONTHS}\b|\b{MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?\b(?!\s*(?:€|eur\b|euro\b|[.,]\d))',
+    re.IGNORECASE
+)
+# a year in the message ("5/3/2024", "5 maggio 2024"), amounts excluded
+EXPLICIT_YEAR_PATTERN = re.compile(r'\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{1,2}-\d{1,2}|(?<![€$.,\d])\b(?:19|20)\d{2}\b(?!\s*(?:€|eur\b|euro\b)|[.,]\d)', re.IGNORECASE)
+# a month without a day ("affitto di marzo") resolves against the current month: never served from cache
+BARE_MONTH_PATTERN = re.compile(MONTHS.replace('|may|', '|') + r'\b', re.IGNORECASE)
+# weekdays resolve to a different offset every day: never served from cache
+WEEKDAY_PATTERN = re.compile(r'\b(?:luned|marted|mercoled|gioved|venerd|sabato|domenica|monday|tuesday|wednesday|thursday|friday|saturday|sunday)', re.IGNORECASE)
+# a bare day of the month ("il 5", "on the 3rd") depends on the current month: never served from cache
+DAY_NUMBER_PATTERN = re.compile(r"\b(?:il|l'|dal|al|del|the)\s*\d{1,2}(?:st|nd|rd|th)?\b(?!/|\s*(?:€|eur\b|euro\b))|\b\d{1,2}(?:st|nd|rd|th)\b", re.IGNORECASE)
+# dates in a response
+RESPONSE_DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})|(\d{4})-(\d{1,2})-(\d{1,2})')
+
+class ResponseCache:
+    """
+    Cache of LLM responses keyed on the normalized request, with relative dates re-resolved on hits
+    """
+    # shared instance
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, cache):
+        """
+        Initializes the counters
+        Args:
+            cache (LLMCache): The on-disk cache
+        """
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared cache
+        Returns:
+            ResponseCache: The shared cache, None if openai.cache.status is off
+        """
+        if not helper.config('openai.cache.status'):
+            return None
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(LLMCache(
+                        helper.project_path(helper.config('openai.cache.path')),
+                        helper.config('openai.cache.ttl') or 2592000,
+                        helper.config('openai.cache.max_entries') or 5000
+                    ))
+        return cls._instance
+
+    def lookup(self, message, system_prompt, model, temperature, reference_data=None):
+        """
+        Returns the cached content of a request
+        Args:
+            message (str): The user's request
+            system_prompt (str): The system prompt
+            model (str): The model
+            temperature (float): The temperature
+            reference_data (ReferenceData, optional): The lists the answer depends on, defaults to the shared ones
+        Returns:
+            Any: The content with relative dates moved to today, None on miss
+        """
+        entry = None
+        if is_cacheable(message):
+            entry = self.cache.get(cache_key(message, system_prompt, model, temperature, reference_data))
+            # "5 maggio" or "5/3" was resolved in the year of the request: stale in any other year
+            if entry is not None and EXPLICIT_DATE_PATTERN.search(message) and not EXPLICIT_YEAR_PATTERN.search(message) and entry['base_date'][:4] != datetime.today().strftime('%Y'):
+                entry = None
+        with self._counter_lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+        if EXPLICIT_DATE_PATTERN.search(message):
+            return entry['content']
+        # "ieri", "today" or no date at all: same offset from the day of the request
+        days = (datetime.today().date() - datetime.strptime(entry['base_date'], '%Y-%m-%d').date()).days
+        return shift_dates(entry['content'], days)
+
+    def store(self, message, system_prompt, model, temperature, content, reference_data=None):
+        """
+        Caches the content of a request (empty extractions are not cached)
+        Args:
+            message (str): The user's request
+            system_prompt (str): The system prompt
+            model (str): The model
+            temperature (float): The temperature
+            content (Any): The parsed response content
+            reference_data (ReferenceData, optional): The lists the answer depends on, defaults to the shared ones
+        """
+        if not content or not is_cacheable(message):
+            return
+        if isinstance(content, dict) and content.get('transactions') == []:
+            return
+        self.cache.put(cache_key(message, system_prompt, model, temperature, reference_data), content, model, datetime.today().strftime('%Y-%m-%d'))
+
+    def stats(self):
+        """
+        Returns the cache counters
+        Returns:
+            dict: hits, misses, hit_ratio and size
+        """
+        with self._counter_lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            'size': self.cache.size()
+        }
+
+# requests whose dates do not move by a fixed offset (weekdays, bare day numbers, bare months) are never cached
+def is_cacheable(message: str) -> bool:
+    if WEEKDAY_PATTERN.search(message) or DAY_NUMBER_PATTERN.search(message):
+        return False
+    return not BARE_MONTH_PATTERN.search(EXPLICIT_DATE_PATTERN.sub(' ', message))
+
+# lowercase, single spaced, without trailing punctuation
+def normalize_message(message: str) -> str:
+    return re.sub(r'\s+', ' ', message.lower()).strip().rstrip('.!')
+
+# system prompt without the current date (prompts embed "today: dd/mm/yyyy")
+def prompt_template(system_prompt: str) -> str:
+    return system_prompt.replace(datetime.today().strftime('%d/%m/%Y'), '{today}')
+
+# version of the categories and payment methods the answers were resolved against
+def reference_version(reference_data: ReferenceData = None) -> str:
+    reference_data = reference_data or ReferenceData.get()
+    values = [reference_data.values('categories'), reference_data.values('payment_methods')]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# cache key of a request
+def cache_key(message: str, system_prompt: str, model: str, temperature: float, reference_data: ReferenceData = None) -> str:
+    parts = [normalize_message(message), prompt_template(system_prompt), model, temperature, reference_version(reference_data)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# move every dd/mm/yyyy or yyyy-mm-dd date of a response by a number of days
+def shift_dates(content, days: int):
+    if days == 0:
+        return content
+    if isinstance(content, dict):
+        return {key: shift_dates(value, days) for key, value in content.items()}
+    if isinstance(content, list):
+        return [shift_dates(value, days) for value in content]
+    if isinstance(content, str):
+        return RESPONSE_DATE_PATTERN.sub(lambda match: _shift_date(match, days), content)
+    return content
+
+def _shift_date(match, days):
+    try:
+        if match.group(1):
+            date = datetime(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+            return (date + timedelta(days=days)).strftime('%d/%m/%Y')
+        date = datetime(int(match.group(4)), int(match.group(5)), int(match.group(6)))
+        return (date + timedelta(days=days)).strftime('%Y-%m-%d')
+    except ValueError:
+        return match.group(0)
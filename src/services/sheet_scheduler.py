@@ -0,0 +1,236 @@
+import time
+import random
+import threading
+import helper
+import metrics
+from concurrent.futures import Future
+from googleapiclient.errors import HttpError
+
+# statuses retried with backoff (quota exceeded, transient server errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# statuses retried for requests that are not idempotent (a 5xx may come after the write was applied)
+REJECTED_STATUSES = {429}
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: callers reserve a token and sleep until it is theirs (first come, first served)
+    """
+    def __init__(self, per_minute, burst):
+        """
+        Initializes a full bucket
+        Args:
+            per_minute (float): Tokens added per minute, 0 to disable the limit
+            burst (int): Maximum burst
+        """
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting for it if the bucket is empty
+        Returns:
+            float: The seconds waited
+        """
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def drain(self):
+        """
+        Empties the bucket after a quota error, so the next callers slow down too
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = time.monotonic()
+
+class SheetScheduler:
+    """
+    Quota-aware scheduler of Google Sheets requests: read/write token buckets, single-flight reads,
+    value updates merged into one batchUpdate and jittered exponential backoff on 429/5xx
+    """
+    def __init__(self, read_per_minute=60, write_per_minute=60, burst=10, max_retries=5, backoff_base=1.0, backoff_max=32.0):
+        """
+        Initializes the buckets
+        Args:
+            read_per_minute (float): Read requests per minute, 0 for no limit
+            write_per_minute (float): Write requests per minute, 0 for no limit
+            burst (int): Requests sent back to back before the rate applies
+            max_retries (int): Retries of a request failing with 429/5xx
+            backoff_base (float): First backoff (seconds), doubled on each retry
+            backoff_max (float): Maximum backoff (seconds)
+        """
+        self.read_bucket = RateLimiter(read_per_minute, burst)
+        self.write_bucket = RateLimiter(write_per_minute, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # read key => Future of the request in flight
+        self._reads = {}
+        # (spreadsheet, value input option) => value updates waiting for a write token
+        self._updates = {}
+        self._lock = threading.Lock()
+        self.counters = {'coalesced_reads': 0, 'merged_updates': 0, 'throttled': 0, 'retries': 0}
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates a scheduler sized on google_sheet.quota
+        Returns:
+            SheetScheduler: The scheduler
+        """
+        quota = helper.config('google_sheet.quota')
+        return cls(
+            quota.get('read_per_minute', 60),
+            quota.get('write_per_minute', 60),
+            quota.get('burst', 10),
+            quota.get('max_retries', 5),
+            quota.get('backoff_base', 1.0),
+            quota.get('backoff_max', 32.0)
+        )
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def acquire(self, bucket):
+        """
+        Waits for a token of a bucket
+        Args:
+            bucket (RateLimiter): The read or write bucket
+        """
+        with metrics.span('google_sheet.quota_wait'):
+            if bucket.acquire():
+                self._count('throttled')
+
+    def run(self, bucket, call, acquired=False, retry_statuses=RETRY_STATUSES):
+        """
+        Runs a request within the quota, retrying 429/5xx with full jitter backoff
+        Args:
+            bucket (RateLimiter): The read or write bucket
+            call (callable): Performs the request
+            acquired (bool): The token of the first attempt is already taken
+            retry_statuses (set): The statuses retried
+        Returns:
+            dict: The response body
+        """
+        attempt = 0
+        while True:
+            if attempt or not acquired:
+                self.acquire(bucket)
+            try:
+                return call()
+            except HttpError as e:
+                status = getattr(e.resp, 'status', None)
+                if status not in retry_statuses or attempt >= self.max_retries:
+                    raise
+                if status == 429:
+                    bucket.drain()
+                # Retry-After wins over the computed backoff
+                retry_after = e.resp.get('retry-after') if hasattr(e.resp, 'get') else None
+                delay = float(retry_after) if retry_after and str(retry_after).isdigit() else random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                print(f"Google Sheets {status}, retry {attempt + 1} in {delay:.1f}s")
+                self._count('retries')
+                attempt += 1
+                time.sleep(delay)
+
+    def read(self, key, call):
+        """
+        Runs a read, sharing the response with identical reads already in flight
+        Args:
+            key (Hashable): Identifies the read (method, uri, body)
+            call (callable): Performs the request
+        Returns:
+            dict: The response body
+        """
+        with self._lock:
+            future = self._reads.get(key)
+            leader = future is None
+            if leader:
+                future = self._reads[key] = Future()
+            else:
+                self.counters['coalesced_reads'] += 1
+        if not leader:
+            return future.result()
+        try:
+            result = self.run(self.read_bucket, call)
+        except BaseException as e:
+            with self._lock:
+                del self._reads[key]
+            future.set_exception(e)
+            raise
+        # later reads must see later writes: never served from a finished read
+        with self._lock:
+            del self._reads[key]
+        future.set_result(result)
+        return result
+
+    def write(self, call, idempotent=True):
+        """
+        Runs a write
+        Args:
+            call (callable): Performs the request
+            idempotent (bool): Repeating the request is harmless, False retries only the rejected (429) attempts
+        Returns:
+            dict: The response body
+        """
+        return self.run(self.write_bucket, call, retry_statuses=RETRY_STATUSES if idempotent else REJECTED_STATUSES)
+
+    def update(self, key, data, batch_update):
+        """
+        Queues value updates, merged with the ones of the same spreadsheet waiting for a write token
+        Args:
+            key (Hashable): The spreadsheet and value input option
+            data (list): The {'range', 'values'} updates
+            batch_update (callable): Sends a batchUpdate of a data list, returns its response
+        Returns:
+            list: The update responses of data, in order
+        """
+        future = Future()
+        with self._lock:
+            pending = self._updates.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._updates[key] = []
+            else:
+                self.counters['merged_updates'] += 1
+            pending.append((data, future))
+        if not leader:
+            return future.result()
+
+        # the updates queued while waiting for the token travel in the same request
+        self.acquire(self.write_bucket)
+        with self._lock:
+            pending = self._updates.pop(key)
+        merged = [item for data, _ in pending for item in data]
+        try:
+            response = self.run(self.write_bucket, lambda: batch_update(merged), acquired=True)
+        except BaseException as e:
+            for _, waiting in pending:
+                waiting.set_exception(e)
+            raise
+        responses = response.get('responses', [])
+        offset = 0
+        for data, waiting in pending:
+            waiting.set_result(responses[offset:offset + len(data)])
+            offset += len(data)
+        return future.result()
+
+    def stats(self):
+        """
+        Returns the scheduler counters
+        Returns:
+            dict: coalesced_reads, merged_updates, throttled and retries
+        """
+        with self._lock:
+            return dict(self.counters)
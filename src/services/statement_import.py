@@ -0,0 +1,454 @@
+import io
+import re
+import csv
+import codecs
+import helper
+import metrics
+from collections import Counter
+from datetime import datetime
+from database import local_store
+from services.reference_data import ReferenceData
+
+class StatementImporter:
+    """
+    Imports CSV/XLSX bank statements: read in chunks, columns detected from the header, rows categorized
+    by vectorized keyword matching and only the ambiguous descriptions sent to the LLM (in batches)
+    """
+    # header keywords of each column (Italian and English exports), an exact header beats a partial one
+    COLUMNS = {
+        'date': ['data operazione', 'data contabile', 'booking date', 'transaction date', 'completed date', 'started date', 'data', 'date', 'data valuta', 'value date'],
+        'amount': ['importo', 'amount', 'ammontare', 'totale', 'total'],
+        'debit': ['addebiti', 'addebito', 'uscite', 'dare', 'debit', 'withdrawal', 'paid out'],
+        'credit': ['accrediti', 'accredito', 'entrate', 'avere', 'credit', 'deposit', 'paid in'],
+        'description': ['descrizione', 'description', 'causale', 'dettagli', 'details', 'beneficiario', 'payee', 'merchant', 'memo', 'narrative', 'note'],
+        'payment_method': ['metodo', 'payment method', 'tipo operazione', 'type']
+    }
+    # date formats tried in order (day first, like the bot)
+    DATE_FORMATS = ['%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%Y/%m/%d', '%d-%m-%y', '%d.%m.%y']
+    # rows scanned for the header (exports often start with the account details)
+    HEADER_ROWS = 30
+    # bytes sniffed for the encoding and the delimiter
+    SAMPLE_SIZE = 64 * 1024
+    # defaults of general.statement_import
+    DEFAULT_CHUNK_ROWS = 1000
+    DEFAULT_LLM_BATCH = 40
+
+    def __init__(self, openai_service, translations, reference_data=None, store=None):
+        """
+        Initializes the importer
+        Args:
+            openai_service (OpenAIService): Categorizes the ambiguous descriptions
+            translations (dict): The loaded translations (parser.* vocabulary)
+            reference_data (ReferenceData, optional): The categories and payment methods, defaults to the shared ones
+            store (LocalStore, optional): The recorded transactions, rows already there are not imported again
+        """
+        self.openai_service = openai_service
+        self.store = store
+        self.reference_data = reference_data or ReferenceData.get()
+        vocabulary = helper.lang(translations, 'parser') or {}
+        self.categories = list(self.reference_data.values('categories'))
+        self.payment_methods = list(self.reference_data.values('payment_methods'))
+        # value => regex of its name and vocabulary aliases
+        self.patterns = {
+            'categories': self.keyword_patterns(self.categories, vocabulary.get('categories', {})),
+            'payment_methods': self.keyword_patterns(self.payment_methods, vocabulary.get('payment_methods', {}))
+        }
+        # words dropped from the notes ("pagamento pos ...")
+        noise = sorted({word.lower() for word in list(vocabulary.get('stopwords', [])) + list(vocabulary.get('statement', []))}, key=len, reverse=True)
+        self.noise_pattern = r'(?<!\w)(?:' + '|'.join(re.escape(word) for word in noise) + r')(?!\w)' if noise else None
+
+    @staticmethod
+    def keyword_patterns(names, aliases):
+        """
+        Builds a whole word regex per reference value, matching its name and its aliases
+        Args:
+            names (list): The reference values
+            aliases (dict): alias => value (parser vocabulary)
+        Returns:
+            dict: value => regex
+        """
+        keywords = {str(name): {str(name).lower()} for name in names}
+        lookup = {str(name).lower(): str(name) for name in names}
+        for alias, name in dict(aliases).items():
+            # only aliases of configured values
+            if str(name).lower() in lookup:
+                keywords[lookup[str(name).lower()]].add(alias.lower())
+        return {
+            name: r'(?<!\w)(?:' + '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True)) + r')(?!\w)'
+            for name, words in keywords.items()
+        }
+
+    @classmethod
+    def detect_columns(cls, header):
+        """
+        Maps the statement columns on the header cells
+        Args:
+            header (list): The header cells
+        Returns:
+            dict: column (date, amount, debit, credit, description, payment_method) => header index
+        """
+        cells = [re.sub(r'\s+', ' ', str(cell or '')).strip().lower() for cell in header]
+        columns = {}
+        for column, keywords in cls.COLUMNS.items():
+            for keyword in keywords:
+                taken = set(columns.values())
+                exact = [index for index, cell in enumerate(cells) if cell == keyword and index not in taken]
+                partial = [index for index, cell in enumerate(cells) if re.search(r'(?<!\w)' + re.escape(keyword) + r'(?!\w)', cell) and index not in taken]
+                if exact or partial:
+                    columns[column] = (exact or partial)[0]
+                    break
+        return columns
+
+    @classmethod
+    def is_header(cls, columns):
+        """
+        Checks whether the detected columns are enough to import a statement
+        Args:
+            columns (dict): The detect_columns result
+        Returns:
+            bool: True if there are a date and an amount (or debit/credit) column
+        """
+        return 'date' in columns and ('amount' in columns or 'debit' in columns or 'credit' in columns)
+
+    def find_header(self, rows):
+        """
+        Finds the header among the first rows
+        Args:
+            rows (list): The first rows of the file
+        Returns:
+            Tuple[int, dict]: The header row index and its columns
+        Raises:
+            ValueError: If no row names a date and an amount column
+        """
+        for index, row in enumerate(rows[:self.HEADER_ROWS]):
+            columns = self.detect_columns(row)
+            if self.is_header(columns):
+                return index, columns
+        raise ValueError('No date and amount columns found in the statement header')
+
+    def read_csv(self, stream, chunk_rows):
+        """
+        Reads a CSV statement in chunks (encoding, delimiter and header detected from the first bytes)
+        Args:
+            stream (BinaryIO): The file
+            chunk_rows (int): Rows per chunk
+        Returns:
+            Iterator[pd.DataFrame]: The chunks, with the statement column names
+        """
+        import pandas as pd
+        sample = stream.read(self.SAMPLE_SIZE)
+        stream.seek(0)
+        # bank exports are utf-8 or windows-1252
+        try:
+            encoding, text = 'utf-8-sig', codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        except UnicodeDecodeError:
+            encoding, text = 'cp1252', sample.decode('cp1252', errors='replace')
+        lines = text.splitlines()[:self.HEADER_ROWS]
+        try:
+            delimiter = csv.Sniffer().sniff('\n'.join(lines), delimiters=';,\t|').delimiter
+        except csv.Error:
+            delimiter = ';' if text.count(';') >= text.count(',') else ','
+        header_index, columns = self.find_header(list(csv.reader(lines, delimiter=delimiter)))
+
+        chunks = pd.read_csv(
+            io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=''),
+            sep=delimiter,
+            skiprows=header_index,
+            header=0,
+            dtype=str,
+            keep_default_na=False,
+            skipinitialspace=True,
+            on_bad_lines='skip',
+            chunksize=chunk_rows
+        )
+        for chunk in chunks:
+            yield self.select_columns(chunk, columns)
+
+    def read_xlsx(self, stream, chunk_rows):
+        """
+        Reads the first sheet of an XLSX statement in chunks (read-only workbook, rows streamed)
+        Args:
+            stream (BinaryIO): The file
+            chunk_rows (int): Rows per chunk
+        Returns:
+            Iterator[pd.DataFrame]: The chunks, with the statement column names
+        """
+        import pandas as pd
+        from openpyxl import load_workbook
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            head = []
+            for row in rows:
+                head.append([self.cell_text(cell) for cell in row])
+                if len(head) >= self.HEADER_ROWS:
+                    break
+            header_index, columns = self.find_header(head)
+            width = len(head[header_index])
+
+            # rows read with the header scan come first
+            def body():
+                yield from head[header_index + 1:]
+                for row in rows:
+                    yield [self.cell_text(cell) for cell in row]
+
+            chunk = []
+            for row in body():
+                chunk.append((list(row) + [''] * width)[:width])
+                if len(chunk) >= chunk_rows:
+                    yield self.select_columns(pd.DataFrame(chunk), columns)
+                    chunk = []
+            if chunk:
+                yield self.select_columns(pd.DataFrame(chunk), columns)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def cell_text(cell):
+        # excel dates are written as dd/mm/yyyy, the other cells as text
+        if cell is None:
+            return ''
+        if isinstance(cell, datetime):
+            return cell.strftime('%d/%m/%Y')
+        return str(cell)
+
+    @staticmethod
+    def select_columns(chunk, columns):
+        """
+        Keeps the detected columns of a chunk, renamed to the statement column names
+        Args:
+            chunk (pd.DataFrame): The raw chunk
+            columns (dict): column => position
+        Returns:
+            pd.DataFrame: The chunk with the date, amount, debit, credit, description and payment_method columns found
+        """
+        present = {column: position for column, position in columns.items() if position < chunk.shape[1]}
+        frame = chunk.iloc[:, list(present.values())].copy()
+        frame.columns = list(present)
+        return frame.reset_index(drop=True)
+
+    @classmethod
+    def to_dates(cls, column):
+        """
+        Normalizes statement dates to dd/mm/yyyy
+        Args:
+            column (pd.Series): The raw dates
+        Returns:
+            pd.Series: The dd/mm/yyyy dates (NaN if not parsable)
+        """
+        import pandas as pd
+        # drop the time of "2024-03-01 10:22:00" / "2024-03-01T10:22"
+        cleaned = column.astype(str).str.strip().str.replace(r'[ T]\d{1,2}:\d{2}.*$', '', regex=True)
+        dates = pd.Series(pd.NaT, index=column.index, dtype='datetime64[ns]')
+        for date_format in cls.DATE_FORMATS:
+            missing = dates.isna()
+            if not missing.any():
+                break
+            dates = dates.fillna(pd.to_datetime(cleaned.where(missing), format=date_format, errors='coerce'))
+        return dates.dt.strftime('%d/%m/%Y')
+
+    @staticmethod
+    def to_amounts(column):
+        """
+        Converts statement amounts ("-1.234,50", "1,234.50", "45,00-", "€ 12") to numbers
+        Args:
+            column (pd.Series): The raw amounts
+        Returns:
+            pd.Series: The numeric amounts (NaN if not parsable)
+        """
+        import pandas as pd
+        cleaned = column.astype(str).str.replace(r'[^\d,.\-+]', '', regex=True)
+        # trailing sign: "45,00-"
+        trailing = cleaned.str.endswith('-') & ~cleaned.str.startswith('-')
+        cleaned = cleaned.where(~trailing, '-' + cleaned.str.rstrip('-'))
+        # "1.200" / "1.200,50": dot as thousands separator, comma as decimal separator
+        comma_decimal = cleaned.str.contains(r',\d{1,2}$') | cleaned.str.fullmatch(r'[-+]?\d{1,3}(?:\.\d{3})+')
+        cleaned = cleaned.where(~comma_decimal, cleaned.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        cleaned = cleaned.where(comma_decimal, cleaned.str.replace(',', '', regex=False))
+        return pd.to_numeric(cleaned, errors='coerce').round(2)
+
+    def normalize(self, chunk):
+        """
+        Parses the dates and amounts of a chunk, dropping the rows that are not transactions (balances, totals)
+        Args:
+            chunk (pd.DataFrame): A chunk with the statement column names
+        Returns:
+            pd.DataFrame: date, amount, description and payment_method (raw text) of the transactions
+        """
+        import pandas as pd
+        frame = pd.DataFrame(index=chunk.index)
+        frame['date'] = self.to_dates(chunk['date'])
+        if 'amount' in chunk:
+            frame['amount'] = self.to_amounts(chunk['amount'])
+        else:
+            # separate columns: expenses are negative
+            debit = self.to_amounts(chunk['debit']).abs() if 'debit' in chunk else pd.Series(float('nan'), index=chunk.index)
+            credit = self.to_amounts(chunk['credit']).abs() if 'credit' in chunk else pd.Series(float('nan'), index=chunk.index)
+            frame['amount'] = credit.fillna(0) - debit.fillna(0)
+            frame.loc[debit.isna() & credit.isna(), 'amount'] = float('nan')
+        empty = pd.Series('', index=chunk.index)
+        frame['description'] = chunk.get('description', empty).astype(str).str.replace(r'\s+', ' ', regex=True).str.strip()
+        frame['payment_method'] = chunk.get('payment_method', empty).astype(str).str.strip()
+        return frame[frame['date'].notna() & frame['amount'].notna() & (frame['amount'] != 0)]
+
+    def match(self, text, kind):
+        """
+        Matches texts on the reference values, one vectorized regex pass per value
+        Args:
+            text (pd.Series): The lowercase texts
+            kind (str): categories or payment_methods
+        Returns:
+            pd.Series: The value of each text, None when no value or more than one value matches
+        """
+        import pandas as pd
+        patterns = self.patterns[kind]
+        if not patterns or text.empty:
+            return pd.Series(None, index=text.index, dtype=object)
+        hits = pd.DataFrame({name: text.str.contains(pattern, regex=True) for name, pattern in patterns.items()}, index=text.index)
+        return hits.idxmax(axis=1).where(hits.sum(axis=1) == 1, None)
+
+    def notes(self, description):
+        """
+        Builds the notes (max 10 characters) of the descriptions, without the statement boilerplate
+        Args:
+            description (pd.Series): The descriptions
+        Returns:
+            pd.Series: The notes
+        """
+        text = description.str.lower().str.replace(r'[\d\W_]+', ' ', regex=True)
+        if self.noise_pattern:
+            text = text.str.replace(self.noise_pattern, ' ', regex=True)
+        text = text.str.replace(r'\s+', ' ', regex=True).str.strip().str[:10].str.strip()
+        return text.where(text != '', '-')
+
+    def prepare(self, chunk, default_payment_method):
+        """
+        Parses a chunk and matches its categories, payment methods and notes locally
+        Args:
+            chunk (pd.DataFrame): A chunk with the statement column names
+            default_payment_method (str): The payment method of the rows that name none
+        Returns:
+            pd.DataFrame: date, amount, description, category (None if ambiguous), payment_method and note
+        """
+        frame = self.normalize(chunk)
+        text = frame['description'].str.lower()
+        frame['category'] = self.match(text, 'categories')
+        payment_methods = self.match(frame['payment_method'].str.lower(), 'payment_methods')
+        frame['payment_method'] = payment_methods.fillna(self.match(text, 'payment_methods')).fillna(default_payment_method)
+        frame['note'] = self.notes(frame['description'])
+        return frame
+
+    def unseen(self, frame, matched, chat_ids):
+        """
+        Flags the rows that are not recorded yet (same date, amount and note in the local store)
+        Args:
+            frame (pd.DataFrame): A prepared chunk
+            matched (Counter): The stored keys already matched by the previous chunks, updated
+            chat_ids (list): The completions of this import (their rows are not duplicates)
+        Returns:
+            pd.Series: True for the rows to import
+        """
+        import pandas as pd
+        if self.store is None or frame.empty:
+            return pd.Series(True, index=frame.index)
+        paid_at = pd.to_datetime(frame['date'], format='%d/%m/%Y').dt.strftime('%Y-%m-%d')
+        keys = [local_store.import_key(date, amount, note) for date, amount, note in zip(paid_at, frame['amount'], frame['note'])]
+        available = Counter(self.store.transaction_keys(paid_at.min(), paid_at.max(), chat_ids)) - matched
+        # a row twice in the statement is two transactions: each stored row hides one statement row
+        flags = []
+        for key in keys:
+            seen = available[key] > 0
+            if seen:
+                available[key] -= 1
+                matched[key] += 1
+            flags.append(not seen)
+        return pd.Series(flags, index=frame.index)
+
+    def categorize(self, frame, known, batch_size):
+        """
+        Categorizes the ambiguous rows of a chunk with the LLM, each description once per file
+        Args:
+            frame (pd.DataFrame): A prepared chunk, updated in place
+            known (dict): sign + description => category of the descriptions already asked, updated
+            batch_size (int): Lines per completion
+        Returns:
+            Tuple[int, list]: The rows categorized by the LLM and the completions used
+        """
+        # the LLM sees each ambiguous description once (the same shop appears many times), with its sign
+        ambiguous = frame['category'].isna()
+        keys = (frame['amount'] > 0).map({True: '+', False: '-'}) + frame['description'].str.lower().str.replace(r'[\d\W_]+', ' ', regex=True).str.strip()
+        unique = keys[ambiguous].drop_duplicates()
+        unique = unique[~unique.isin(list(known))]
+        responses = []
+        if len(unique):
+            lines = [
+                f"{'income' if key[0] == '+' else 'expense'}: {frame.at[index, 'description'] or '-'}"
+                for index, key in unique.items()
+            ]
+            with metrics.span('statement_import.categorize'):
+                categories, responses = self.openai_service.categorize(lines, self.categories, batch_size)
+            known.update(zip(unique.values, categories))
+        frame.loc[ambiguous, 'category'] = keys[ambiguous].map(known)
+        return int((ambiguous & frame['category'].notna()).sum()), responses
+
+    def run(self, stream, file_name, commit, caption=None):
+        """
+        Imports a statement one chunk at a time, each chunk journaled before the next one is read
+        Args:
+            stream (BinaryIO): The file
+            file_name (str): The file name (.csv or .xlsx)
+            commit (callable): Journals the transactions of a chunk, commit(completion, transactions) with a completion
+            summing the chunk categorization usage and the transactions in sanitize_response shape (file order)
+            caption (str, optional): The document caption, naming the payment method of the rows that do not
+        Returns:
+            dict: The counters (rows, imported, local, llm, skipped, duplicates)
+        Raises:
+            ValueError: If the header cannot be detected
+        """
+        import pandas as pd
+        settings = helper.config('general.statement_import')
+        chunk_rows = settings.get('chunk_rows') or self.DEFAULT_CHUNK_ROWS
+        batch_size = settings.get('llm_batch') or self.DEFAULT_LLM_BATCH
+        reader = self.read_xlsx if file_name.lower().endswith('.xlsx') else self.read_csv
+
+        # payment method of the whole file: the caption, then the local parser default
+        default_payment_method = None
+        if caption:
+            default_payment_method = self.match(pd.Series([caption.lower()]), 'payment_methods').iloc[0]
+        if default_payment_method is None:
+            default_payment_method = helper.config('general.local_parser.default_payment_method') or 'Contanti'
+        # what the LLM could not place either goes to the fallback category, if any
+        fallback = settings.get('fallback_category')
+        if not (fallback and str(fallback).lower() in {str(name).lower() for name in self.categories}):
+            fallback = None
+
+        counters = {'rows': 0, 'imported': 0, 'local': 0, 'llm': 0, 'skipped': 0, 'duplicates': 0}
+        known = {}
+        matched = Counter()
+        chat_ids = []
+        for chunk in reader(stream, chunk_rows):
+            with metrics.span('statement_import.parse'):
+                frame = self.prepare(chunk, default_payment_method)
+            # rows of a statement imported before are skipped (re-sent files, overlapping periods)
+            fresh = self.unseen(frame, matched, chat_ids)
+            duplicates = len(frame) - int(fresh.sum())
+            frame = frame[fresh].copy()
+            local = int(frame['category'].notna().sum())
+            llm, responses = self.categorize(frame, known, batch_size)
+            if fallback:
+                frame['category'] = frame['category'].fillna(fallback)
+            resolved = frame[frame['category'].notna()]
+
+            transactions = [
+                {'date': date, 'payment_method': payment_method, 'category': category, 'amount': float(amount), 'note': note}
+                for date, payment_method, category, amount, note in resolved[['date', 'payment_method', 'category', 'amount', 'note']].itertuples(index=False)
+            ]
+            chunk_counters = {'rows': len(chunk), 'imported': len(transactions), 'local': local, 'llm': llm, 'skipped': len(chunk) - duplicates - len(transactions), 'duplicates': duplicates}
+            for key, value in chunk_counters.items():
+                counters[key] += value
+            if transactions:
+                model = helper.config('openai.model') if responses else 'statement-import'
+                completion = helper.local_completion(chunk_counters, model, 'import', helper.sum_usage(responses))
+                chat_ids.append(completion.id)
+                commit(completion, transactions)
+        return counters
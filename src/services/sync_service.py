@@ -0,0 +1,143 @@
+import helper
+from database import local_store
+from services.google_sheet_service import GoogleSheetService
+
+class SyncService:
+    """
+    Incremental sync of the items sheet with the local store and the database
+    """
+    # rows before the watermark re-read on each incremental sync (recent hand edits)
+    DEFAULT_WINDOW = 200
+
+    def __init__(self, store, conn=None, lock=None, spreadsheet_id=None, db_scope=None):
+        """
+        Initializes the sync service
+        Args:
+            store (LocalStore): The local store holding the watermark and the row hashes
+            conn (DatabaseInterface, optional): The database connection
+            lock (threading.Lock, optional): Lock shared with the journal flusher
+            spreadsheet_id (str, optional): The spreadsheet (tenant), defaults to the SPREADSHEET_ID env var
+            db_scope (str, optional): The tenant_id of the database rows, None in single user mode
+        """
+        self.store = store
+        self.conn = conn
+        self.lock = lock
+        self.spreadsheet_id = spreadsheet_id
+        self.db_scope = db_scope
+
+    def run(self, full=False):
+        """
+        Fetches the new or changed sheet rows and applies the minimal delta
+        Args:
+            full (bool): Re-read the whole sheet instead of the window before the watermark
+        Returns:
+            dict: The number of inserted, updated and deleted rows
+        """
+        if self.lock is None:
+            return self._run(full)
+        # appended rows get their hash from the flusher: never sync in between
+        with self.lock:
+            return self._run(full)
+
+    def _run(self, full):
+        watermark = int(self.store.get_meta('sync_watermark') or 1)
+        window = helper.config('general.sync.window') or self.DEFAULT_WINDOW
+        # header is row 1
+        start = 2 if full else max(2, watermark - window + 1)
+
+        rows = GoogleSheetService('add_transaction', spreadsheet_id=self.spreadsheet_id).read_from(start)
+        stored = self.store.sheet_hashes(start)
+
+        inserts, updates, deletes = [], [], []
+        for offset, row in enumerate(rows):
+            sheet_row = start + offset
+            values = local_store.sheet_row_values(row, sheet_row)
+            if values is None:
+                if sheet_row in stored:
+                    deletes.append(sheet_row)
+                continue
+            if sheet_row not in stored:
+                inserts.append(values)
+            elif stored[sheet_row] != local_store.row_hash(values):
+                updates.append(values)
+        # rows past the end of the sheet were removed
+        last_row = start + len(rows) - 1
+        deletes += [sheet_row for sheet_row in stored if sheet_row > last_row]
+        # appended bot rows whose position was never known are not new rows
+        inserts, claims = self.claim(inserts)
+
+        if inserts or updates or deletes or claims:
+            # remote first: a failure leaves the local baseline untouched and the next run retries
+            if self.conn is not None and helper.config('general.db.status'):
+                self.apply_remote(inserts, updates, deletes, claims)
+            self.store.assign_sheet_rows(claims)
+            self.store.apply_sheet_delta(inserts + updates, deletes, max(last_row, start - 1))
+        else:
+            self.store.set_meta('sync_watermark', max(last_row, start - 1))
+
+        return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+    def claim(self, inserts):
+        """
+        Matches the new sheet rows with the mirrored bot transactions that have no sheet row yet
+        Args:
+            inserts (list): The values of the new rows
+        Returns:
+            Tuple[list, list]: The rows that are really new and the (journal_key, sheet_row, hash) claims
+        """
+        unassigned = self.store.unassigned_rows() if inserts else {}
+        remaining, claims = [], []
+        for values in inserts:
+            hash = local_store.row_hash(values)
+            if unassigned.get(hash):
+                claims.append((unassigned[hash].pop(0), values['sheet_row'], hash))
+            else:
+                remaining.append(values)
+        return remaining, claims
+
+    def apply_remote(self, inserts, updates, deletes, claims=()):
+        """
+        Applies the sheet delta to the database, keyed on transactions.sheet_row
+        Args:
+            inserts (list): The values of the new rows
+            updates (list): The values of the changed rows
+            deletes (list): The removed sheet rows
+            claims (list): (journal_key, sheet_row, hash) of the bot rows found in the sheet
+        """
+        # tenants share the database: every match is scoped, the default tenant owns the rows without tenant_id
+        scope = {'tenant_id': self.db_scope}
+        for sheet_row in deletes:
+            self.conn.delete('transactions', {'sheet_row': sheet_row, **scope})
+        # the bot row is already in the database under its journal key
+        for journal_key, sheet_row, _ in claims:
+            self.conn.update('transactions', {'sheet_row': sheet_row}, {'journal_key': journal_key, **scope})
+        missing = []
+        for values in updates:
+            if values['amount'] is None:
+                continue
+            # rows written before sheet_row existed are not in the database under their row: insert them
+            if not affected(self.conn.update('transactions', remote_values(values), {'sheet_row': values['sheet_row'], **scope})):
+                missing.append(values)
+        # amount is mandatory in the database: incomplete rows stay local until fixed in the sheet
+        # the default tenant writes its rows without tenant_id, like the journal flusher
+        owner = {} if self.db_scope is None else scope
+        rows = [{**remote_values(values), **owner} for values in inserts + missing if values['amount'] is not None]
+        if rows:
+            self.conn.bulk_insert('transactions', rows)
+
+# database values of a sheet row (same normalization as helper.transaction_values)
+def remote_values(values: dict) -> dict:
+    return {
+        'category': values['category'].lower(),
+        'amount': values['amount'],
+        'payment_method': values['payment_method'].lower(),
+        'note': values['note'].lower(),
+        'paid_at': values['paid_at'],
+        'sheet_row': values['sheet_row']
+    }
+
+# number of rows touched by an update (row count or PostgREST response)
+def affected(result) -> int:
+    if isinstance(result, int):
+        return result
+    return len(getattr(result, 'data', None) or [])
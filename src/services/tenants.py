@@ -0,0 +1,332 @@
+import os
+import json
+import threading
+import contextlib
+import concurrent.futures
+import asyncio
+import helper
+import executor
+from collections import OrderedDict
+from database.journal import Journal
+from database.local_store import LocalStore
+from services.google_sheet_service import GoogleSheetService
+from services.intent_router import IntentRouter
+from services.local_parser import LocalParser
+from services.reference_data import ReferenceData
+from services.balance_cache import BalanceCache
+from services.write_behind import WriteBehind
+from services.sync_service import SyncService
+
+# tenants kept open when general.tenants.max_active is not set
+DEFAULT_MAX_ACTIVE = 200
+# requests of one tenant processed at the same time when general.tenants.max_concurrent is not set
+DEFAULT_MAX_CONCURRENT = 2
+
+# lang => (translations, router), shared by the tenants speaking it
+_languages = {}
+_languages_lock = threading.Lock()
+
+# return the translations and pre-router of a language (loaded once)
+def language(lang: str) -> tuple:
+    loaded = _languages.get(lang)
+    if loaded is None:
+        with _languages_lock:
+            loaded = _languages.get(lang)
+            if loaded is None:
+                translations = helper.load_translations(lang)
+                loaded = _languages[lang] = (translations, IntentRouter(translations))
+    return loaded
+
+class Tenant:
+    """
+    A Telegram user with its own spreadsheet, language, lists, journal, local store and work queue
+    """
+    def __init__(self, user_id, options=None, conn=None, default=False):
+        """
+        Opens the tenant resources
+        Args:
+            user_id (str): The Telegram user id
+            options (dict, optional): The registry entry (spreadsheet_id, lang, categories, payment_methods, db_scope, db, admin)
+            conn (DatabaseInterface, optional): The shared database connection
+            default (bool): The TELEGRAM_USER_ID tenant, served by SPREADSHEET_ID, settings.json and the shared write-behind queue and caches
+        """
+        options = dict(options or {})
+        self.user_id = str(user_id)
+        self.default = default
+        self.admin = bool(options.get('admin'))
+        self.spreadsheet_id = os.getenv('SPREADSHEET_ID') if default else options.get('spreadsheet_id')
+        # a false "db" keeps the tenant out of the shared database
+        self.conn = conn if options.get('db', True) else None
+
+        if default:
+            # single user mode: rows without tenant_id, settings.json lists and lang
+            self.db_scope = None
+            self.lang = helper.config('general.lang')
+            self.reference_data = ReferenceData.get()
+            self.balance_cache = BalanceCache.get()
+            self.write_behind = WriteBehind.get() or WriteBehind.configure(self.conn, helper.connect_store())
+            self.store = self.write_behind.store
+        else:
+            self.db_scope = str(options.get('db_scope') or self.user_id)
+            self.lang = options.get('lang') or helper.config('general.lang')
+            self.reference_data = ReferenceData(self.spreadsheet_id, {kind: options[kind] for kind in ReferenceData.KINDS if options.get(kind)})
+            self.balance_cache = BalanceCache(self.spreadsheet_id)
+            directory = os.path.join(helper.project_path(helper.config('general.tenants.data_path')), self.user_id)
+            os.makedirs(directory, exist_ok=True)
+            self.store = LocalStore(os.path.join(directory, 'store.db')) if helper.config('general.local_store.status') else None
+            self.write_behind = WriteBehind(Journal(os.path.join(directory, 'journal.db')), self.conn, self.store, self.spreadsheet_id, self.balance_cache, self.db_scope)
+
+        # the journal flusher lock also keeps the sync away from appends
+        self.sync_service = SyncService(self.store, self.conn, None, self.spreadsheet_id, self.db_scope) if self.store is not None else None
+        # one heavy tenant cannot take every worker
+        self.queue = asyncio.Semaphore(helper.config('general.tenants.max_concurrent') or DEFAULT_MAX_CONCURRENT)
+        self.in_flight = 0
+        # background jobs of this tenant still running (one run per job at a time)
+        self.running = set()
+        self.load_language(self.lang)
+
+    def load_language(self, lang):
+        """
+        Loads the translations, pre-router and parser of a language
+        Args:
+            lang (str): The language code
+        """
+        self.lang = lang
+        self.trans, self.router = language(lang)
+        self.parser = LocalParser(self.trans, self.reference_data)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Waits for a free slot in the tenant queue (busy tenants are never evicted)
+        """
+        self.in_flight += 1
+        try:
+            async with self.queue:
+                yield
+        finally:
+            self.in_flight -= 1
+
+    async def job(self, name, backend, func):
+        """
+        Runs a background job of the tenant on a backend pool, skipped while its previous run is still going
+        Args:
+            name (str): The job name
+            backend (str): The executor pool
+            func (callable): The blocking job
+        Returns:
+            Any: The job result, None if skipped
+        """
+        # a slow tenant holds at most one worker per job, the other tenants keep their turn
+        if name in self.running:
+            return None
+        self.running.add(name)
+        self.in_flight += 1
+        try:
+            return await executor.run(backend, func)
+        finally:
+            self.in_flight -= 1
+            self.running.discard(name)
+
+    def backfill(self):
+        """
+        Mirrors the items sheet in the local store once
+        """
+        if self.store is None or self.store.is_backfilled():
+            return
+        try:
+            # appends in between would be read twice or lost: hold the flusher
+            with self.write_behind.flush_lock:
+                rows = GoogleSheetService('add_transaction', spreadsheet_id=self.spreadsheet_id).read()
+                print(f"Local store of {self.user_id} backfilled with {self.store.backfill(rows)} rows")
+        except Exception as e:
+            print(f"Local store backfill of {self.user_id} failed: {e}")
+
+    def sync(self, full=False):
+        """
+        Syncs the hand edits of the items sheet
+        Args:
+            full (bool): Re-read the whole sheet
+        Returns:
+            dict: The sync delta, None if the tenant has no backfilled store or is closed
+        """
+        if self.sync_service is None:
+            return None
+        # appended rows get their hash from the flusher: never sync in between
+        with self.write_behind.flush_lock:
+            if self.write_behind.closed or not self.store.is_backfilled():
+                return None
+            return self.sync_service.run(full)
+
+    def close(self):
+        """
+        Delivers the pending writes and releases the journal and the local store
+        """
+        self.write_behind.close()
+        if self.store is not None:
+            with self.write_behind.flush_lock:
+                self.store.close()
+
+class TenantRegistry:
+    """
+    Telegram user id => tenant settings (general.tenants.registry), with a bounded LRU of open tenants
+    """
+    # shared instance
+    _instance = None
+
+    def __init__(self, conn=None, path=None):
+        """
+        Loads the registry
+        Args:
+            conn (DatabaseInterface, optional): The shared database connection
+            path (str, optional): The registry file, defaults to general.tenants.registry
+        """
+        self.conn = conn
+        self.path = path or helper.project_path(helper.config('general.tenants.registry')) or None
+        self.max_active = helper.config('general.tenants.max_active') or DEFAULT_MAX_ACTIVE
+        self.default_user_id = os.getenv('TELEGRAM_USER_ID')
+        self.options = self.load()
+        # user id => Tenant, least recently used first
+        self.active = OrderedDict()
+        # user id => close of an evicted tenant (at most one per registered user)
+        self.closing = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, conn=None):
+        """
+        Creates the shared registry
+        Args:
+            conn (DatabaseInterface, optional): The shared database connection
+        Returns:
+            TenantRegistry: The shared registry
+        """
+        cls._instance = cls(conn)
+        return cls._instance
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared registry
+        Returns:
+            TenantRegistry: The shared registry
+        """
+        return cls._instance
+
+    def load(self):
+        """
+        Reads the registry file, the TELEGRAM_USER_ID user is always a tenant
+        Returns:
+            dict: user id => options
+        """
+        options = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                options = {str(user_id): dict(values) for user_id, values in json.load(f).items()}
+        for user_id, values in list(options.items()):
+            # never fall back on the owner's spreadsheet
+            if user_id != self.default_user_id and not values.get('spreadsheet_id'):
+                print(f"Tenant {user_id} has no spreadsheet_id, skipped")
+                del options[user_id]
+        if self.default_user_id and self.default_user_id not in options:
+            options[self.default_user_id] = {}
+        return options
+
+    def active_tenant(self, user_id):
+        """
+        Returns the tenant of a Telegram user if it is already open (no I/O, safe on the event loop)
+        Args:
+            user_id (int|str): The Telegram user id
+        Returns:
+            Tenant: The open tenant, None if it must be opened with tenant()
+        """
+        key = str(user_id)
+        with self._lock:
+            tenant = self.active.get(key)
+            if tenant is not None:
+                self.active.move_to_end(key)
+            return tenant
+
+    def tenant(self, user_id):
+        """
+        Returns the tenant of a Telegram user, opening it if needed (journal, local store: run it off the event loop)
+        Args:
+            user_id (int|str): The Telegram user id
+        Returns:
+            Tenant: The tenant, None if the user is not registered
+        """
+        key = str(user_id)
+        while True:
+            with self._lock:
+                tenant = self.active.get(key)
+                if tenant is not None:
+                    self.active.move_to_end(key)
+                    return tenant
+                options = self.options.get(key)
+                if options is None:
+                    return None
+                # an evicted tenant flushes its journal on close: a second instance on the same files would append the same rows
+                closing = self.closing.get(key)
+                if closing is None or closing.done():
+                    self.closing.pop(key, None)
+                    tenant = self.active[key] = Tenant(key, options, self.conn, key == self.default_user_id)
+                    # close the least recently used idle tenants past max_active
+                    for candidate in list(self.active.values()):
+                        if len(self.active) <= self.max_active:
+                            break
+                        if candidate.default or candidate is tenant or candidate.in_flight:
+                            continue
+                        self.active.pop(candidate.user_id)
+                        self.closing[candidate.user_id] = executor.pool('journal').submit(candidate.close)
+                    break
+            # reopen once closed
+            concurrent.futures.wait([closing])
+        # load the sheet history in the local store once
+        if tenant.store is not None and not tenant.store.is_backfilled():
+            executor.pool('google_sheet').submit(tenant.backfill)
+        return tenant
+
+    def tenants(self):
+        """
+        Returns the open tenants
+        Returns:
+            list: The open tenants
+        """
+        with self._lock:
+            return list(self.active.values())
+
+    def preload(self):
+        """
+        Opens the registered tenants (up to max_active), so journaled writes left behind are delivered
+        """
+        user_ids = list(self.options)
+        # the default tenant first: it is never evicted
+        if self.default_user_id in self.options:
+            user_ids.remove(self.default_user_id)
+            user_ids.insert(0, self.default_user_id)
+        for user_id in user_ids[:self.max_active]:
+            self.tenant(user_id)
+
+    def update(self, user_id, values):
+        """
+        Updates and persists the settings of a tenant
+        Args:
+            user_id (int|str): The Telegram user id
+            values (dict): The changed options (lang, categories, payment_methods)
+        """
+        key = str(user_id)
+        with self._lock:
+            self.options.setdefault(key, {}).update(values)
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # the implicit TELEGRAM_USER_ID entry is not written back
+                helper.write_json(self.path, {user: options for user, options in self.options.items() if options or user != self.default_user_id})
+
+    def close(self):
+        """
+        Closes every open tenant
+        """
+        with self._lock:
+            tenants, self.active = list(self.active.values()), OrderedDict()
+        for tenant in tenants:
+            tenant.close()
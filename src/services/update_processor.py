@@ -0,0 +1,50 @@
+import asyncio
+from typing import Awaitable
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently (up to max_concurrent_updates) while keeping each chat in order
+    """
+    def __init__(self, max_concurrent_updates):
+        """
+        Initializes the processor
+        Args:
+            max_concurrent_updates (int): The maximum number of updates processed at once
+        """
+        super().__init__(max_concurrent_updates)
+        # chat id => [lock, updates holding or waiting for it]
+        self.chat_locks = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        """
+        Waits for the previous updates of the same chat, then takes a worker slot
+        Args:
+            update (object): The update
+            coroutine (Awaitable): The handlers coroutine
+        """
+        chat_id = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+        # asyncio.Lock is FIFO and updates reach it in arrival order: chat order is kept
+        entry = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # lock before the worker slot so a busy chat never holds slots while waiting
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.chat_locks[chat_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
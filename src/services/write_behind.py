@@ -0,0 +1,295 @@
+import threading
+import helper
+import executor
+import metrics
+from database import local_store
+from database.journal import Journal
+from services.google_sheet_service import GoogleSheetService
+from services.balance_cache import BalanceCache
+
+class WriteBehind:
+    """
+    Commits parsed transactions to the local journal and drains it to Google Sheets and the database
+    """
+    # shared instance
+    _instance = None
+
+    def __init__(self, journal, conn=None, store=None, spreadsheet_id=None, balance_cache=None, db_scope=None):
+        """
+        Initializes the write-behind queue
+        Args:
+            journal (Journal): The durable journal
+            conn (DatabaseInterface, optional): The database connection, None if the db is disabled
+            store (LocalStore, optional): The local read model, None if disabled
+            spreadsheet_id (str, optional): The spreadsheet (tenant), defaults to the SPREADSHEET_ID env var
+            balance_cache (BalanceCache, optional): The balance snapshot to invalidate, defaults to the shared one
+            db_scope (str, optional): The tenant_id written with every database row, None in single user mode
+        """
+        self.journal = journal
+        self.conn = conn
+        self.store = store
+        self.spreadsheet_id = spreadsheet_id
+        self.balance_cache = balance_cache
+        self.db_scope = db_scope
+        # one flush (or sheet sync) at a time
+        self.flush_lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    def configure(cls, conn=None, store=None):
+        """
+        Creates the shared write-behind queue
+        Args:
+            conn (DatabaseInterface, optional): The database connection
+            store (LocalStore, optional): The local read model
+        Returns:
+            WriteBehind: The shared queue
+        """
+        cls._instance = cls(Journal(helper.project_path(helper.config('general.journal.path'))), conn, store)
+        return cls._instance
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the shared write-behind queue
+        Returns:
+            WriteBehind: The shared queue
+        """
+        return cls._instance
+
+    def record(self, response, message, route, transactions):
+        """
+        Durably commits an OpenAI response and its transactions
+        Args:
+            response (ChatCompletion): The OpenAI response
+            message (str): The user's request
+            route (str): The chosen route
+            transactions (list): The sanitized transactions
+        """
+        db_done = self.conn is None or not helper.config('general.db.status')
+        entries = [{
+            'idempotency_key': f"openai:{response.id}",
+            'kind': 'openai_response',
+            'payload': helper.openai_response_values(response, message, route),
+            'sheet_done': True,
+            'db_done': db_done
+        }]
+        for index, transaction in enumerate(transactions):
+            entries.append({
+                'idempotency_key': f"transaction:{response.id}:{index}",
+                'kind': 'transaction',
+                'payload': {'transaction': transaction, 'chat_id': response.id},
+                'db_done': db_done
+            })
+        self.journal.append(entries)
+        # mirror on the local read model right away
+        if self.store is not None:
+            self.store.insert_many([
+                ('openai_responses', [entries[0]['payload']]),
+                ('transactions', [
+                    {**local_store.transaction_values(transaction, response.id), 'journal_key': entry['idempotency_key']}
+                    for transaction, entry in zip(transactions, entries[1:])
+                ])
+            ])
+
+    def flush(self):
+        """
+        Drains the journal to Google Sheets and the database
+        """
+        with self.flush_lock:
+            if self.closed:
+                return
+            self.flush_sheet()
+            self.flush_db()
+
+    def close(self):
+        """
+        Drains the journal one last time and closes it (later flushes are no-ops)
+        """
+        with self.flush_lock:
+            if self.closed:
+                return
+            self.flush_sheet()
+            self.flush_db()
+            self.closed = True
+            self.journal.close()
+
+    def flush_in_background(self):
+        """
+        Schedules a flush on the journal pool
+        """
+        executor.pool('journal').submit(self.flush)
+
+    def flush_sheet(self):
+        """
+        Appends the pending transactions to Google Sheets, one request per batch
+        """
+        # one append carries thousands of rows: imported statements take a few requests of the write quota
+        batch_size = helper.config('general.journal.sheet_batch_size') or helper.config('general.journal.batch_size') or 100
+        while True:
+            entries = self.journal.pending('sheet', batch_size)
+            if not entries:
+                return
+            # a malformed transaction (null date, text amount) never becomes valid: park it, append the rest
+            dead = {}
+            for entry in entries:
+                try:
+                    helper.normalize_transaction(entry['payload']['transaction'])
+                except ValueError as e:
+                    print(f"Journal entry {entry['idempotency_key']} cannot be delivered to Google Sheets: {e}")
+                    dead[entry['id']] = e
+            if dead:
+                self.journal.mark_dead(dead, 'sheet')
+                # the database waits for the sheet row: it would never get the entry either
+                self.journal.mark_dead(dead, 'db')
+                entries = [entry for entry in entries if entry['id'] not in dead]
+                if not entries:
+                    continue
+            ids = [entry['id'] for entry in entries]
+            try:
+                g_sheet_service = GoogleSheetService('add_transaction', spreadsheet_id=self.spreadsheet_id)
+                response = g_sheet_service.add_transactions([entry['payload']['transaction'] for entry in entries])
+            except Exception as e:
+                # a server error may come after the rows were written: appending them again would duplicate them
+                if (getattr(getattr(e, 'resp', None), 'status', None) or 0) >= 500 and self.written(entries):
+                    continue
+                print(f"Sheet flush failed, retrying later: {e}")
+                self.journal.mark_failed(ids, e, helper.config('general.journal.retry_base') or 2, helper.config('general.journal.retry_max') or 600)
+                return
+            first_row = GoogleSheetService.first_updated_row(response)
+            if first_row is None:
+                # the rows are written: never append them again, find where they landed
+                try:
+                    first_row = self.locate_appended(entries)
+                except Exception as e:
+                    print(f"Appended rows could not be located, the sync will match them: {e}")
+            self.assign_sheet_rows(entries, first_row)
+            self.journal.mark_done(ids, 'sheet')
+            # the dashboard changed
+            (self.balance_cache or BalanceCache.get()).invalidate()
+
+    def written(self, entries):
+        """
+        Checks whether a failed append was applied anyway, completing the entries if so
+        Args:
+            entries (list): The appended journal entries, in append order
+        Returns:
+            bool: True if the rows are the last ones of the sheet and the entries were marked done
+        """
+        try:
+            first_row = self.locate_appended(entries, at_end=True)
+        except Exception as e:
+            print(f"Failed append could not be checked: {e}")
+            return False
+        if first_row is None:
+            return False
+        self.assign_sheet_rows(entries, first_row)
+        self.journal.mark_done([entry['id'] for entry in entries], 'sheet')
+        (self.balance_cache or BalanceCache.get()).invalidate()
+        return True
+
+    def locate_appended(self, entries, at_end=False):
+        """
+        Finds the rows written by an append whose response has no updated range
+        Args:
+            entries (list): The appended journal entries, in append order
+            at_end (bool): Only match the rows at the end of the sheet
+        Returns:
+            int: The first written row, None if the rows are not found
+        """
+        hashes = [local_store.row_hash(local_store.transaction_values(entry['payload']['transaction'])) for entry in entries]
+        # appended rows come after the synced ones (header is row 1)
+        start = 2
+        if self.store is not None:
+            start = max(2, int(self.store.get_meta('sync_watermark') or 1) - (helper.config('general.sync.window') or 200) + 1)
+        rows = GoogleSheetService('add_transaction', spreadsheet_id=self.spreadsheet_id).read_from(start)
+        sheet_hashes = []
+        for row in rows:
+            values = local_store.sheet_row_values(row)
+            sheet_hashes.append(local_store.row_hash(values) if values else None)
+        # the append is the last run of matching rows
+        for offset in range(len(rows) - len(hashes), -1, -1):
+            if sheet_hashes[offset:offset + len(hashes)] == hashes:
+                return start + offset
+            if at_end:
+                break
+        return None
+
+    def assign_sheet_rows(self, entries, first_row):
+        """
+        Records the sheet row of appended transactions (journal payload and local store sync baseline)
+        Args:
+            entries (list): The appended journal entries, in append order
+            first_row (int): The first row written by the append
+        """
+        if first_row is None:
+            return
+        payloads = {}
+        assignments = []
+        for offset, entry in enumerate(entries):
+            payload = {**entry['payload'], 'sheet_row': first_row + offset}
+            payloads[entry['id']] = payload
+            assignments.append((entry['idempotency_key'], payload['sheet_row'], local_store.row_hash(local_store.transaction_values(payload['transaction']))))
+        self.journal.update_payloads(payloads)
+        if self.store is not None:
+            self.store.assign_sheet_rows(assignments)
+
+    def db_row(self, entry):
+        """
+        Builds the database row of a journal entry
+        Args:
+            entry (dict): The journal entry
+        Returns:
+            Tuple[str, dict]: The table name and the row values
+        """
+        if entry['kind'] == 'openai_response':
+            table_name, values = 'openai_responses', entry['payload']
+        else:
+            table_name, values = 'transactions', helper.transaction_values(entry['payload']['transaction'], entry['payload']['chat_id'], entry['payload'].get('sheet_row'))
+            # the journal key makes retried inserts idempotent (unique transactions.journal_key)
+            values['journal_key'] = entry['idempotency_key']
+        # rows of the tenant's scope in a shared database
+        if self.db_scope is not None:
+            values = {**values, 'tenant_id': self.db_scope}
+        return table_name, values
+
+    def flush_db(self):
+        """
+        Inserts the pending rows in the database, in journal order, with one insert_many per batch
+        """
+        if self.conn is None:
+            return
+        batch_size = helper.config('general.journal.batch_size') or 100
+        while True:
+            entries = self.journal.pending('db', batch_size)
+            if not entries:
+                return
+            # group consecutive entries per table, keeping the journal order
+            batches = []
+            ids = []
+            dead = {}
+            for entry in entries:
+                try:
+                    table_name, values = self.db_row(entry)
+                except Exception as e:
+                    # a malformed entry (no category, bad date) never becomes valid: park it, deliver the rest
+                    print(f"Journal entry {entry['idempotency_key']} cannot be delivered to the database: {e}")
+                    dead[entry['id']] = e
+                    continue
+                ids.append(entry['id'])
+                if batches and batches[-1][0] == table_name:
+                    batches[-1][1].append(values)
+                else:
+                    batches.append((table_name, [values]))
+            self.journal.mark_dead(dead, 'db')
+            if not batches:
+                continue
+            try:
+                # one round trip per table instead of one per row
+                with metrics.span('db.insert_many'):
+                    self.conn.insert_many(batches)
+            except Exception as e:
+                print(f"Database flush failed, retrying later: {e}")
+                self.journal.mark_failed(ids, e, helper.config('general.journal.retry_base') or 2, helper.config('general.journal.retry_max') or 600)
+                return
+            self.journal.mark_done(ids, 'db')